@@ -0,0 +1,145 @@
+"""
+Common-shingle suppression: posting lists, lookup and matching time, and how
+much of the reported similarity is shared template text.
+
+    python -m benchmarks.bench_common_shingles --docs 500 --words 1500 --max-df 0 10 50
+
+Every document answers one of a few assignments: it starts with that
+assignment's question text and ends with citations drawn from a shared
+reference list. A share of the documents also copies passages of the upload's
+own answer. Max DF 0 keeps every shingle. After the check, --removals
+documents are removed one by one, as a corpus sync does when files disappear.
+
+    postings      shingle index rows, longest  the longest posting list
+    innocent      documents reported that copied nothing from the upload
+    copied %      mean similarity reported for the copying documents
+    template %    mean similarity reported for the others
+    remove ms     mean time to remove one document from the index
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import plagiarize, synthetic_text, vocabulary
+
+N = 5
+
+
+def build_corpus(num_docs, num_words, assignments, plagiarism_rate, seed):
+    """(upload, {name: text}, set of copying document names)."""
+    rng = random.Random(seed)
+    words = vocabulary()
+    questions = [synthetic_text(200, rng, words) for _ in range(assignments)]
+    references = [synthetic_text(15, rng, words) for _ in range(40)]
+
+    def document(body):
+        citations = " ".join(rng.sample(references, 5))
+        return f"{rng.choice(questions)} {body} {citations}"
+
+    answer = synthetic_text(num_words, rng, words)
+    upload = f"{questions[0]} {answer} {' '.join(rng.sample(references, 5))}"
+    corpus, copying = {}, set()
+    for i in range(num_docs):
+        name = f"doc{i:05d}.docx"
+        if rng.random() < plagiarism_rate:
+            corpus[name] = document(plagiarize(answer, num_words, rng.uniform(0.05, 0.5), rng, words=words))
+            copying.add(name)
+        else:
+            corpus[name] = document(synthetic_text(num_words, rng, words))
+    return upload, corpus, copying
+
+
+def run(main, max_df, upload, corpus, copying, workdir, removals):
+    from shingle_index import ShingleIndex
+    from shingles import text_shingles
+    from text_cache import text_sha256
+    from token_store import TokenStore
+
+    store = TokenStore(os.path.join(workdir, f"store-df{max_df}"))
+    index = ShingleIndex(os.path.join(workdir, f"index-df{max_df}.db"), n=N, max_df=max_df, token_store=store)
+    started = time.perf_counter()
+    arrays = {}
+    with store.batch():
+        for name, text in corpus.items():
+            index.add_document(name, name, text)
+            _, hashes = text_shingles(text, N)
+            store.add_document(name, name, text_sha256(text), hashes)
+            arrays[name] = np.asarray(hashes, dtype=np.uint64)
+    ingest = time.perf_counter() - started
+    conn = index._conn()
+    postings = conn.execute("SELECT COUNT(*) FROM postings").fetchone()[0]
+    longest = conn.execute(
+        "SELECT COALESCE(MAX(c), 0) FROM (SELECT COUNT(*) AS c FROM postings GROUP BY shingle)"
+    ).fetchone()[0]
+
+    main.shingle_index = index
+    source = main.prepare_source(upload)
+    started = time.perf_counter()
+    candidates = index.candidates(main.index_keys(source))
+    lookup = time.perf_counter() - started
+
+    started = time.perf_counter()
+    reported = {}
+    for name in candidates:
+        result = main.phrase_match(name, source, arrays[name])
+        if result is not None:
+            reported[name] = result[0]['similarity_percentage']
+    compare = time.perf_counter() - started
+
+    removed = sorted(corpus)[:removals]
+    started = time.perf_counter()
+    for name in removed:
+        index.remove_document(name)
+        store.remove_document(name)
+    remove = time.perf_counter() - started
+
+    copied = [reported[name] for name in copying if name in reported]
+    template = [pct for name, pct in reported.items() if name not in copying]
+    return {
+        'postings': postings,
+        'longest': longest,
+        'ingest_s': ingest,
+        'lookup_ms': lookup * 1000,
+        'candidates': len(candidates),
+        'compare_ms': compare * 1000,
+        'recall': len(copied) / len(copying) if copying else 1.0,
+        'innocent': len(template),
+        'copied_pct': sum(copied) / len(copied) if copied else 0,
+        'template_pct': sum(template) / len(template) if template else 0,
+        'remove_ms': remove * 1000 / len(removed) if removed else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=500)
+    parser.add_argument('--words', type=int, default=1500)
+    parser.add_argument('--assignments', type=int, default=3)
+    parser.add_argument('--plagiarism-rate', type=float, default=0.1)
+    parser.add_argument('--max-df', type=int, nargs='+', default=[0, 10, 50])
+    parser.add_argument('--removals', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    upload, corpus, copying = build_corpus(args.docs, args.words, args.assignments,
+                                           args.plagiarism_rate, args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        # main creates its working directories on import
+        os.chdir(workdir)
+        import main as app
+
+        print(f"{'max df':>6} {'postings':>9} {'longest':>7} {'ingest s':>8} {'lookup ms':>9} {'candidates':>10} "
+              f"{'compare ms':>10} {'recall':>6} {'innocent':>8} {'copied %':>8} {'template %':>10} {'remove ms':>9}")
+        for max_df in args.max_df:
+            r = run(app, max_df, upload, corpus, copying, workdir, args.removals)
+            print(f"{max_df:>6} {r['postings']:>9} {r['longest']:>7} {r['ingest_s']:>8.2f} {r['lookup_ms']:>9.1f} "
+                  f"{r['candidates']:>10} {r['compare_ms']:>10.1f} {r['recall']:>6.1%} {r['innocent']:>8} "
+                  f"{r['copied_pct']:>8.2f} {r['template_pct']:>10.2f} {r['remove_ms']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
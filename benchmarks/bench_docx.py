@@ -0,0 +1,95 @@
+"""
+DOCX extraction throughput and peak memory: streaming document.xml vs python-docx.
+
+    python -m benchmarks.bench_docx --paragraphs 20000 --words 40
+
+Each extractor runs in a fresh process on the same generated document, so the
+peak RSS it reports is its own.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('stream', 'python-docx')
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_document(path, num_paragraphs, words_per_paragraph):
+    from docx import Document
+    from benchmarks.synthetic import synthetic_text
+
+    rng = random.Random(0)
+    doc = Document()
+    for i in range(num_paragraphs):
+        paragraph = doc.add_paragraph(synthetic_text(words_per_paragraph // 2, rng))
+        paragraph.add_run(' ' + synthetic_text(words_per_paragraph - words_per_paragraph // 2, rng)).bold = True
+        if i % 500 == 0:
+            table = doc.add_table(rows=4, cols=4)
+            for cell in table._cells:
+                cell.text = synthetic_text(5, rng)
+    doc.save(path)
+
+
+def child(mode, path):
+    """Extract path in this process and print a JSON result line."""
+    sys.path.insert(0, REPO_ROOT)
+    from docx_extract import extract_docx_text
+    import main
+
+    extract = extract_docx_text if mode == 'stream' else main.extract_text_from_docx_document
+    before = max_rss_mb()
+    start = time.perf_counter()
+    text = extract(path)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'mode': mode,
+        'seconds': round(elapsed, 3),
+        'peak_rss_added_mb': round(max_rss_mb() - before, 1),
+        'chars': len(text),
+        'digest': hash(text),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--paragraphs', type=int, default=20000)
+    parser.add_argument('--words', type=int, default=40)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'large.docx')
+        make_document(path, args.paragraphs, args.words)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print(f"{args.paragraphs} paragraphs, {size_mb:.1f} MB")
+        print(f"{'mode':>12} {'time (s)':>9} {'MB/s':>7} {'peak RSS added (MB)':>20} {'same':>5}")
+        results = []
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_docx', '--child', mode, path],
+                cwd=tmp, env=dict(os.environ, PYTHONPATH=REPO_ROOT, PYTHONHASHSEED='0', JOB_WORKERS='0'),
+                capture_output=True, text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        for result in results:
+            same = result['digest'] == results[-1]['digest']
+            print(f"{result['mode']:>12} {result['seconds']:>9} {size_mb / result['seconds']:>7.1f} "
+                  f"{result['peak_rss_added_mb']:>20} {str(same):>5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+PDF text extraction throughput (pages/sec) per engine and page-worker count.
+
+    python -m benchmarks.bench_extraction --docs 20 --pages 40 --workers 0 4
+    python -m benchmarks.bench_extraction --dir path/to/pdfs
+
+Without --dir a fixture set of synthetic PDFs is generated with fpdf. Engines
+that are not installed are skipped. The 'same' column tells whether the text
+equals the serial pypdf2 extraction.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from fpdf import FPDF
+
+from benchmarks.synthetic import synthetic_text
+from pdf_extract import available_engines, extract_pdf_text, open_pdf
+
+WORDS_PER_PAGE = 450
+
+
+def make_fixtures(directory, num_docs, num_pages, seed=0):
+    rng = random.Random(seed)
+    paths = []
+    for i in range(num_docs):
+        pdf = FPDF()
+        pdf.set_font("Arial", size=10)
+        for _ in range(num_pages):
+            pdf.add_page()
+            pdf.multi_cell(0, 5, synthetic_text(WORDS_PER_PAGE, rng))
+        path = os.path.join(directory, f"fixture{i:03d}.pdf")
+        pdf.output(path)
+        paths.append(path)
+    return paths
+
+
+def page_count(path):
+    count, _, close = open_pdf(path, 'pypdf2')
+    if close:
+        close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dir', help='benchmark the PDFs in this directory instead of fixtures')
+    parser.add_argument('--docs', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=40)
+    parser.add_argument('--engines', nargs='+', default=available_engines())
+    parser.add_argument('--workers', nargs='+', type=int, default=[0, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.dir:
+            paths = sorted(os.path.join(args.dir, name) for name in os.listdir(args.dir)
+                           if name.lower().endswith('.pdf'))
+        else:
+            paths = make_fixtures(tmp, args.docs, args.pages)
+        pages = sum(page_count(path) for path in paths)
+        print(f"{len(paths)} PDFs, {pages} pages")
+
+        reference = {path: extract_pdf_text(path, 'pypdf2', workers=0) for path in paths}
+        print(f"{'engine':>10} {'workers':>8} {'time (s)':>9} {'pages/sec':>10} {'same':>5}")
+        for engine in args.engines:
+            for workers in args.workers:
+                start = time.perf_counter()
+                texts = {path: extract_pdf_text(path, engine, workers=workers) for path in paths}
+                elapsed = time.perf_counter() - start
+                same = texts == reference
+                print(f"{engine:>10} {workers:>8} {elapsed:>9.2f} {pages / elapsed:>10.1f} {str(same):>5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Recall vs latency of the MinHash/LSH and TF-IDF candidate prefilters against
+the exhaustive scan that runs find_matching_phrases on every corpus document.
+
+    python -m benchmarks.bench_lsh --docs 2000 --words 800 --configs 64x1 64x2 32x4 tfidf
+
+A document counts as a true source when the exhaustive scan reports it, i.e.
+it shares 5-word phrases amounting to more than 2% similarity.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import synthetic_corpus
+from main import match_shingles, SHINGLE_SIZE
+from minhash_lsh import MinHashLSH
+from shingles import text_shingles
+from tfidf_index import TfidfIndex
+
+
+def scan(source, docs, names):
+    """Run the phrase matcher over names and return the ones reported as matches."""
+    found = set()
+    for name in names:
+        words, hashes = docs[name]
+        phrases, percentage = match_shingles(source[0], source[1], words, hashes, SHINGLE_SIZE)
+        if phrases and percentage > 2:
+            found.add(name)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=2000)
+    parser.add_argument('--words', type=int, default=800)
+    parser.add_argument('--plagiarism-rate', type=float, default=0.05)
+    parser.add_argument('--top-k', type=int, default=50)
+    parser.add_argument('--configs', nargs='+', default=['64x1', '64x2', '32x4'],
+                        help="LSH parameters as BANDSxROWS, or 'tfidf'")
+    args = parser.parse_args()
+
+    upload, corpus = synthetic_corpus(args.docs, args.words, args.plagiarism_rate)
+    source = text_shingles(upload, SHINGLE_SIZE)
+    docs = {name: text_shingles(text, SHINGLE_SIZE) for name, text in corpus.items()}
+
+    start = time.perf_counter()
+    truth = scan(source, docs, docs)
+    exhaustive = time.perf_counter() - start
+    print(f"corpus: {args.docs} docs x {args.words} words, {len(truth)} true sources")
+    print(f"{'mode':>12} {'build (s)':>10} {'query (s)':>10} {'recall':>7} {'checked':>8}")
+    print(f"{'exhaustive':>12} {'-':>10} {exhaustive:>10.4f} {1:>7.3f} {len(docs):>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for config in args.configs:
+            start = time.perf_counter()
+            if config == 'tfidf':
+                index = TfidfIndex(os.path.join(tmp, 'tfidf'))
+                with index.batch():
+                    for name, text in corpus.items():
+                        index.add_document(name, name, text)
+            else:
+                bands, rows = (int(v) for v in config.split('x'))
+                index = MinHashLSH(os.path.join(tmp, f"{config}.db"), bands=bands, rows=rows)
+                for name, (_, hashes) in docs.items():
+                    index.add_document(name, name, hashes)
+            build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if config == 'tfidf':
+                shortlist = [name for name, _ in index.top_candidates(upload, args.top_k)]
+            else:
+                shortlist = [name for name, _ in index.top_candidates(source[1], args.top_k)]
+            found = scan(source, docs, shortlist)
+            query = time.perf_counter() - start
+
+            recall = len(found & truth) / len(truth) if truth else 1
+            print(f"{config:>12} {build:>10.2f} {query:>10.4f} {recall:>7.3f} {len(shortlist):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Microbenchmark of find_matching_phrases against the list-scan implementation
+it replaced (find_matching_phrases_old).
+
+    python -m benchmarks.bench_matching --sizes 1000 4000 10000
+"""
+import argparse
+import random
+import time
+
+from benchmarks.synthetic import plagiarize, synthetic_text
+from main import find_matching_phrases, find_matching_phrases_old
+
+
+def best_of(repeat, fn, *args):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 4000, 10000],
+                        help='document lengths in words')
+    parser.add_argument('--rate', type=float, default=0.3, help='share of copied text')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-old', action='store_true', help='only time the new implementation')
+    args = parser.parse_args()
+
+    print(f"{'words':>8} {'old (s)':>10} {'new (s)':>10} {'speedup':>8} {'matches':>8}")
+    for size in args.sizes:
+        rng = random.Random(size)
+        source = synthetic_text(size, rng)
+        target = plagiarize(source, size, args.rate, rng)
+
+        new_time, new_result = best_of(args.repeat, find_matching_phrases, source, target)
+        if args.skip_old:
+            print(f"{size:>8} {'-':>10} {new_time:>10.4f} {'-':>8} {len(new_result[0]):>8}")
+            continue
+
+        old_time, old_result = best_of(1, find_matching_phrases_old, source, target)
+        assert old_result == new_result, "implementations disagree"
+        print(f"{size:>8} {old_time:>10.4f} {new_time:>10.4f} {old_time / new_time:>7.0f}x {len(new_result[0]):>8}")
+
+
+if __name__ == '__main__':
+    main()
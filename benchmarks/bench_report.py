@@ -0,0 +1,72 @@
+"""
+Report render time and PDF size: report.py vs the previous generate_pdf_report.
+
+    python -m benchmarks.bench_report --words 2000 8000 --docs 200
+
+Matches come from running the shingle matcher over a synthetic corpus in
+which a share of the documents copy passages of the upload, so the number of
+5-word matches grows with the upload like it does in production.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import synthetic_corpus
+import main
+from shingles import text_shingles
+
+
+def build_matches(upload, corpus):
+    source_words, source_hashes = text_shingles(upload, main.SHINGLE_SIZE)
+    matches = []
+    for name, text in sorted(corpus.items()):
+        target_words, target_hashes = text_shingles(text, main.SHINGLE_SIZE)
+        spans = []
+        phrases, percentage = main.match_shingles(source_words, source_hashes, target_words, target_hashes,
+                                                  main.SHINGLE_SIZE, spans=spans)
+        if phrases and percentage > 2:
+            matches.append({
+                "document": f"{main.BASE_URL}/{name}",
+                "document_name": name,
+                "matching_phrases": phrases,
+                "similarity_percentage": percentage,
+                "spans": spans,
+            })
+    return matches
+
+
+def measure(render, upload, matches, directory):
+    start = time.perf_counter()
+    path = render(upload, list(matches), 42.0, 'report.pdf')
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(path)
+    os.remove(path)
+    return elapsed, size
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--words', type=int, nargs='+', default=[2000, 8000])
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--plagiarism-rate', type=float, default=0.3)
+    parser.add_argument('--skip-old', action='store_true', help='only time the new renderer')
+    args = parser.parse_args()
+
+    print(f"{'words':>7} {'matches':>8} {'phrases':>8} {'engine':>6} {'time (s)':>9} {'size (KB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        main.REPORTS_DIR = tmp
+        for num_words in args.words:
+            upload, corpus = synthetic_corpus(args.docs, num_words, args.plagiarism_rate)
+            matches = build_matches(upload, corpus)
+            phrases = sum(len(match["matching_phrases"]) for match in matches)
+            engines = [('new', main.generate_pdf_report)]
+            if not args.skip_old:
+                engines.append(('old', main.generate_pdf_report_old))
+            for label, render in engines:
+                elapsed, size = measure(render, upload, matches, tmp)
+                print(f"{num_words:>7} {len(matches):>8} {phrases:>8} {label:>6} {elapsed:>9.2f} {size / 1024:>10.0f}")
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,163 @@
+"""
+Startup time and memory of the development server vs gunicorn with preloading.
+
+    python -m benchmarks.bench_serving --docs 300 --words 2000 --workers 2 4
+
+Each mode serves a synthetic corpus from a fresh working directory. Checks
+run in the default job worker pools unless --job-workers is given (0 runs
+them inline); queued checks are timed until their status is done. Startup is
+the time until GET /jobs answers; then every upload is checked once and the
+memory of each server process, job processes and fork servers included, is
+read from /proc: RSS, PSS (shared pages split between the processes sharing
+them) and USS (pages only that process uses). Network calls go to closed
+local ports, so nothing leaves the machine.
+"""
+import argparse
+import base64
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import requests
+
+from benchmarks.suite import make_fixtures
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 8002  # main.py's development server always binds it
+
+
+def process_tree(pid):
+    pids = [pid]
+    # Each thread lists the children it started (fork servers start from request threads)
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children') as f:
+            for child in f.read().split():
+                pids.extend(process_tree(int(child)))
+    return pids
+
+
+def memory_mb(pid):
+    """(RSS, PSS, USS) of a process in MB."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    uss = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return fields.get('Rss', 0), fields.get('Pss', 0), uss
+
+
+def wait_for_port_free():
+    # Leftover children of the previous mode must not answer for the next one
+    while True:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', PORT)) != 0:
+                return
+        time.sleep(0.2)
+
+
+def command(mode, workers):
+    if mode == 'dev':
+        return [sys.executable, os.path.join(REPO_ROOT, 'main.py')]
+    return [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py'),
+            '--workers', str(workers), '--graceful-timeout', '10', 'wsgi:app']
+
+
+def check(url, path):
+    """Check one upload; a queued check is polled until it finishes. Returns (seconds, ok)."""
+    with open(path, 'rb') as f:
+        body = {'file': base64.b64encode(f.read()).decode('ascii'), 'file_name': os.path.basename(path),
+                'insert_id': 1}
+    started = time.perf_counter()
+    response = requests.post(f'{url}/check-similarity', json=body, timeout=600)
+    if response.status_code == 202:
+        status_url = url + response.json()['status_url']
+        while True:
+            status = requests.get(status_url, timeout=60).json()['status']
+            if status in ('done', 'failed'):
+                return time.perf_counter() - started, status == 'done'
+            time.sleep(0.05)
+    return time.perf_counter() - started, response.status_code == 200
+
+
+def run(mode, workers, workdir, job_workers=None):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, PORT=str(PORT),
+               CALLBACK_URL='http://127.0.0.1:9/', FILES_API_URL='http://127.0.0.1:9/')
+    if job_workers is not None:
+        env['JOB_WORKERS'] = str(job_workers)
+    log = open(os.path.join(workdir, f'{mode}.log'), 'w')
+    start = time.perf_counter()
+    server = subprocess.Popen(command(mode, workers), cwd=workdir, env=env, stdout=log,
+                              stderr=subprocess.STDOUT, start_new_session=True)
+    try:
+        url = f'http://127.0.0.1:{PORT}'
+        while True:
+            if server.poll() is not None:
+                raise SystemExit(f"{mode} exited; see {log.name}")
+            # gunicorn accepts connections while the master preloads; wait for the
+            # answer rather than abandoning connections a worker will pick up later
+            try:
+                if requests.get(f'{url}/jobs', timeout=600).status_code == 200:
+                    break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        startup = time.perf_counter() - start
+
+        latencies = []
+        uploads = sorted(os.listdir(os.path.join(workdir, 'fixtures')))
+        for name in uploads:
+            elapsed, ok = check(url, os.path.join(workdir, 'fixtures', name))
+            latencies.append(elapsed)
+            if not ok:
+                print(f"{mode}: the check of {name} failed")
+
+        processes = [memory_mb(pid) for pid in process_tree(server.pid)]
+        return startup, sorted(latencies)[len(latencies) // 2], processes
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            print(f"{mode} did not stop within 60s of SIGTERM; killing it")
+            os.killpg(server.pid, signal.SIGKILL)
+            server.wait()
+        log.close()
+        wait_for_port_free()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=300)
+    parser.add_argument('--words', type=int, default=2000)
+    parser.add_argument('--uploads', type=int, default=6)
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4], help='gunicorn worker counts')
+    parser.add_argument('--job-workers', type=int, help="JOB_WORKERS of every server (main.py's default if unset)")
+    args = parser.parse_args()
+
+    fixtures = SimpleNamespace(docs=args.docs, words=args.words, plagiarism_rate=0.2, uploads=args.uploads,
+                               formats=['docx', 'pdf'], seed=0)
+    print(f"{'mode':>12} {'procs':>5} {'startup (s)':>11} {'p50 (s)':>8} {'RSS total':>9} "
+          f"{'PSS total':>9} {'USS/proc':>8}  (MB)")
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'fixtures-source')
+        make_fixtures(source, fixtures)
+        for mode, workers in [('dev', 1)] + [('gunicorn', n) for n in args.workers]:
+            workdir = os.path.join(tmp, f'{mode}-{workers}')
+            shutil.copytree(source, workdir)
+            startup, p50, processes = run(mode, workers, workdir, args.job_workers)
+            rss = sum(p[0] for p in processes)
+            pss = sum(p[1] for p in processes)
+            uss = sum(p[2] for p in processes) / len(processes)
+            label = mode if mode == 'dev' else f'{mode}-{workers}'
+            print(f"{label:>12} {len(processes):>5} {startup:>11.1f} {p50:>8.3f} {rss:>9.0f} {pss:>9.0f} {uss:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Scatter-gather over local shard servers: latency, memory per node, agreement
+with a single node, and what a check returns while a shard is down.
+
+    python -m benchmarks.bench_sharding --docs 300 --words 2000 --shards 2 4
+
+For each shard count, that many gunicorn servers start from copies of the
+same fixtures (SHARD_COUNT / SHARD_INDEX, each ingesting its part of the
+corpus) plus a coordinator with SHARD_URLS pointing at them. Every upload is
+checked once through the coordinator and compared with the answer of one
+unsharded server. Then the first shard is stopped and the first upload is
+checked again. Checks run inline (JOB_WORKERS=0) and network calls other
+than the shard queries go to closed local ports.
+
+    same        uploads whose matches and overall similarity equal the single node's
+    RSS/node    largest RSS of one server's process tree (MB)
+    degraded    overall similarity, sources and missing shards with shard 0 down
+"""
+import argparse
+import base64
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import requests
+
+from benchmarks.bench_serving import memory_mb, process_tree
+from benchmarks.suite import make_fixtures
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_PORT = 8100
+
+
+class Server:
+    """One gunicorn server in its own working directory."""
+
+    def __init__(self, workdir, port, **env):
+        self.url = f'http://127.0.0.1:{port}'
+        env = dict(os.environ, PYTHONPATH=REPO_ROOT, PORT=str(port), JOB_WORKERS='0',
+                   CALLBACK_URL='http://127.0.0.1:9/', FILES_API_URL='http://127.0.0.1:9/',
+                   WEB_CONCURRENCY='1', **env)
+        self.log = open(os.path.join(workdir, 'server.log'), 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py'),
+             '--graceful-timeout', '10', 'wsgi:app'],
+            cwd=workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT, start_new_session=True,
+        )
+
+    def wait_ready(self):
+        while True:
+            if self.process.poll() is not None:
+                raise SystemExit(f"Server on {self.url} exited; see {self.log.name}")
+            try:
+                if requests.get(f'{self.url}/jobs', timeout=600).status_code == 200:
+                    return
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+    def rss_mb(self):
+        return sum(memory_mb(pid)[0] for pid in process_tree(self.process.pid))
+
+    def stop(self):
+        if self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            try:
+                self.process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+        self.log.close()
+
+
+def check(url, path):
+    with open(path, 'rb') as f:
+        body = {'file': base64.b64encode(f.read()).decode('ascii'), 'file_name': os.path.basename(path),
+                'insert_id': 1}
+    started = time.perf_counter()
+    response = requests.post(f'{url}/check-similarity', json=body, timeout=600)
+    return time.perf_counter() - started, response.json()
+
+
+def answer(result):
+    return result.get('overall_similarity'), sorted((m['document'], m['similarity_percentage'])
+                                                   for m in result.get('matches', []))
+
+
+def start(tmp, source, label, port, **env):
+    workdir = os.path.join(tmp, label)
+    shutil.copytree(source, workdir)
+    return Server(workdir, port, **env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=300)
+    parser.add_argument('--words', type=int, default=2000)
+    parser.add_argument('--uploads', type=int, default=6)
+    parser.add_argument('--shards', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    fixtures = SimpleNamespace(docs=args.docs, words=args.words, plagiarism_rate=0.2, uploads=args.uploads,
+                               formats=['docx', 'pdf'], seed=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'fixtures-source')
+        make_fixtures(source, fixtures)
+        uploads = [os.path.join(source, 'fixtures', name) for name in sorted(os.listdir(os.path.join(source, 'fixtures')))]
+
+        single = start(tmp, source, 'single', BASE_PORT)
+        try:
+            single.wait_ready()
+            timed = [check(single.url, path) for path in uploads]
+            expected = [answer(result) for _, result in timed]
+            rss = single.rss_mb()
+        finally:
+            single.stop()
+
+        print(f"{'shards':>6} {'p50 (s)':>8} {'same':>5} {'RSS/node':>8}  degraded")
+        print(f"{'1':>6} {sorted(t for t, _ in timed)[len(timed) // 2]:>8.3f} {len(timed):>5} {rss:>8.0f}  -")
+        for count in args.shards:
+            shards = []
+            coordinator = None
+            try:
+                for index in range(count):
+                    shards.append(start(tmp, source, f'shard-{count}-{index}', BASE_PORT + 1 + index,
+                                        SHARD_COUNT=str(count), SHARD_INDEX=str(index)))
+                coordinator = start(tmp, source, f'coordinator-{count}', BASE_PORT,
+                                    SHARD_URLS=','.join(shard.url for shard in shards),
+                                    SHARD_TIMEOUT=str(args.timeout))
+                for server in shards + [coordinator]:
+                    server.wait_ready()
+
+                timed = [check(coordinator.url, path) for path in uploads]
+                same = sum(answer(result) == wanted for (_, result), wanted in zip(timed, expected))
+                rss = max(server.rss_mb() for server in shards)
+
+                shards[0].stop()
+                _, result = check(coordinator.url, uploads[0])
+                degraded = (f"{result.get('overall_similarity')}% from {result.get('Total Source')} sources, "
+                            f"missing {len(result.get('missing_shards', []))}")
+                print(f"{count:>6} {sorted(t for t, _ in timed)[len(timed) // 2]:>8.3f} {same:>5} {rss:>8.0f}  "
+                      f"{degraded}")
+            finally:
+                for server in shards + ([coordinator] if coordinator else []):
+                    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Peak RSS added by accepting one upload on /check-similarity, per upload mode.
+
+    python -m benchmarks.bench_upload --size-mb 30 --modes json-before json multipart raw
+
+json-before is the endpoint as it was before streaming: the same JSON request,
+with the upload decoded by one base64.b64decode call and written in one piece.
+Each mode runs in a fresh process through Flask's test client. The job queue is
+stubbed out, so only request parsing and spooling the upload to disk are
+measured, not the similarity check itself.
+"""
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rss_mb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+
+
+def reset_peak_rss():
+    """Reset VmHWM to the current RSS, so building the request body is not counted."""
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+
+def child(mode, size_mb):
+    """Measure one upload in this process and print a JSON result line."""
+    os.environ.setdefault('JOB_WORKERS', '1')
+    sys.path.insert(0, REPO_ROOT)
+    import main
+
+    def submit(job, job_id=None):
+        os.remove(job['file_path'])
+        return job_id
+    main.job_queue.submit = submit
+    if mode == 'json-before':
+        def write_base64(encoded, file_path):
+            with open(file_path, 'wb') as f:
+                f.write(base64.b64decode(encoded))
+        main.write_base64 = write_base64
+
+    path = os.path.abspath('upload.pdf')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size_mb * 1024 * 1024))
+
+    client = main.app.test_client()
+    if mode in ('json', 'json-before'):
+        with open(path, 'rb') as f:
+            body = json.dumps({'file': base64.b64encode(f.read()).decode('ascii'),
+                               'file_name': 'upload.pdf', 'insert_id': 1})
+        kwargs = {'data': body, 'content_type': 'application/json'}
+    elif mode == 'multipart':
+        kwargs = {'data': {'file': (open(path, 'rb'), 'upload.pdf'), 'insert_id': '1'},
+                  'content_type': 'multipart/form-data'}
+    else:
+        kwargs = {'query_string': {'file_name': 'upload.pdf', 'insert_id': '1'},
+                  'input_stream': open(path, 'rb'), 'content_type': 'application/octet-stream',
+                  'headers': {'Content-Length': str(os.path.getsize(path))}}
+
+    reset_peak_rss()
+    before = rss_mb('VmRSS')
+    start = time.perf_counter()
+    response = client.post('/check-similarity', **kwargs)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'mode': mode,
+        'status': response.status_code,
+        'seconds': round(elapsed, 3),
+        'peak_rss_added_mb': round(rss_mb('VmHWM') - before, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    # JSON requests carry the upload base64-encoded, within the 50MB request limit
+    parser.add_argument('--size-mb', type=int, default=30)
+    parser.add_argument('--modes', nargs='+', default=['json-before', 'json', 'multipart', 'raw'])
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.size_mb)
+        return
+
+    print(f"{'mode':>11} {'status':>6} {'time (s)':>9} {'peak RSS added (MB)':>20}")
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_upload', '--child', mode, '--size-mb', str(args.size_mb)],
+                cwd=tmp, env=dict(os.environ, PYTHONPATH=REPO_ROOT), capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:>11} {result['status']:>6} {result['seconds']:>9} {result['peak_rss_added_mb']:>20}")
+
+
+if __name__ == '__main__':
+    main()
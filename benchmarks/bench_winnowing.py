@@ -0,0 +1,176 @@
+"""
+Winnowed fingerprints vs full shingles: index size, lookup and matching time,
+and how much copied text each still detects.
+
+    python -m benchmarks.bench_winnowing --docs 300 --words 2000 --windows 1 4 8 \\
+        --passage-words 6 8 12 40
+
+Window 1 is the full-shingle index and the 'shingles' engine. Every other
+window indexes the winnowed fingerprints and matches with the 'winnowing'
+engine, which always detects passages of at least window + n - 1 words.
+
+For each copied-passage length the corpus is rebuilt: a share of the
+documents copies passages of that length from the upload. Recall is measured
+against that ground truth:
+
+    docs found    copying documents that are index candidates
+    docs reported copying documents reported (above the 2% threshold)
+    words         copied words covered by the reported spans
+
+Finally each window matches copies of a text with one word substituted near
+the middle; a span covering that word would show it as copied, so the
+'edited' count must be 0.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import plagiarize, synthetic_text, vocabulary
+
+N = 5
+
+
+def build_corpus(num_docs, num_words, plagiarism_rate, passage_words, seed):
+    """(upload, {name: text}, {name: set of copied upload word offsets}) with known copies."""
+    rng = random.Random(seed)
+    words = vocabulary()
+    upload = synthetic_text(num_words, rng, words)
+    upload_words = upload.split()
+    corpus, copied = {}, {}
+    for i in range(num_docs):
+        name = f"doc{i:05d}.docx"
+        if rng.random() < plagiarism_rate:
+            text = plagiarize(upload, num_words, rng.uniform(0.05, 0.5), rng, passage_words, words)
+            corpus[name] = text
+            copied[name] = copied_offsets(upload_words, text.split(), passage_words)
+        else:
+            corpus[name] = synthetic_text(num_words, rng, words)
+    return upload, corpus, copied
+
+
+def copied_offsets(upload_words, doc_words, passage_words):
+    """Upload word offsets whose passage_words-word passage appears in the document."""
+    starts = {}
+    for i in range(len(upload_words) - passage_words + 1):
+        starts.setdefault(tuple(upload_words[i:i + passage_words]), i)
+    offsets = set()
+    for j in range(len(doc_words) - passage_words + 1):
+        i = starts.get(tuple(doc_words[j:j + passage_words]))
+        if i is not None:
+            offsets.update(range(i, i + passage_words))
+    return offsets
+
+
+def run(main, window, upload, corpus, copied, workdir, label):
+    from shingle_index import ShingleIndex
+    from shingles import text_shingles
+    from winnowing import winnow
+
+    path = os.path.join(workdir, f"index-{label}-w{window}.db")
+    index = ShingleIndex(path, n=N, window=window)
+    shingles = fingerprints = 0
+    arrays = {}
+    for name, text in corpus.items():
+        index.add_document(name, name, text)
+        _, hashes = text_shingles(text, N)
+        arrays[name] = np.asarray(hashes, dtype=np.uint64)
+        shingles += len(hashes)
+        fingerprints += len(winnow(hashes, window)) if window > 1 else len(hashes)
+    index._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size = os.path.getsize(path)
+
+    main.MATCHING_ENGINE = 'winnowing' if window > 1 else 'shingles'
+    main.WINNOW_WINDOW = window
+    source = main.prepare_source(upload)
+    started = time.perf_counter()
+    candidates = index.candidates(main.index_keys(source))
+    lookup = time.perf_counter() - started
+
+    started = time.perf_counter()
+    reported = {}
+    for name in candidates:
+        result = main.phrase_match(name, source, arrays[name])
+        if result is not None:
+            reported[name] = result[0]
+    compare = time.perf_counter() - started
+
+    covered = copied_words = 0
+    for name, offsets in copied.items():
+        copied_words += len(offsets)
+        spans = reported[name]['spans'] if name in reported else []
+        found = set()
+        for start, _, length in spans:
+            found.update(range(start, start + length))
+        covered += len(found & offsets)
+    return {
+        'fingerprints': fingerprints / len(corpus),
+        'kept': fingerprints / shingles,
+        'index_mb': size / 2 ** 20,
+        'lookup_ms': lookup * 1000,
+        'compare_ms': compare * 1000,
+        'found': len(set(candidates) & set(copied)) / len(copied),
+        'reported': len(set(reported) & set(copied)) / len(copied),
+        'words': covered / copied_words if copied_words else 1.0,
+    }
+
+
+def edited_word_spans(window, trials, num_words=200):
+    """Copies with one substituted word whose reported spans still cover that word."""
+    from shingles import text_shingles
+    from winnowing import match_fingerprints, winnow
+
+    bridged = 0
+    for trial in range(trials):
+        rng = random.Random(trial)
+        words = synthetic_text(num_words, rng).split()
+        edited = list(words)
+        k = rng.randrange(num_words * 2 // 5, num_words * 3 // 5)
+        edited[k] = 'substituted'
+        source = np.asarray(text_shingles(" ".join(words), N)[1], dtype=np.uint64)
+        target = np.asarray(text_shingles(" ".join(edited), N)[1], dtype=np.uint64)
+        spans, _, _ = match_fingerprints(winnow(source, window), source, target, window, N)
+        bridged += any(start <= k < start + length for start, _, length in spans)
+    return bridged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=300)
+    parser.add_argument('--words', type=int, default=2000)
+    parser.add_argument('--plagiarism-rate', type=float, default=0.2)
+    parser.add_argument('--windows', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--passage-words', type=int, nargs='+', default=[6, 8, 12, 40],
+                        help='lengths of the copied passages')
+    parser.add_argument('--edit-trials', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # main creates its working directories on import
+        os.chdir(workdir)
+        import main as app
+
+        print(f"{'passage':>7} {'window':>6} {'guarantee':>9} {'fp/doc':>7} {'kept':>5} {'index MB':>8} "
+              f"{'lookup ms':>9} {'compare ms':>10} {'docs found':>10} {'reported':>8} {'words':>6}")
+        for passage_words in args.passage_words:
+            upload, corpus, copied = build_corpus(args.docs, args.words, args.plagiarism_rate,
+                                                  passage_words, args.seed)
+            for window in args.windows:
+                r = run(app, window, upload, corpus, copied, workdir, passage_words)
+                guarantee = window + N - 1 if window > 1 else N
+                print(f"{passage_words:>7} {window:>6} {guarantee:>9} {r['fingerprints']:>7.0f} {r['kept']:>5.2f} "
+                      f"{r['index_mb']:>8.2f} {r['lookup_ms']:>9.1f} {r['compare_ms']:>10.1f} "
+                      f"{r['found']:>10.1%} {r['reported']:>8.1%} {r['words']:>6.1%}")
+
+        print(f"\n{'window':>6} {'edited':>6}  (of {args.edit_trials} copies with a substituted word)")
+        for window in args.windows:
+            if window > 1:
+                print(f"{window:>6} {edited_word_spans(window, args.edit_trials):>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+End-to-end and per-stage benchmark of the similarity pipeline, written as JSON.
+
+    python -m benchmarks.suite --docs 200 --words 2000 --plagiarism-rate 0.2 \\
+        --uploads 20 --output bench.json
+    python -m benchmarks.suite --output after.json --baseline bench.json
+
+A synthetic corpus of PDF and DOCX fixtures is generated (see synthetic.py),
+then every scenario runs in a fresh process on the same working directory:
+
+    ingest      ingest_corpus_file per corpus document, cold caches
+    extract     extract_text per upload
+    match       compare_with_corpus per upload (prepare, candidates, compare)
+    report      generate_pdf_report per upload
+    callback    the save-response callback per report, against a stub session
+    end_to_end  POST /check-similarity through Flask's test client, inline jobs
+
+For each scenario the output records throughput, p50/p95/p99 latency and the
+process' peak RSS; end_to_end also breaks its latency down by stage from the
+job traces. Nothing leaves the machine: callbacks go to an in-process stub and
+the corpus sync is never started. Keys are sorted, so two result files diff
+cleanly; --baseline prints the p50 change against an earlier run.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('ingest', 'extract', 'match', 'report', 'callback', 'end_to_end')
+WORDS_PER_PARAGRAPH = 120
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(samples):
+    """Latency percentiles (seconds) and throughput (items/s, back to back) of a list of samples."""
+    if not samples:
+        return {'count': 0}
+    values = np.asarray(samples, dtype=float)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    elapsed = values.sum()
+    return {
+        'count': len(samples),
+        'seconds': round(float(elapsed), 4),
+        'throughput_per_s': round(len(samples) / elapsed, 3) if elapsed else None,
+        'mean': round(float(values.mean()), 5),
+        'p50': round(float(p50), 5),
+        'p95': round(float(p95), 5),
+        'p99': round(float(p99), 5),
+        'max': round(float(values.max()), 5),
+    }
+
+
+def write_fixture(path, text):
+    words = text.split()
+    paragraphs = [' '.join(words[i:i + WORDS_PER_PARAGRAPH]) for i in range(0, len(words), WORDS_PER_PARAGRAPH)]
+    if path.endswith('.pdf'):
+        from fpdf import FPDF
+        pdf = FPDF()
+        pdf.set_font("Arial", size=10)
+        pdf.add_page()
+        for paragraph in paragraphs:
+            pdf.multi_cell(0, 5, paragraph)
+        pdf.output(path)
+    else:
+        from docx import Document
+        doc = Document()
+        for paragraph in paragraphs:
+            doc.add_paragraph(paragraph)
+        doc.save(path)
+
+
+def make_fixtures(workdir, args):
+    """Corpus documents in workdir/downloaded_docs, uploads in workdir/fixtures."""
+    from benchmarks.synthetic import plagiarize, synthetic_corpus
+
+    rng = random.Random(args.seed)
+    upload, corpus = synthetic_corpus(args.docs, args.words, args.plagiarism_rate, seed=args.seed)
+    corpus_dir = os.path.join(workdir, 'downloaded_docs')
+    upload_dir = os.path.join(workdir, 'fixtures')
+    os.makedirs(corpus_dir, exist_ok=True)
+    os.makedirs(upload_dir, exist_ok=True)
+    for i, (name, text) in enumerate(sorted(corpus.items())):
+        suffix = args.formats[i % len(args.formats)]
+        write_fixture(os.path.join(corpus_dir, f"{name.rsplit('.', 1)[0]}.{suffix}"), text)
+    # Uploads are variants of the same essay, so they match the same share of the corpus
+    for i in range(args.uploads):
+        suffix = args.formats[i % len(args.formats)]
+        text = upload if i == 0 else plagiarize(upload, args.words, 0.8, rng)
+        write_fixture(os.path.join(upload_dir, f"upload{i:03d}.{suffix}"), text)
+
+
+class StubResponse:
+    status_code = 200
+
+
+class StubSession:
+    """Stands in for the callback session: reads the whole streamed body, answers 200."""
+
+    def post(self, url, data=None, **kwargs):
+        while data.read(1024 * 1024):
+            pass
+        return StubResponse()
+
+
+def child(scenario, repeat):
+    """Run one scenario in this process (cwd is the working directory) and print a JSON line."""
+    os.environ['JOB_WORKERS'] = '0'
+    sys.path.insert(0, REPO_ROOT)
+    import main
+
+    main.delivery._get_session = lambda: StubSession()
+    uploads = sorted(os.path.join('fixtures', name) for name in os.listdir('fixtures'))
+    samples = []
+    extra = {}
+    before = max_rss_mb()
+
+    def timed(fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        samples.append(time.perf_counter() - start)
+        return result
+
+    if scenario == 'ingest':
+        corpus = sorted(os.path.join(main.ASSIGNMENT_DIR, name) for name in os.listdir(main.ASSIGNMENT_DIR))
+        with main.text_cache.batch(), main.token_store.batch(), main.tfidf_index.batch():
+            for path in corpus:
+                timed(main.ingest_corpus_file, path)
+    else:
+        texts = {path: main.extract_text(path) for path in uploads} if scenario != 'extract' else {}
+        for _ in range(repeat):
+            for path in uploads:
+                name = os.path.basename(path)
+                if scenario == 'extract':
+                    timed(main.extract_text, path)
+                elif scenario == 'match':
+                    timed(main.compare_with_corpus, texts[path], name)
+                elif scenario == 'report':
+                    matches, _, _ = main.compare_with_corpus(texts[path], name)
+                    timed(main.generate_pdf_report, texts[path], matches, 42.0, f"{name}.pdf")
+                elif scenario == 'callback':
+                    matches, _, _ = main.compare_with_corpus(texts[path], name)
+                    report = main.generate_pdf_report(texts[path], matches, 42.0, f"{name}.pdf")
+                    timed(main.delivery.send, {'insert_id': 1, 'similarity': 42.0, 'file_name': name}, report)
+                else:
+                    with open(path, 'rb') as f:
+                        body = {'file': base64.b64encode(f.read()).decode('ascii'), 'file_name': name, 'insert_id': 1}
+                    client = main.app.test_client()
+                    response = timed(client.post, '/check-similarity', json=body)
+                    for stage, seconds in response.get_json().get('trace', {}).get('timings', {}).items():
+                        extra.setdefault(stage, []).append(seconds)
+
+    result = summarize(samples)
+    result['peak_rss_mb'] = round(max_rss_mb(), 1)
+    result['peak_rss_added_mb'] = round(max_rss_mb() - before, 1)
+    if extra:
+        result['stages'] = {stage: summarize(values) for stage, values in sorted(extra.items())}
+    print(json.dumps({'scenario': scenario, 'result': result}))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--words', type=int, default=2000)
+    parser.add_argument('--plagiarism-rate', type=float, default=0.2)
+    parser.add_argument('--uploads', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=1, help='passes over the uploads per scenario')
+    parser.add_argument('--formats', nargs='+', default=['docx', 'pdf'], choices=['docx', 'pdf'])
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--baseline', help='earlier result file to compare p50 latencies with')
+    parser.add_argument('--workdir', help='keep fixtures and indexes here instead of a temp dir')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.repeat)
+        return
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'params': {key: getattr(args, key) for key in
+                       ('docs', 'words', 'plagiarism_rate', 'uploads', 'repeat', 'formats', 'seed')},
+        },
+        'scenarios': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = os.path.abspath(args.workdir or tmp)
+        start = time.perf_counter()
+        make_fixtures(workdir, args)
+        print(f"Generated fixtures in {time.perf_counter() - start:.1f}s")
+
+        # ingest goes first: it builds the indexes the other scenarios read
+        scenarios = ['ingest'] + [scenario for scenario in args.scenarios if scenario != 'ingest']
+        for scenario in scenarios:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.suite', '--child', scenario, '--repeat', str(args.repeat)],
+                cwd=workdir, env=dict(os.environ, PYTHONPATH=REPO_ROOT), capture_output=True, text=True,
+            )
+            lines = [line for line in output.stdout.splitlines() if line.startswith('{"scenario"')]
+            if output.returncode or not lines:
+                print(output.stderr[-2000:])
+                raise SystemExit(f"Scenario {scenario} failed")
+            report['scenarios'][scenario] = json.loads(lines[-1])['result']
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['scenarios']
+
+    print(f"{'scenario':>12} {'n':>5} {'per s':>8} {'p50 (s)':>9} {'p95 (s)':>9} {'p99 (s)':>9} {'RSS (MB)':>9}"
+          + (f" {'p50 vs base':>12}" if baseline else ''))
+    for scenario, result in report['scenarios'].items():
+        line = (f"{scenario:>12} {result['count']:>5} {result['throughput_per_s']:>8} {result['p50']:>9} "
+                f"{result['p95']:>9} {result['p99']:>9} {result['peak_rss_mb']:>9}")
+        if scenario in baseline and baseline[scenario].get('p50'):
+            line += f" {result['p50'] / baseline[scenario]['p50']:>11.2f}x"
+        print(line)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Synthetic documents for the benchmarks."""
+import random
+
+VOCABULARY_SIZE = 20000
+
+
+def vocabulary(size=VOCABULARY_SIZE):
+    return [f"word{i}" for i in range(size)]
+
+
+def synthetic_text(num_words, rng=None, words=None):
+    rng = rng or random.Random(0)
+    words = words or vocabulary()
+    return " ".join(rng.choice(words) for _ in range(num_words))
+
+
+def plagiarize(source_text, target_words, rate, rng=None, passage_words=40, words=None):
+    """
+    Build a document of target_words words where roughly `rate` of the text is
+    copied from source_text in passages of passage_words words.
+    """
+    rng = rng or random.Random(0)
+    words = words or vocabulary()
+    source = source_text.split()
+    out = []
+    while len(out) < target_words:
+        if source and rng.random() < rate:
+            start = rng.randrange(max(1, len(source) - passage_words))
+            out.extend(source[start:start + passage_words])
+        else:
+            out.extend(rng.choice(words) for _ in range(passage_words))
+    return " ".join(out[:target_words])
+
+
+def synthetic_corpus(num_docs, num_words, plagiarism_rate=0.2, copy_share=(0.05, 0.5), seed=0):
+    """
+    Return (upload_text, {name: text}). A plagiarism_rate share of the corpus
+    documents copy passages of the upload, each copying a share of its text drawn
+    uniformly from copy_share; the rest are unrelated.
+    """
+    rng = random.Random(seed)
+    words = vocabulary()
+    upload = synthetic_text(num_words, rng, words)
+    corpus = {}
+    for i in range(num_docs):
+        if rng.random() < plagiarism_rate:
+            share = rng.uniform(*copy_share)
+            corpus[f"doc{i:05d}.docx"] = plagiarize(upload, num_words, share, rng, words=words)
+        else:
+            corpus[f"doc{i:05d}.docx"] = synthetic_text(num_words, rng, words)
+    return upload, corpus
@@ -0,0 +1,203 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from text_cache import atomic_write
+
+# Constants
+SYNC_MANIFEST = "sync_manifest.json"
+DIRECTORY_MANIFEST = ".sync_manifest.json"  # kept in download_dir unless a manifest path is given
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+REQUEST_TIMEOUT = (10, 120)  # (connect, read) seconds
+# Listing fields that, when the API provides them, tell us a file changed
+LISTING_VERSION_FIELDS = ('size', 'file_size', 'updated_at', 'etag', 'hash')
+
+
+def make_session(pool_size, retries=3):
+    """requests session with a connection pool sized for the download workers."""
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class CorpusSync:
+    """
+    Incremental mirror of the portal's file list into download_dir.
+
+    The manifest records, per file name, the link and listing metadata it was
+    downloaded from plus the ETag and size of the response. A file whose listing
+    entry is unchanged is skipped without touching the filesystem; a changed one
+    is re-fetched with If-None-Match. Downloads stream into a temp file in
+    download_dir which is renamed into place, so readers never see partial files.
+    Only files whose names are accepted by accept(name) are mirrored.
+
+    The manifest is keyed by file name, so it belongs to one download_dir:
+    without manifest_path it is kept in download_dir itself.
+    """
+
+    def __init__(self, download_dir, files_url, manifest_path=None, workers=8, on_files=None,
+                 accept=None):
+        self.download_dir = download_dir
+        self.files_url = files_url
+        self.manifest_path = manifest_path or os.path.join(download_dir, DIRECTORY_MANIFEST)
+        self.workers = workers
+        self.on_files = on_files
+        self.accept = accept or (lambda name: True)
+        self.session = make_session(workers)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_duration = None
+        os.makedirs(download_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        with self._lock:
+            data = json.dumps(self.manifest)
+        atomic_write(self.manifest_path, data)
+
+    @staticmethod
+    def _listing_version(file_info):
+        return {key: file_info[key] for key in LISTING_VERSION_FIELDS if key in file_info}
+
+    def _is_current(self, file_info, file_path):
+        entry = self.manifest.get(os.path.basename(file_path))
+        if entry is None:
+            # Files downloaded before the manifest existed are adopted as they are
+            if os.path.exists(file_path):
+                self._record(file_info, file_path, etag=None)
+                return True
+            return False
+        return entry['link'] == file_info['file_link'] and entry['listing'] == self._listing_version(file_info)
+
+    def _record(self, file_info, file_path, etag):
+        with self._lock:
+            self.manifest[os.path.basename(file_path)] = {
+                'link': file_info['file_link'],
+                'listing': self._listing_version(file_info),
+                'etag': etag,
+                'size': os.path.getsize(file_path),
+            }
+
+    def _download(self, file_info):
+        """Fetch one file. Returns its path if new content was written, else None."""
+        file_name = os.path.basename(file_info['file_name'])
+        file_path = os.path.join(self.download_dir, file_name)
+        entry = self.manifest.get(file_name)
+        headers = {}
+        if entry and entry.get('etag') and os.path.exists(file_path):
+            headers['If-None-Match'] = entry['etag']
+
+        try:
+            with self.session.get(file_info['file_link'], headers=headers, stream=True,
+                                  timeout=REQUEST_TIMEOUT) as response:
+                if response.status_code == 304:
+                    self._record(file_info, file_path, entry['etag'])
+                    print(f"Skipping {file_name} (not modified)")
+                    return None
+                if response.status_code != 200:
+                    print(f"Failed to download {file_name}")
+                    return None
+
+                fd, tmp_path = tempfile.mkstemp(dir=self.download_dir, prefix='.', suffix='.part')
+                try:
+                    with os.fdopen(fd, 'wb') as file:
+                        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            file.write(chunk)
+                    os.replace(tmp_path, file_path)
+                except Exception:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+                self._record(file_info, file_path, response.headers.get('ETag'))
+        except (requests.RequestException, OSError) as e:
+            print(f"Failed to download {file_name}: {e}")
+            return None
+
+        print(f"Downloaded {file_name}")
+        return file_path
+
+    def sync(self):
+        """
+        Mirror the file list once. Returns the paths of new or changed files, or
+        None if the list could not be retrieved.
+        """
+        with self._sync_lock:
+            try:
+                response = self.session.get(self.files_url, timeout=REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                print(f"Failed to retrieve the file list: {e}")
+                return None
+            if response.status_code != 200:
+                print("Failed to retrieve the file list")
+                return None
+
+            files = [
+                file_info for file_info in response.json().get('data', [])
+                if self.accept(os.path.basename(file_info['file_name']))
+            ]
+            pending = [
+                file_info for file_info in files
+                if not self._is_current(file_info, os.path.join(self.download_dir, os.path.basename(file_info['file_name'])))
+            ]
+            print(f"Corpus sync: {len(files)} listed, {len(pending)} to fetch")
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                downloaded = [path for path in pool.map(self._download, pending) if path]
+            self._save_manifest()
+
+            if downloaded and self.on_files:
+                self.on_files(downloaded)
+            return downloaded
+
+    def trigger(self, *_):
+        """Ask the background loop to sync now; repeated calls coalesce."""
+        self._wake.set()
+
+    def start(self, interval):
+        """Sync immediately, then every interval seconds (or when triggered) in a daemon thread."""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                self._wake.clear()
+                started = time.time()
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"Corpus sync failed: {e}")
+                self.last_duration = time.time() - started
+                print(f"Corpus sync took {self.last_duration:.1f}s")
+                self._wake.wait(interval)
+
+        self._thread = threading.Thread(target=run, name='corpus-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
@@ -0,0 +1,221 @@
+import base64
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import requests
+
+from corpus_sync import make_session
+from text_cache import atomic_write
+
+# Constants
+OUTBOX_DIR = "outbox/"
+DELIVERY_TIMEOUT = (10, 120)  # (connect, read) seconds of a replayed callback
+SEND_TIMEOUT = (5, 15)  # the one attempt a job makes before leaving the callback to replay()
+DELIVERY_MAX_ATTEMPTS = int(os.environ.get('DELIVERY_MAX_ATTEMPTS', 20))
+DELIVERY_BACKOFF = float(os.environ.get('DELIVERY_BACKOFF', 60))  # seconds before the first replay
+DELIVERY_MAX_BACKOFF = 3600
+DELIVERY_POOL_SIZE = 4
+READ_CHUNK_SIZE = 3 * 64 * 1024  # a multiple of 3, so base64 chunks concatenate cleanly
+# Responses worth retrying; other 4xx mean the request itself is wrong
+RETRY_STATUSES = {408, 425, 429}
+
+
+class Base64JsonBody:
+    """
+    File-like JSON body {..., "file_data": "<base64 of file>"} that encodes the
+    file while it is sent. Its length is known up front, so requests sends a
+    normal Content-Length instead of holding the whole payload in memory.
+    """
+
+    def __init__(self, fields, file_field, file_path):
+        head = json.dumps(fields)[:-1] + (', ' if fields else '') + json.dumps(file_field) + ': "'
+        self._head = head.encode('utf-8')
+        self._tail = b'"}'
+        self._file = open(file_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._length = len(self._head) + 4 * ((size + 2) // 3) + len(self._tail)
+        self._buffer = bytearray(self._head)
+        self._offset = 0  # bytes of _buffer already read
+        self._done = False
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if not self._done and (size < 0 or len(self._buffer) - self._offset < size):
+            # Drop what was read once per refill, not on every read
+            del self._buffer[:self._offset]
+            self._offset = 0
+            while not self._done and (size < 0 or len(self._buffer) < size):
+                chunk = self._file.read(READ_CHUNK_SIZE)
+                if chunk:
+                    self._buffer += base64.b64encode(chunk)
+                else:
+                    self._buffer += self._tail
+                    self._done = True
+                    self._file.close()
+        end = len(self._buffer) if size < 0 else min(self._offset + size, len(self._buffer))
+        data = bytes(memoryview(self._buffer)[self._offset:end])
+        self._offset = end
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class Delivery:
+    """
+    Durable delivery of reports to the save-response callback.
+
+    Every callback is first written to outbox_dir (entry JSON plus a copy of
+    the report) and only removed once the callback accepted it, so
+    a report survives failed callbacks and restarts. send() makes one attempt
+    with a short timeout, so a hanging callback does not hold the job worker.
+    Entries still pending are retried by replay(), which start() runs at
+    startup and then periodically, with exponential backoff between attempts;
+    after max_attempts an entry is moved to failed/. An entry is locked while
+    it is being sent, so worker processes and the replay thread never send the
+    same one twice.
+    """
+
+    def __init__(self, callback_url, outbox_dir=OUTBOX_DIR, max_attempts=DELIVERY_MAX_ATTEMPTS,
+                 backoff=DELIVERY_BACKOFF, timeout=DELIVERY_TIMEOUT, send_timeout=SEND_TIMEOUT):
+        self.callback_url = callback_url
+        self.outbox_dir = outbox_dir
+        self.failed_dir = os.path.join(outbox_dir, 'failed')
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+        self.send_timeout = send_timeout
+        self._session = None
+        self._session_pid = None
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    def _get_session(self):
+        # Connections cannot be shared with forked worker processes
+        if self._session is None or self._session_pid != os.getpid():
+            self._session = make_session(DELIVERY_POOL_SIZE, retries=0)
+            self._session_pid = os.getpid()
+        return self._session
+
+    def _paths(self, entry_id):
+        return os.path.join(self.outbox_dir, f"{entry_id}.json"), os.path.join(self.outbox_dir, f"{entry_id}.pdf")
+
+    def enqueue(self, fields, report_path):
+        """Store a callback (JSON fields plus the report as file_data) in the outbox; returns its id."""
+        entry_id = uuid.uuid4().hex
+        entry_path, pdf_path = self._paths(entry_id)
+        # A copy, not a link: the entry must keep sending this report whatever
+        # later happens to the file at report_path
+        shutil.copyfile(report_path, pdf_path)
+        atomic_write(entry_path, json.dumps({'fields': fields, 'attempts': 0, 'created_at': time.time()}))
+        return entry_id
+
+    def send(self, fields, report_path):
+        """
+        Queue a callback and try it once. Returns the final HTTP status, or None
+        if it is still in the outbox for a later replay.
+        """
+        return self.deliver(self.enqueue(fields, report_path), timeout=self.send_timeout)
+
+    def _give_up(self, entry_path, pdf_path):
+        # Keep the report for inspection
+        os.replace(pdf_path, os.path.join(self.failed_dir, os.path.basename(pdf_path)))
+        os.replace(entry_path, os.path.join(self.failed_dir, os.path.basename(entry_path)))
+
+    def deliver(self, entry_id, timeout=None, due_only=False):
+        """
+        Make one attempt at a pending callback. With due_only, an entry still
+        backing off from its last attempt is left alone.
+        """
+        entry_path, pdf_path = self._paths(entry_id)
+        try:
+            lock = open(entry_path, 'r+', encoding='utf-8')
+        except FileNotFoundError:
+            return None  # Delivered by someone else meanwhile
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None  # Being sent by another process
+            if not os.path.exists(entry_path):
+                return None
+            entry = json.load(lock)
+            fields = entry['fields']
+            if due_only and entry.get('retry_at', 0) > time.time():
+                return None
+
+            entry['attempts'] += 1
+            status = None
+            body = Base64JsonBody(fields, 'file_data', pdf_path)
+            try:
+                response = self._get_session().post(
+                    self.callback_url, data=body, timeout=timeout or self.timeout,
+                    headers={'Content-Type': 'application/json'},
+                )
+                status = response.status_code
+            except requests.RequestException as e:
+                print(f"Callback for insert_id {fields.get('insert_id')} failed: {e}")
+            finally:
+                body.close()
+
+            if status is not None and status < 400:
+                os.remove(pdf_path)
+                os.remove(entry_path)
+                return status
+            if status is not None and status < 500 and status not in RETRY_STATUSES:
+                # Retrying will not help
+                print(f"Callback for insert_id {fields.get('insert_id')} rejected with {status}")
+                self._give_up(entry_path, pdf_path)
+                return status
+            if status is not None:
+                print(f"Callback for insert_id {fields.get('insert_id')} returned {status}")
+            if entry['attempts'] >= self.max_attempts:
+                print(f"Giving up on the callback for insert_id {fields.get('insert_id')} "
+                      f"after {entry['attempts']} attempts")
+                self._give_up(entry_path, pdf_path)
+                return status
+
+            entry['retry_at'] = time.time() + min(self.backoff * 2 ** (entry['attempts'] - 1), DELIVERY_MAX_BACKOFF)
+            atomic_write(entry_path, json.dumps(entry))
+            return None
+
+    def pending(self):
+        return sorted(name[:-len('.json')] for name in os.listdir(self.outbox_dir) if name.endswith('.json'))
+
+    def replay(self):
+        """Try every pending callback that is due once more. Returns the number delivered."""
+        delivered = 0
+        for entry_id in self.pending():
+            status = self.deliver(entry_id, due_only=True)
+            if status is not None and status < 400:
+                delivered += 1
+        if delivered:
+            print(f"Replayed {delivered} callbacks from the outbox")
+        return delivered
+
+    def start(self, interval):
+        """Replay the outbox now and then every interval seconds in a daemon thread."""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.replay()
+                except Exception as e:
+                    print(f"Outbox replay failed: {e}")
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=run, name='callback-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
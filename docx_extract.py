@@ -0,0 +1,121 @@
+import os
+import posixpath
+import shutil
+import subprocess
+import zipfile
+
+from lxml import etree
+
+# Constants
+ANTIWORD_TIMEOUT = int(os.environ.get('ANTIWORD_TIMEOUT', 60))
+OLE2_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+OFFICE_DOCUMENT_REL = '/officeDocument'
+RELS_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+BODY = W_NS + 'body'
+P = W_NS + 'p'
+R = W_NS + 'r'
+HYPERLINK = W_NS + 'hyperlink'
+TBL = W_NS + 'tbl'
+T = W_NS + 't'
+BR = W_NS + 'br'
+BR_TYPE = W_NS + 'type'
+# Text equivalents of run content, as in python-docx's CT_R.text
+RUN_CONTENT = {
+    W_NS + 'tab': '\t',
+    W_NS + 'ptab': '\t',
+    W_NS + 'cr': '\n',
+    W_NS + 'noBreakHyphen': '-',
+}
+
+
+def _main_part(package):
+    """Name of the main document part, normally word/document.xml."""
+    rels = etree.fromstring(package.read('_rels/.rels'))
+    for rel in rels.iter(RELS_NS + 'Relationship'):
+        if rel.get('Type', '').endswith(OFFICE_DOCUMENT_REL):
+            return posixpath.normpath(rel.get('Target').lstrip('/'))
+    raise KeyError('no officeDocument relationship')
+
+
+def _run_text(run, parts):
+    for child in run:
+        if child.tag == T:
+            parts.append(child.text or '')
+        elif child.tag == BR:
+            # Page and column breaks have no text equivalent
+            if child.get(BR_TYPE, 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        else:
+            text = RUN_CONTENT.get(child.tag)
+            if text:
+                parts.append(text)
+
+
+def paragraph_text(p):
+    """Same text as python-docx's Paragraph.text."""
+    parts = []
+    for child in p:
+        if child.tag == R:
+            _run_text(child, parts)
+        elif child.tag == HYPERLINK:
+            for run in child:
+                if run.tag == R:
+                    _run_text(run, parts)
+    return ''.join(parts)
+
+
+def iter_docx_paragraphs(file_path):
+    """
+    Yield the text of each top-level body paragraph, like Document.paragraphs.
+
+    document.xml is streamed out of the zip with iterparse. Every finished body
+    child is dropped, so memory stays bounded by one paragraph or table
+    instead of the whole tree.
+    """
+    with zipfile.ZipFile(file_path) as package:
+        with package.open(_main_part(package)) as xml:
+            # Same parser options as python-docx, so whitespace is handled alike
+            for _, elem in etree.iterparse(xml, events=('end',), tag=(P, TBL),
+                                           remove_blank_text=True, resolve_entities=False):
+                parent = elem.getparent()
+                if parent is None or parent.tag != BODY:
+                    continue  # Paragraphs in tables are freed with their table
+                if elem.tag == P:
+                    yield paragraph_text(elem)
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+
+def extract_docx_text(file_path):
+    """Paragraph text, each followed by a newline, as extract_text_from_docx builds it."""
+    return ''.join(text + '\n' for text in iter_docx_paragraphs(file_path))
+
+
+def is_ole2(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read(len(OLE2_SIGNATURE)) == OLE2_SIGNATURE
+
+
+def extract_doc_text(file_path):
+    """
+    Text of a legacy Word .doc through antiword, or None when antiword is not
+    installed or fails.
+    """
+    antiword = shutil.which('antiword')
+    if antiword is None:
+        print(f"Cannot extract {os.path.basename(file_path)}: antiword is not installed")
+        return None
+    try:
+        result = subprocess.run([antiword, '-m', 'UTF-8.txt', file_path],
+                                capture_output=True, timeout=ANTIWORD_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        print(f"antiword timed out on {os.path.basename(file_path)}")
+        return None
+    if result.returncode != 0:
+        message = result.stderr.decode('utf-8', 'ignore').strip()
+        print(f"antiword failed on {os.path.basename(file_path)}: {message}")
+        return None
+    return result.stdout.decode('utf-8', 'replace')
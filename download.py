@@ -4,9 +4,7 @@ from PyPDF2 import PdfReader
 from docx import Document
 from fpdf import FPDF
 from sklearn.feature_extraction.text import CountVectorizer
-import os
-import requests
-import base64
+from corpus_sync import CorpusSync, SYNC_MANIFEST
 
 download_dir = './downloaded_docs'
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc'}
@@ -15,36 +13,9 @@ ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc'}
 app = Flask(__name__)
 
 def download_files(download_dir):
-    # Ensure the download directory exists
-    os.makedirs(download_dir, exist_ok=True)
-
-    url = "https://portalteam.org/api/download_files"
-    response = requests.get(url)
-    if response.status_code != 200:
-        print("Failed to retrieve the file list")
-        return
-
-    files = response.json().get('data', [])
-    
-    # Download only new files
-    for file_info in files:
-        file_name = file_info['file_name']
-        file_link = file_info['file_link']
-        file_path = os.path.join(download_dir, file_name)
-
-        # Check if the file already exists
-        if os.path.exists(file_path):
-            print(f"Skipping {file_name} (already exists)")
-            continue
-
-        # Download and save the new file
-        file_response = requests.get(file_link)
-        if file_response.status_code == 200:
-            with open(file_path, 'wb') as file:
-                file.write(file_response.content)
-            print(f"Downloaded {file_name}")
-        else:
-            print(f"Failed to download {file_name}")
+    """Download new or changed files concurrently; unchanged files are skipped via the sync manifest."""
+    # The corpus directory of main.py, so the same manifest
+    CorpusSync(download_dir, "https://portalteam.org/api/download_files", SYNC_MANIFEST).sync()
 
 if __name__ == '__main__':
     download_files(download_dir)
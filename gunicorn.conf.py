@@ -0,0 +1,49 @@
+import os
+import shutil
+import sys
+
+# Constants
+bind = f"0.0.0.0:{os.environ.get('PORT', 8002)}"
+
+# Load the app and ingest the corpus (see wsgi.py) in the master before forking
+preload_app = True
+
+# prometheus_client's multiprocess mode: each process writes its metrics to this
+# directory, so the worker answering /metrics reports the whole server. Set before
+# the app is loaded, since prometheus_client reads it on import
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', 'metrics_data/')
+if 'metrics' not in sys.modules:
+    # Start from zero before the preloaded app records the startup ingest under the
+    # master's pid (on_starting runs after that); a config reload keeps the files
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir, exist_ok=True)
+
+# Each worker also runs its own pool of JOB_WORKERS similarity processes, so
+# keep WEB_CONCURRENCY * JOB_WORKERS within the available cores
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Checks run inline (JOB_WORKERS=0) or large uploads can take minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+# Recycled or stopped workers get this long to finish their requests and the
+# jobs already queued in their pool
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 600))
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth, staggered by the jitter
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+
+def post_fork(server, worker):
+    # Threads do not survive fork, so the background tasks start in a worker
+    import main
+    main.start_background_tasks()
+
+
+def child_exit(server, worker):
+    # A recycled worker's counts still add up; its live gauges no longer do
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
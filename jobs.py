@@ -0,0 +1,161 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from text_cache import atomic_write
+
+# Constants
+JOBS_DIR = "jobs/"
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+def _status_path(jobs_dir, job_id):
+    return os.path.join(jobs_dir, f"{job_id}.json")
+
+
+def write_status(jobs_dir, job_id, status, **fields):
+    record = {'job_id': job_id, 'status': status, 'updated_at': time.time()}
+    record.update(fields)
+    atomic_write(_status_path(jobs_dir, job_id), json.dumps(record))
+
+
+def read_status(jobs_dir, job_id):
+    try:
+        with open(_status_path(jobs_dir, job_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _run_job(fn, jobs_dir, job_id, payload):
+    """Worker-side wrapper: records running/done/failed around fn(payload)."""
+    write_status(jobs_dir, job_id, 'running', started_at=time.time())
+    try:
+        result = fn(payload)
+    except Exception as e:
+        message = str(e).encode('utf-8', 'ignore').decode('utf-8')
+        print(f"Job {job_id} failed: {message}")
+        write_status(jobs_dir, job_id, 'failed', error=message)
+        raise
+    write_status(jobs_dir, job_id, 'done', result=result)
+    return result
+
+
+class JobQueue:
+    """
+    Bounded queue of similarity jobs executed by a pool of worker processes.
+
+    Job status lives in one JSON file per job under jobs_dir so that any process
+    can answer a status query. With workers=0 jobs run inline on the caller's
+    thread, which is convenient for development and benchmarks.
+    """
+
+    def __init__(self, fn, workers, max_pending, jobs_dir=JOBS_DIR, on_done=None):
+        self.fn = fn
+        self.workers = workers
+        self.max_pending = max_pending
+        self.jobs_dir = jobs_dir
+        self.on_done = on_done
+        if workers > 0:
+            # Before anything starts the shared fork server (the PDF page pool uses it too)
+            multiprocessing.get_context('forkserver').set_forkserver_preload([fn.__module__])
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        os.makedirs(jobs_dir, exist_ok=True)
+        self.prune()
+
+    def _get_executor(self):
+        # Workers never fork from this process: it runs the corpus sync, watcher
+        # and outbox threads, and a child forked while one of them holds a lock
+        # inherits it locked. They fork from a single-threaded fork server that
+        # has imported the job function's module once.
+        if self._executor is None:
+            context = multiprocessing.get_context('forkserver')
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def depth(self):
+        """Jobs accepted but not finished yet."""
+        with self._lock:
+            return self._pending
+
+    def stats(self):
+        pending = self.depth()
+        running = min(pending, max(self.workers, 1))
+        return {
+            'queued': pending - running,
+            'running': running,
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+        }
+
+    def submit(self, payload, job_id=None, fn=None):
+        """
+        Queue fn(payload) and return its job id, or None if the queue is full.
+        fn defaults to the queue's function; it must be importable by the workers.
+        """
+        fn = fn or self.fn
+        job_id = job_id or uuid.uuid4().hex
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+        write_status(self.jobs_dir, job_id, 'queued', submitted_at=time.time())
+
+        if self.workers <= 0:
+            try:
+                result = _run_job(fn, self.jobs_dir, job_id, payload)
+            except Exception:
+                result = None
+            self._finished(job_id, result)
+            return job_id
+
+        try:
+            future = self._get_executor().submit(_run_job, fn, self.jobs_dir, job_id, payload)
+        except Exception as e:
+            # A broken pool (e.g. a worker killed by the OOM killer) is replaced on the next submit
+            print(f"Failed to queue job {job_id}: {e}")
+            self._executor = None
+            write_status(self.jobs_dir, job_id, 'failed', error='Failed to queue the job.')
+            self._finished(job_id, None)
+            return job_id
+        future.add_done_callback(lambda f: self._future_done(job_id, f))
+        return job_id
+
+    def _future_done(self, job_id, future):
+        error = future.exception()
+        if error is not None:
+            # The worker records its own failures; this covers workers that died mid-job
+            record = read_status(self.jobs_dir, job_id)
+            if not record or record['status'] not in ('done', 'failed'):
+                write_status(self.jobs_dir, job_id, 'failed', error=str(error) or type(error).__name__)
+        self._finished(job_id, None if error is not None else future.result())
+
+    def _finished(self, job_id, result):
+        with self._lock:
+            self._pending -= 1
+        if self.on_done:
+            self.on_done(job_id, result)
+
+    def status(self, job_id):
+        return read_status(self.jobs_dir, job_id)
+
+    def prune(self, max_age=JOB_RETENTION_SECONDS):
+        """Delete status files of jobs that finished more than max_age seconds ago."""
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.jobs_dir):
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
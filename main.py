@@ -1,68 +1,301 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, url_for, g
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from PyPDF2 import PdfReader
 from docx import Document
 from fpdf import FPDF
 from sklearn.feature_extraction.text import CountVectorizer
 import os
-import requests
+import time
+import fcntl
+import threading
 import base64
+import uuid
+import shutil
+import tempfile
+import zipfile
+import multiprocessing.util
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from text_cache import TextCache, TEXT_CACHE_DIR, normalize_text, text_sha256, file_sha256
+from shingle_index import ShingleIndex, INDEX_PATH
+from shingles import text_shingles
+from minhash_lsh import MinHashLSH, LSH_PATH
+from jobs import JobQueue, JOBS_DIR
+from corpus_sync import CorpusSync, SYNC_MANIFEST
+from token_store import TokenStore, TOKEN_STORE_DIR, COMPACT_GARBAGE_RATIO
+from resident_corpus import ResidentCorpus, DirectoryWatcher
+from tfidf_index import TfidfIndex, TFIDF_DIR
+from pdf_extract import extract_pdf_text
+from passages import SuffixAutomaton, match_passages, passage_texts
+from winnowing import winnow, match_fingerprints
+from report import (render_report, REPORT_MAX_SOURCES, REPORT_MAX_PASSAGES,
+                    REPORT_MAX_PASSAGE_WORDS, REPORT_MAX_SOURCE_WORDS)
+from docx_extract import extract_docx_text, extract_doc_text, is_ole2
+from delivery import Delivery, OUTBOX_DIR
+from result_cache import ResultCache, RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES
+from shard import ShardClient, shard_of, SHARD_QUERY_TIMEOUT
+import metrics
 
 # Constants
 ASSIGNMENT_DIR = "downloaded_docs/"
 REPORTS_DIR = "similarity_reports/"
+UPLOADS_DIR = "uploads/"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Bytes outside the base64 alphabet, which base64.b64decode skips
+NON_BASE64 = bytes(set(range(256)) - set(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='))
+RAW_UPLOAD_TYPES = {'application/octet-stream', 'application/pdf', 'application/msword',
+                    'application/vnd.openxmlformats-officedocument.wordprocessingml.document'}
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc'}
+SUPPORTED_SUFFIXES = ('.pdf', '.docx', '.doc')
+SHINGLE_SIZE = 5
+EMPTY_TEXT_SHA256 = text_sha256('')  # digest of a document that yielded no text
+# Opt-in: byte-identical corpus files are replaced with hard links to one
+# copy. Only safe while every writer of downloaded_docs replaces files by
+# rename, as the corpus sync does; files.py writes in place, which would
+# change every linked name at once
+LINK_DUPLICATE_FILES = os.environ.get('LINK_DUPLICATE_FILES', '0') == '1'
+
+# Candidate selection: 'index' checks every document sharing a shingle with the
+# upload, 'lsh' only checks the LSH_TOP_K most similar documents by MinHash and
+# 'tfidf' the TFIDF_TOP_K documents with the highest TF-IDF cosine similarity
+CANDIDATE_FILTER = os.environ.get('CANDIDATE_FILTER', 'index')
+LSH_BANDS = int(os.environ.get('LSH_BANDS', 64))
+LSH_ROWS = int(os.environ.get('LSH_ROWS', 1))
+LSH_TOP_K = int(os.environ.get('LSH_TOP_K', 50))
+TFIDF_TOP_K = int(os.environ.get('TFIDF_TOP_K', 50))
+
+# Phrase evidence: 'shingles' reports every non-overlapping SHINGLE_SIZE-word
+# match, 'passages' reports maximal copied passages as word spans and
+# 'winnowing' reports passages found from winnowed fingerprints only. It keeps
+# about 2 / (WINNOW_WINDOW + 1) of the shingles in the index and detects every
+# passage of at least WINNOW_WINDOW + SHINGLE_SIZE - 1 words
+MATCHING_ENGINE = os.environ.get('MATCHING_ENGINE', 'shingles')
+WINNOW_WINDOW = int(os.environ.get('WINNOW_WINDOW', 4))
+# Opt-in: shingles in more than MAX_SHINGLE_DF corpus documents (templates,
+# question text, citation boilerplate) are left out of the index and never
+# count as matches; 0 keeps every shingle
+MAX_SHINGLE_DF = int(os.environ.get('MAX_SHINGLE_DF', 0))
+
+# Similarity checks run in a pool of worker processes; 0 runs them on the request thread
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1))
+MAX_PENDING_JOBS = int(os.environ.get('MAX_PENDING_JOBS', 100))
+# Batch checks: uploads per request, and processes extracting and scoring them
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', 500))
+# Size of a multipart batch request; its parts are spooled to temp files one at a
+# time. JSON batches are parsed whole in memory and keep MAX_CONTENT_LENGTH below.
+MAX_BATCH_BYTES = int(os.environ.get('MAX_BATCH_BYTES', 2 * 1024 * 1024 * 1024))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+
+# Opt-in: shard the corpus comparison of each job across this many processes
+# (per job worker, so up to JOB_WORKERS * PARALLEL_COMPARE_WORKERS in total)
+PARALLEL_COMPARE_WORKERS = int(os.environ.get('PARALLEL_COMPARE_WORKERS', 0))
+PARALLEL_CHUNK_SIZE = int(os.environ.get('PARALLEL_CHUNK_SIZE', 64))
+# Shingled corpus documents each process keeps in memory between comparisons
+RESIDENT_DOCUMENTS = int(os.environ.get('RESIDENT_DOCUMENTS', 512))
+
+# Corpus sync: concurrent downloads, then a resync every SYNC_INTERVAL seconds
+FILES_API_URL = os.environ.get('FILES_API_URL', "https://staging.portalteam.org/api/files")
+#FILES_API_URL = "http://localhost/PortalCRM/api/files"
+SYNC_WORKERS = int(os.environ.get('SYNC_WORKERS', 8))
+SYNC_INTERVAL = int(os.environ.get('SYNC_INTERVAL', 300))
+# Files added to or removed from ASSIGNMENT_DIR by other means are noticed within WATCH_INTERVAL seconds
+WATCH_INTERVAL = int(os.environ.get('WATCH_INTERVAL', 30))
+# Undelivered save-response callbacks are retried every OUTBOX_INTERVAL seconds
+OUTBOX_INTERVAL = int(os.environ.get('OUTBOX_INTERVAL', 300))
+# Finished checks are cached on disk by upload content, least recently used
+# entries evicted beyond RESULT_CACHE_BYTES; 0 disables the cache
+RESULT_CACHE_BYTES = int(os.environ.get('RESULT_CACHE_BYTES', RESULT_CACHE_MAX_BYTES))
+# Scatter-gather: a shard server holds only the corpus documents with
+# shard_of(name, SHARD_COUNT) == SHARD_INDEX and scores uploads against them on
+# /shard/score. A coordinator (SHARD_URLS, comma-separated shard base URLs)
+# holds no corpus and sends every check to all shards, leaving out those that
+# do not answer within SHARD_TIMEOUT seconds
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', 1))
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', 0))
+SHARD_URLS = [url for url in os.environ.get('SHARD_URLS', '').split(',') if url.strip()]
+SHARD_TIMEOUT = float(os.environ.get('SHARD_TIMEOUT', SHARD_QUERY_TIMEOUT))
+# Only the process holding this lock runs the sync, watcher and outbox threads
+BACKGROUND_LOCK = "background.lock"
+BACKGROUND_RETRY_INTERVAL = 30
+
+BASE_URL = "https://staging.portalteam.org/user_uploads"
+#BASE_URL = "http://localhost/PortalCRM/user_uploads"
+CALLBACK_URL = os.environ.get('CALLBACK_URL', "https://staging.portalteam.org/api/files/save-response")
+#CALLBACK_URL = "http://localhost/PortalCRM/api/files/save-response"
 download_dir = './downloaded_docs'
 
+# Everything besides the upload and the corpus that changes a check's result or report
+MATCH_PARAMETERS = {
+    'n': SHINGLE_SIZE,
+    'engine': [MATCHING_ENGINE, WINNOW_WINDOW, MAX_SHINGLE_DF],
+    'filter': [CANDIDATE_FILTER, LSH_BANDS, LSH_ROWS, LSH_TOP_K, TFIDF_TOP_K],
+    'report': [REPORT_MAX_SOURCES, REPORT_MAX_PASSAGES, REPORT_MAX_PASSAGE_WORDS, REPORT_MAX_SOURCE_WORDS],
+    'base_url': BASE_URL,
+}
+
 # Ensure directories exist
 os.makedirs(ASSIGNMENT_DIR, exist_ok=True)
 
 os.makedirs(REPORTS_DIR, exist_ok=True)
 
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+
 os.makedirs(download_dir, exist_ok=True)
 
+# Extracted text of the corpus, keyed by file content
+text_cache = TextCache(TEXT_CACHE_DIR)
+
+# Token ids and shingle hashes of the corpus, memory-mapped by every worker
+token_store = TokenStore(TOKEN_STORE_DIR)
+
+# Shingle -> documents index used to find candidate sources
+shingle_index = ShingleIndex(INDEX_PATH, n=SHINGLE_SIZE,
+                             window=WINNOW_WINDOW if MATCHING_ENGINE == 'winnowing' else 1,
+                             max_df=MAX_SHINGLE_DF, token_store=token_store)
+
+# MinHash signatures and LSH buckets used to shortlist likely sources
+lsh_index = MinHashLSH(LSH_PATH, bands=LSH_BANDS, rows=LSH_ROWS)
+
+# TF-IDF term counts of the corpus used to shortlist sources by cosine similarity
+tfidf_index = TfidfIndex(TFIDF_DIR)
+
+# The token store kept in memory as an immutable snapshot, swapped after every change
+resident_corpus = ResidentCorpus(token_store)
+
+# Results and reports of finished checks, reused when the same file is submitted again
+# Not on a coordinator: its results depend on the shards' corpora, not on a local revision
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_BYTES) if RESULT_CACHE_BYTES > 0 and not SHARD_URLS else None
+
+# Shard servers a coordinator sends checks to
+shard_client = ShardClient(SHARD_URLS, SHARD_TIMEOUT) if SHARD_URLS else None
 
 # Flask app initialization
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB limit
 
 def download_files(download_dir):
-    # Ensure the download directory exists
-    os.makedirs(download_dir, exist_ok=True)
-
-    url = "https://staging.portalteam.org/api/files"
-    #url = "http://localhost/PortalCRM/api/files"
-    response = requests.get(url)
-    if response.status_code != 200:
-        print("Failed to retrieve the file list")
+    """
+    Download new or changed files from the portal. Only the corpus directory is
+    ingested; any other directory is a plain mirror with a manifest of its own.
+    """
+    if os.path.abspath(download_dir) == os.path.abspath(ASSIGNMENT_DIR):
+        corpus_sync.sync()
+    else:
+        CorpusSync(download_dir, FILES_API_URL, accept=corpus_file).sync()
+
+
+def link_duplicate_file(file_path, sha256, seen):
+    """
+    Replace file_path with a hard link to an earlier corpus file with the same
+    bytes (from seen, {sha256: path}, or the resident corpus), so duplicates
+    take the disk space of one file. Downloads replace files by rename, so
+    updating one of the names later does not change the others.
+    """
+    name = os.path.basename(file_path)
+    directory = os.path.dirname(file_path)
+    original = seen.setdefault(sha256, file_path)
+    if original == file_path:
+        for other in resident_corpus.snapshot().file_duplicates(sha256):
+            if other != name and os.path.exists(os.path.join(directory, other)):
+                original = seen[sha256] = os.path.join(directory, other)
+                break
+    if original == file_path or os.path.samefile(original, file_path):
         return
+    link_path = os.path.join(directory, f".{name}.link")
+    try:
+        os.link(original, link_path)
+        os.replace(link_path, file_path)
+    except OSError as e:
+        print(f"Could not link {name} to {os.path.basename(original)}: {e}")
+        if os.path.exists(link_path):
+            os.remove(link_path)
 
-    files = response.json().get('data', [])
-    
-    # Download only new files
-    for file_info in files:
-        file_name = file_info['file_name']
-        file_link = file_info['file_link']
-        file_path = os.path.join(download_dir, file_name)
 
-        # Check if the file already exists
-        if os.path.exists(file_path):
-            print(f"Skipping {file_name} (already exists)")
-            continue
+def ingest_corpus_file(file_path, seen=None):
+    """
+    Extract a corpus file into the text cache and add its shingles to the index,
+    so requests only read cached text and look up candidates. seen collects
+    {sha256: path} across a batch to link duplicate files.
+    """
+    name = os.path.basename(file_path)
+    if not corpus_file(name):
+        return
+    try:
+        text = text_cache.get_text(file_path, extract_text)
+        sha256 = text_cache.file_key(file_path)
+        if LINK_DUPLICATE_FILES:
+            link_duplicate_file(file_path, sha256, {} if seen is None else seen)
+        # Before the token store: a replaced version is read back from it (see ShingleIndex)
+        if shingle_index.add_document(name, sha256, text):
+            print(f"Indexed {name}")
+        lsh_stale = not lsh_index.has_document(name, sha256)
+        store_stale = not token_store.has_document(name, sha256)
+        if lsh_stale or store_stale:
+            _, hashes = text_shingles(text, SHINGLE_SIZE)
+            if lsh_stale:
+                lsh_index.add_document(name, sha256, hashes)
+            if store_stale:
+                token_store.add_document(name, sha256, text_sha256(text), hashes)
+        if not tfidf_index.has_document(name, sha256):
+            tfidf_index.add_document(name, sha256, text)
+    except OSError as e:
+        print(f"Failed to ingest {file_path}: {e}")
+
+
+def ingest_corpus_files(file_paths):
+    seen = {}
+    with metrics.stage('ingest'), text_cache.batch(), token_store.batch(), tfidf_index.batch():
+        for file_path in file_paths:
+            ingest_corpus_file(file_path, seen)
+    resident_corpus.refresh()
 
-        # Download and save the new file
-        file_response = requests.get(file_link)
-        if file_response.status_code == 200:
-            with open(file_path, 'wb') as file:
-                file.write(file_response.content)
-            print(f"Downloaded {file_name}")
-        else:
-            print(f"Failed to download {file_name}")
+
+def remove_corpus_documents(names, directory=ASSIGNMENT_DIR):
+    """Drop documents whose files are gone from every index."""
+    with token_store.batch(), tfidf_index.batch():
+        for name in names:
+            # Before the token store, as in ingest_corpus_file
+            shingle_index.remove_document(name)
+            lsh_index.remove_document(name)
+            tfidf_index.remove_document(name)
+            token_store.remove_document(name)
+            text_cache.forget(os.path.join(directory, name))
+            print(f"Removed {name} from the index")
+    if token_store.garbage_ratio() > COMPACT_GARBAGE_RATIO:
+        token_store.compact()
+        print("Compacted the token store")
+    if tfidf_index.garbage_ratio() > COMPACT_GARBAGE_RATIO:
+        tfidf_index.compact()
+        print("Compacted the TF-IDF index")
+    resident_corpus.refresh()
+
+
+def sync_corpus_index(directory=ASSIGNMENT_DIR):
+    """Bring the text cache and shingle index in line with the files on disk."""
+    present = {name for name in os.listdir(directory) if corpus_file(name)}
+    ingest_corpus_files(os.path.join(directory, name) for name in sorted(present))
+    indexed = set(shingle_index.documents()) | set(token_store.documents())
+    remove_corpus_documents(sorted(indexed - present), directory)
+
+
+def apply_corpus_changes(changed_paths, removed_names):
+    """DirectoryWatcher callback: ingest new or changed files, drop removed ones."""
+    if changed_paths:
+        ingest_corpus_files(changed_paths)
+    if removed_names:
+        remove_corpus_documents(removed_names)
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+
+def corpus_file(name):
+    """Whether this node holds the corpus file name: a supported file in its shard."""
+    return allowed_file(name) and (SHARD_COUNT <= 1 or shard_of(name, SHARD_COUNT) == SHARD_INDEX)
+
 def extract_text_from_pdf_old(file_path):
     try:
         reader = PdfReader(file_path)
@@ -72,35 +305,41 @@ def extract_text_from_pdf_old(file_path):
         return None
 
 def extract_text_from_pdf(file_path):
+    # Engine, page parallelism and time/page budget are configured in pdf_extract
+    return extract_pdf_text(file_path)
+
+def extract_text_from_docx(file_path):
     try:
-        reader = PdfReader(file_path)
-        text = ''
-        for page in reader.pages:
-            try:
-                text += page.extract_text() or ''  # Handle pages with no text
-            except Exception as e:
-                print(f"Skipped a problematic page due to: {str(e).encode('utf-8', 'ignore').decode('utf-8')}")
-                continue  # Skip the problematic page
-        return text
+        return extract_docx_text(file_path)
     except Exception as e:
-        print(f"Error processing PDF file: {str(e).encode('utf-8', 'ignore').decode('utf-8')}")
-        return None
+        # Unusual packages still open with the full object model
+        print(f"Streaming DOCX extraction failed, using python-docx: {str(e).encode('utf-8', 'ignore').decode('utf-8')}")
+        return extract_text_from_docx_document(file_path)
 
-def extract_text_from_docx(file_path):
+def extract_text_from_docx_document(file_path):
     try:
         doc = Document(file_path)
-        text = ''
+        texts = []
         for para in doc.paragraphs:
             try:
-                text += para.text + '\n'
+                texts.append(para.text + '\n')
             except Exception as e:
                 print(f"Skipped a problematic paragraph due to: {e}")
                 continue  # Skip the problematic paragraph
-        return text
+        return ''.join(texts)
     except Exception as e:
         print(f"Error processing DOCX file: {str(e).encode('utf-8', 'ignore').decode('utf-8')}")
         return None
 
+def extract_text_from_doc(file_path):
+    # Some .doc files are DOCX packages with the old extension
+    if zipfile.is_zipfile(file_path):
+        return extract_text_from_docx(file_path)
+    if is_ole2(file_path):
+        return extract_doc_text(file_path)
+    print(f"Unrecognized .doc file: {file_path}")
+    return None
+
 def extract_text_from_docx_old(file_path):
     try:
         doc = Document(file_path)
@@ -109,6 +348,15 @@ def extract_text_from_docx_old(file_path):
         print(f"Error extracting text from DOCX: {e}")
         return None
 
+def extract_text(file_path):
+    if file_path.endswith('.pdf'):
+        return extract_text_from_pdf(file_path)
+    elif file_path.endswith('.docx'):
+        return extract_text_from_docx(file_path)
+    elif file_path.endswith('.doc'):
+        return extract_text_from_doc(file_path)
+    return None
+
 # def find_matching_phrases(source_text, target_text, n=5):
 #     vectorizer = CountVectorizer(ngram_range=(n, n)).fit([source_text, target_text])
 #     source_ngrams = set(vectorizer.build_analyzer()(source_text))
@@ -118,7 +366,7 @@ def extract_text_from_docx_old(file_path):
 #     return matches, similarity_percentage
 
 
-def find_matching_phrases(source_text, target_text, n=5):
+def find_matching_phrases_old(source_text, target_text, n=5):
     """
     Find matching phrases of n words between source and target texts.
     Ensure matches are non-overlapping with at least n-word separation.
@@ -158,51 +406,105 @@ def find_matching_phrases(source_text, target_text, n=5):
     return matches, similarity_percentage
 
 
+def match_shingles(source_words, source_hashes, target_words, target_hashes, n=5, spans=None, ignore=None):
+    """
+    Non-overlapping n-word matches between two documents given their words and
+    shingle hashes, as (matching phrases, similarity percentage).
+    If spans is a list, (source offset, target offset, n) of each match is appended.
+    Source shingles flagged in the boolean array ignore never match.
+    """
+    # First position of every target shingle; lookups are O(1) instead of a list scan
+    target_positions = {}
+    for j, h in enumerate(target_hashes):
+        target_positions.setdefault(h, j)
 
-def generate_pdf_report_old(source_text, matches, overall_similarity, filename):
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
+    matches = []
+    i = 0
+    while i < len(source_hashes):
+        j = target_positions.get(source_hashes[i]) if ignore is None or not ignore[i] else None
+        # Compare the words too, so a hash collision can never produce a match
+        if j is not None and source_words[i:i + n] == target_words[j:j + n]:
+            matches.append(" ".join(source_words[i:i + n]))
+            if spans is not None:
+                spans.append((i, j, n))
+            i += n  # Skip the words of this match to keep matches non-overlapping
+        else:
+            i += 1
 
-    # Add header
-    pdf.set_font("Arial", 'B', size=14)
-    pdf.cell(0, 10, "Detailed Similarity Report", ln=True, align="C")
-    pdf.ln(10)
+    # Calculate similarity percentage
+    unique_source_phrases = len(source_hashes)
+    similarity_percentage = (len(matches) / unique_source_phrases) * 100 if unique_source_phrases > 0 else 0
 
-    # Add overall similarity
-    pdf.set_font("Arial", size=12)
-    pdf.cell(0, 10, f"Overall Similarity: {overall_similarity:.2f}%", ln=True)
-    pdf.ln(10)
+    return matches, similarity_percentage
 
-    # Add source document content
-    pdf.set_font("Arial", size=12)
-    pdf.multi_cell(0, 10, "Source Document Content:", border='B')
-    pdf.ln(5)
-    pdf.set_font("Arial", size=10)
-    pdf.multi_cell(0, 10, source_text)
-    pdf.ln(10)
 
-    # Add matching details
-    for match in matches:
-        pdf.set_font("Arial", 'B', size=12)
-        pdf.multi_cell(0, 10, f"Matching Document: ", border=0, align="L")
-        pdf.ln(5)
-        pdf.multi_cell(0, 10, f"{match['document_name']} ({match['similarity_percentage']:.2f}% similarity)", border=0, align="L")
-        pdf.cell(0, 10, f"View File", border=0, ln=1, align="L", link=match['document'])        
-        pdf.ln(5)
-        pdf.set_font("Arial", size=10)
-        for phrase in match["matching_phrases"]:
-            pdf.multi_cell(0, 10, "Matching Phrase: " + phrase, border=0, align="L")
-        pdf.ln(5)
+def match_shingle_arrays(source_words, source_array, target_array, n=5, spans=None, ignore=None):
+    """
+    match_shingles against a stored document: source_array and target_array are
+    uint64 shingle hash arrays. The store keeps no words, so matches are decided
+    by the 61-bit hashes alone.
+    """
+    shared = np.isin(source_array, target_array)
+    if ignore is not None:
+        shared &= ~ignore
+    hits = np.flatnonzero(shared)
 
-    # Save the report
-    
-    pdf_path = os.path.join(REPORTS_DIR, filename)
-    pdf.output(pdf_path)
+    matches = []
+    selected = []
+    next_free = 0
+    for i in hits.tolist():
+        if i >= next_free:
+            matches.append(" ".join(source_words[i:i + n]))
+            selected.append(i)
+            next_free = i + n  # Keep matches non-overlapping, as in match_shingles
+
+    if spans is not None and selected:
+        # First target position of each matched shingle
+        order = np.argsort(target_array, kind='stable')
+        targets = order[np.searchsorted(target_array, source_array[selected], sorter=order)]
+        spans.extend((i, j, n) for i, j in zip(selected, targets.tolist()))
+
+    unique_source_phrases = len(source_array)
+    similarity_percentage = (len(matches) / unique_source_phrases) * 100 if unique_source_phrases > 0 else 0
+
+    return matches, similarity_percentage
+
+
+def find_matching_phrases(source_text, target_text, n=5):
+    """
+    Find matching phrases of n words between source and target texts.
+    Ensure matches are non-overlapping with at least n-word separation.
+    """
+    source_words, source_hashes = text_shingles(source_text, n)
+    target_words, target_hashes = text_shingles(target_text, n)
+    return match_shingles(source_words, source_hashes, target_words, target_hashes, n)
+
+
+def write_report(filename, write):
+    """
+    Create the report file of one job, REPORTS_DIR/<random>-filename, by calling
+    write(stream) on a temp file that is then renamed into place. Every job gets
+    a file of its own, so a later job with the same file name never changes a
+    report that is still waiting to be sent or cached.
+    """
+    pdf_path = os.path.join(REPORTS_DIR, f"{uuid.uuid4().hex}-{filename}")
+    fd, tmp_path = tempfile.mkstemp(dir=REPORTS_DIR, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            write(stream)
+        os.replace(tmp_path, pdf_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
     return pdf_path
 
+
 def generate_pdf_report(source_text, matches, overall_similarity, filename):
+    """Render the report with report.py into a new file for filename (see write_report)."""
+    return write_report(filename, lambda stream: render_report(stream, source_text, matches, overall_similarity))
+
+def generate_pdf_report_old(source_text, matches, overall_similarity, filename):
     from unidecode import unidecode
 
     def safe_text(text):
@@ -250,143 +552,399 @@ def generate_pdf_report(source_text, matches, overall_similarity, filename):
     pdf.output(pdf_path)
     return pdf_path
 
-@app.route('/check-similarity', methods=['POST'])
-def check_similarity():
-    print("Entered...")
-    print(request)
-    # Check if request contains JSON
-    if not request.is_json:
-        print("Request must be JSON")
-        return jsonify({"error": "Request must be JSON"}), 400
-    try:
-        data = request.get_json()
-    except Exception as e:
-        print("Error:", str(e))
-        return jsonify({"error": str(e)}), 500
-    #print("Data...", data)
-    if not data or 'file' not in data or 'insert_id' not in data:
-        print('Missing file or insert_id')
-        return jsonify({'error': 'Missing file or insert_id'}), 400
-    
-    # Decode file data
-    file_name = data['file_name']
-    file_data = base64.b64decode(data['file'])
-    insert_id = data['insert_id']
-    BASE_URL = "https://staging.portalteam.org/user_uploads"
-    #BASE_URL = "http://localhost/PortalCRM/user_uploads"
-    
+_resident_documents = OrderedDict()
 
-    if not allowed_file(file_name):
-        print('Unsupported file format. Upload a PDF or DOCX file.')
-        return jsonify({'error': 'Unsupported file format. Upload a PDF or DOCX file.'}), 400
+def load_corpus_document(file_path):
+    """
+    Return (text, words, shingle hashes) of a corpus file. The most recently
+    used documents stay in memory, keyed by content hash, so a long-lived worker
+    does not re-read and re-hash them for every check.
+    """
+    key = (file_path, text_cache.file_key(file_path))
+    document = _resident_documents.get(key)
+    metrics.cache_lookup('resident_documents', hit=document is not None)
+    if document is not None:
+        _resident_documents.move_to_end(key)
+        return document
 
-    
-    filename = secure_filename(file_name)
-    file_path = os.path.join('./', filename)
-    #file.save(file_path)
-    try:
-        with open(file_path, 'wb') as f:
-            f.write(file_data)  # Write the decoded file content
-        print(f"File saved successfully: {file_path}")
-    except Exception as e:
-        print(f"Error saving file: {e}")
-        return jsonify({'error': 'Error saving the file.'}), 500
+    text = text_cache.get_text(file_path, extract_text)
+    words, hashes = text_shingles(text, SHINGLE_SIZE)
+    document = (text, words, hashes)
+    _resident_documents[key] = document
+    while len(_resident_documents) > RESIDENT_DOCUMENTS:
+        _resident_documents.popitem(last=False)
+    return document
 
-    # Extract source text
-    if filename.endswith('.pdf'):
-        source_text = extract_text_from_pdf(file_path)
-    elif filename.endswith('.docx'):
-        source_text = extract_text_from_docx(file_path)
-    else:
-        print('Unsupported file type')
-        return jsonify({'error': 'Unsupported file type.'}), 400
 
-    if not source_text:
-        print('Failed to extract text from the uploaded file.')
-        return jsonify({'error': 'Failed to extract text from the uploaded file.'}), 400
+def prepare_source(source_text):
+    """Everything compare_document needs from the upload, computed once per check."""
+    # Corpus text is cached whitespace-normalized, so compare against the same form
+    normalized_source = normalize_text(source_text)
+    source_words, source_hashes = text_shingles(normalized_source, SHINGLE_SIZE)
+    source = {
+        'text': normalized_source,
+        'digest': text_sha256(normalized_source),
+        'words': source_words,
+        'hashes': source_hashes,
+        'array': np.asarray(source_hashes, dtype=np.uint64),
+        'ignore': None,
+    }
+    common = shingle_index.common_shingles(source_hashes)
+    if common:
+        # Boolean mask of the upload's shingles that are too common to count as evidence
+        source['ignore'] = np.isin(source['array'], np.fromiter(common, dtype=np.uint64, count=len(common)))
+    if MATCHING_ENGINE == 'passages':
+        sequence = source_hashes
+        if source['ignore'] is not None:
+            # Negative values occur in no document, so common shingles end every passage
+            sequence = [-1 - i if ignored else h for i, (h, ignored) in enumerate(zip(source_hashes, source['ignore']))]
+        source['automaton'] = SuffixAutomaton(sequence)
+    elif MATCHING_ENGINE == 'winnowing':
+        source['fingerprints'] = winnow(source['array'], WINNOW_WINDOW)
+    return source
 
-    # Find matches
-    matches = []
-    total_similarity = 0
-    total_sources = 0
 
-    for existing_file in os.listdir(ASSIGNMENT_DIR):
-        if existing_file == filename or not allowed_file(existing_file):
-            continue
+def index_keys(source):
+    """Hashes of the upload to look up in the shingle index: its fingerprints when winnowing."""
+    keys = source['fingerprints'] if 'fingerprints' in source else np.arange(len(source['hashes']))
+    if source['ignore'] is not None:
+        # Common shingles have no postings
+        keys = keys[~source['ignore'][keys]]
+    elif 'fingerprints' not in source:
+        return source['hashes']
+    return source['array'][keys].tolist()
+
 
-        existing_file_path = os.path.join(ASSIGNMENT_DIR, existing_file)
-        if existing_file.endswith('.pdf'):
-            target_text = extract_text_from_pdf(existing_file_path)
-        elif existing_file.endswith('.docx'):
-            target_text = extract_text_from_docx(existing_file_path)
+def phrase_match(existing_file, source, target_hashes, target_words=None):
+    """
+    Phrase evidence for one corpus document with the configured MATCHING_ENGINE,
+    as compare_document returns it. Without target_words the shingle engine
+    matches on hashes alone (documents read from the token store).
+    """
+    if MATCHING_ENGINE == 'passages':
+        spans, similarity_percentage, fragments = match_passages(
+            source['automaton'], target_hashes, len(source['hashes']), n=SHINGLE_SIZE
+        )
+        matching_phrases = passage_texts(source['words'], spans)
+    elif MATCHING_ENGINE == 'winnowing':
+        spans, similarity_percentage, fragments = match_fingerprints(
+            source['fingerprints'], source['array'], np.asarray(target_hashes, dtype=np.uint64),
+            WINNOW_WINDOW, n=SHINGLE_SIZE, ignore=source['ignore']
+        )
+        matching_phrases = passage_texts(source['words'], spans)
+    else:
+        spans = []
+        if target_words is None:
+            matching_phrases, similarity_percentage = match_shingle_arrays(
+                source['words'], source['array'], target_hashes, n=SHINGLE_SIZE, spans=spans,
+                ignore=source['ignore']
+            )
         else:
+            matching_phrases, similarity_percentage = match_shingles(
+                source['words'], source['hashes'], target_words, target_hashes, n=SHINGLE_SIZE, spans=spans,
+                ignore=source['ignore']
+            )
+        fragments = len(matching_phrases)
+
+    if matching_phrases and similarity_percentage > 2:
+        return {
+            "document": f"{BASE_URL}/{existing_file}",
+            "document_name" : existing_file,
+            "matching_phrases": matching_phrases,
+            "similarity_percentage": similarity_percentage,
+            "spans": spans
+        }, similarity_percentage * fragments
+    return None
+
+
+def exact_match(existing_file):
+    return {
+        "document": f"{BASE_URL}/{existing_file}",
+        "document_name" : existing_file,
+        "matching_phrases": ["Exact match with uploaded file"],
+        "similarity_percentage": 100
+    }, 100  # Add 100% similarity for exact file
+
+
+def compare_stored_document(existing_file, source, stored):
+    """compare_document for a document in the token store; nothing is read but its arrays."""
+    text_digest, target_shingles = stored
+    if text_digest == EMPTY_TEXT_SHA256:
+        return None
+
+    if source['digest'] == text_digest:
+        return exact_match(existing_file)
+
+    return phrase_match(existing_file, source, target_shingles)
+
+
+def compare_document(existing_file, source, corpus=None):
+    """
+    Compare the upload (as returned by prepare_source) with one corpus document
+    of the corpus snapshot (the current one by default).
+    Returns (match, contribution to total_similarity), or None if it does not match.
+    """
+    if corpus is None:
+        corpus = resident_corpus.snapshot()
+    stored = corpus.get(existing_file)
+    metrics.cache_lookup('resident_corpus', hit=stored is not None)
+    if stored is not None:
+        return compare_stored_document(existing_file, source, stored)
+
+    existing_file_path = os.path.join(ASSIGNMENT_DIR, existing_file)
+    try:
+        # Not ingested yet: fall back to the cached text
+        target_text, target_words, target_hashes = load_corpus_document(existing_file_path)
+    except OSError as e:
+        print(f"Skipping {existing_file}: {e}")
+        return None
+
+    if not target_text:
+        return None
+
+    if source['text'] == target_text:
+        return exact_match(existing_file)
+
+    return phrase_match(existing_file, source, target_hashes, target_words)
+
+
+def compare_shard(shard):
+    """Worker entry point: compare the upload with one slice of the candidates."""
+    names, source = shard
+    corpus = resident_corpus.refresh()
+    return [compare_document(name, source, corpus) for name in names]
+
+
+_compare_pool = None
+
+def get_compare_pool():
+    # One persistent pool per process, so shard workers keep their resident documents
+    global _compare_pool
+    if _compare_pool is None:
+        _compare_pool = ProcessPoolExecutor(max_workers=PARALLEL_COMPARE_WORKERS)
+        # A job worker joins its children on exit, so stop the pool before that
+        # happens and before the pool's own queues are closed (exitpriority 10)
+        multiprocessing.util.Finalize(_compare_pool, _compare_pool.shutdown, exitpriority=100)
+    return _compare_pool
+
+
+def resubmitted_copies(digest, filename, corpus):
+    """Corpus documents (other than filename) whose normalized text has the upload's digest."""
+    return [name for name in corpus.text_duplicates(digest) if name != filename]
+
+
+def is_exact_match(match):
+    return match['matching_phrases'] == ["Exact match with uploaded file"]
+
+
+def select_candidates(source, filename, index_hits=None, corpus=None):
+    """
+    Corpus documents worth comparing with the upload, in comparison order.
+    index_hits is the shingle index lookup for the upload when the caller
+    already did it (batches look up all their uploads at once).
+    """
+    if corpus is None:
+        corpus = resident_corpus.snapshot()
+    source_hashes = source['hashes']
+
+    # A resubmitted document is answered by its exact copies, found by digest
+    # without scanning. Otherwise only documents sharing at least one shingle
+    # can produce matches.
+    duplicates = resubmitted_copies(source['digest'], filename, corpus)
+    if duplicates:
+        candidates = duplicates
+    elif source_hashes and CANDIDATE_FILTER == 'lsh':
+        candidates = [name for name, _ in lsh_index.top_candidates(source_hashes, LSH_TOP_K)]
+    elif source_hashes and CANDIDATE_FILTER == 'tfidf':
+        candidates = [name for name, _ in tfidf_index.top_candidates(source['text'], TFIDF_TOP_K)]
+    elif source_hashes:
+        candidates = sorted(index_hits if index_hits is not None else shingle_index.candidates(index_keys(source)))
+    else:
+        candidates = []
+    return [
+        name for name in candidates
+        if name != filename and allowed_file(name) and name.endswith(SUPPORTED_SUFFIXES)
+    ]
+
+
+def merge_results(results, matches=None, total_similarity=0, total_sources=0):
+    """Fold compare_document results into (matches, total_similarity, total_sources)."""
+    matches = [] if matches is None else matches
+    for result in results:
+        if result is None:
             continue
+        match, contribution = result
+        matches.append(match)
+        total_similarity += contribution
+        total_sources += 1 #len(matching_phrases)
+    return matches, total_similarity, total_sources
 
-        if target_text:
-            if source_text.strip() == target_text.strip():
-                matches.append({
-                    "document": f"{BASE_URL}/{existing_file}",
-                    "document_name" : existing_file,
-                    "matching_phrases": ["Exact match with uploaded file"],
-                    "similarity_percentage": 100
-                })
-                total_similarity += 100  # Add 100% similarity for exact file
-                total_sources += 1
-            else:
-                matching_phrases, similarity_percentage = find_matching_phrases(source_text, target_text, n=5)
-                if matching_phrases and similarity_percentage > 2:
-                    matches.append({
-                        "document": f"{BASE_URL}/{existing_file}",
-                        "document_name" : existing_file,
-                        "matching_phrases": matching_phrases,
-                        "similarity_percentage": similarity_percentage
-                    })
-                    total_similarity += similarity_percentage * len(matching_phrases)
-                    total_sources += 1 #len(matching_phrases)
 
+def for_document(result, existing_file):
+    """A compare_document result of a duplicate, reported under the name existing_file."""
+    if result is None or result[0]['document_name'] == existing_file:
+        return result
+    match, contribution = result
+    return dict(match, document=f"{BASE_URL}/{existing_file}", document_name=existing_file), contribution
+
+
+def compare_candidates(source, candidates, parallel=True, corpus=None):
+    """
+    compare_document for each candidate, in candidate order.
+    Duplicate documents are compared once, under their canonical name.
+    """
+    if corpus is None:
+        corpus = resident_corpus.snapshot()
+    canonical = [corpus.canonical.get(name, name) for name in candidates]
+    unique = list(dict.fromkeys(canonical))
+    if parallel and PARALLEL_COMPARE_WORKERS > 0 and len(unique) > PARALLEL_CHUNK_SIZE:
+        shards = [
+            (unique[i:i + PARALLEL_CHUNK_SIZE], source)
+            for i in range(0, len(unique), PARALLEL_CHUNK_SIZE)
+        ]
+        results = [result for shard in get_compare_pool().map(compare_shard, shards) for result in shard]
+    else:
+        results = [compare_document(name, source, corpus) for name in unique]
+    compared = dict(zip(unique, results))
+
+    return [for_document(compared[canonical_name], name) for name, canonical_name in zip(candidates, canonical)]
+
+
+def score_candidates(source, candidates, parallel=True, corpus=None):
+    """Compare the upload with candidates. Returns (matches, total_similarity, total_sources)."""
+    # Merge in candidate order so the totals match the serial scan exactly
+    return merge_results(compare_candidates(source, candidates, parallel, corpus))
+
+
+def scan_corpus(source_text, filename, corpus, since=None):
+    """
+    Compare source_text with the corpus documents that can match it, or with
+    only those added after revision since. Returns the compare_document
+    results of the matching documents, in candidate order.
+    """
+    with metrics.stage('prepare'):
+        source = prepare_source(source_text)
+    with metrics.stage('candidates'):
+        candidates = select_candidates(source, filename, corpus=corpus)
+        if since is not None:
+            added = corpus.added_since(since)
+            candidates = [name for name in candidates if name in added]
+    with metrics.stage('compare'):
+        return [result for result in compare_candidates(source, candidates, corpus=corpus) if result is not None]
+
+
+def compare_with_corpus(source_text, filename, corpus=None):
+    """
+    Compare source_text with the corpus documents that can match it.
+    Returns (matches, total_similarity, total_sources).
+    """
+    # One snapshot for the whole check, even if the corpus changes meanwhile
+    if corpus is None:
+        corpus = resident_corpus.refresh()
+    return merge_results(scan_corpus(source_text, filename, corpus))
+
+
+def decode_results(results):
+    """scan_corpus results read back from JSON, in the form scan_corpus returns them."""
+    # JSON turned the (match, contribution) pairs and word spans into lists
+    return [
+        (dict(match, spans=[tuple(span) for span in match['spans']]) if 'spans' in match else match, contribution)
+        for match, contribution in results
+    ]
+
+
+def scan_shards(source_text, filename):
+    """
+    scan_corpus across the shard servers. Returns (results, URLs of the shards
+    left out); the results cover the shards that answered.
+    """
+    with metrics.stage('shards'):
+        answers, missing = shard_client.scatter({'text': normalize_text(source_text), 'filename': filename})
+    if not answers:
+        raise RuntimeError('No corpus shard answered.')
+    results = [result for answer in answers.values() for result in decode_results(answer['results'])]
+    # A shard holding copies of a resubmitted document answers with those
+    # alone, as one node would; the other shards scanned their parts
+    if any(is_exact_match(match) for match, _ in results):
+        results = [result for result in results if is_exact_match(result[0])]
+    # Index candidates are scanned in name order, so this is the unsharded scan's order
+    return sorted(results, key=lambda result: result[0]['document_name']), missing
+
+
+def read_cached_check(cache_key):
+    """Result cache entry with its results in the form scan_corpus returns, or None."""
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        cached['results'] = decode_results(cached['results'])
+    return cached
+
+
+def update_cached_results(cached, filename, corpus):
+    """
+    Results of a cached check at the corpus snapshot: the cached ones if the
+    corpus did not change, merged with a scan of the documents added since if
+    it only grew, or None if the upload must be checked again. Incremental
+    scans need the candidates of the full scan to be a superset of theirs,
+    which holds for the shingle index but not for the top-k filters, and
+    unchanged documents to compare the same, which common-shingle suppression
+    breaks: added documents can make more shingles common.
+    """
+    revision = cached['revision']
+    if revision == corpus.revision:
+        return cached['results']
+    if CANDIDATE_FILTER != 'index' or MAX_SHINGLE_DF or not corpus.grown_since(revision):
+        return None
+    # Copies of the upload may have been added; those answer by digest (see
+    # select_candidates). The upload itself, synced back under its own name, is not one.
+    if resubmitted_copies(text_sha256(normalize_text(cached['text'])), filename, corpus):
+        return None
+
+    added = scan_corpus(cached['text'], filename, corpus, since=revision)
+    # Index candidates are scanned in name order, so this is the full scan's order
+    return sorted(cached['results'] + added, key=lambda result: result[0]['document_name'])
+
+
+def deliver_result(source_text, filename, insert_id, matches, total_similarity, total_sources, report=None):
+    """
+    Overall similarity, PDF report and save-response callback of one checked
+    upload. Returns the job result shown by the status endpoint. report is a
+    report already rendered for these matches, copied instead of rendering.
+    """
     #overall_similarity = (total_similarity / total_sources) if total_sources else 0
     overall_similarity = (total_similarity / total_sources) if total_sources else 0
     overall_similarity = min(overall_similarity * 100, 100)
     #overall_similarity = min((total_similarity / total_sources) if total_sources else 0, 100)
     print(total_similarity)
     print(total_sources)
-    os.remove(file_path)
-    print('Source file reomved successfully')
-    # if not matches:
-    #     matches.append({
-    #                 "document": f"No significant matches found.",
-    #                 "document_name" : "No significant matches found.",
-    #                 "matching_phrases": ["No significant matches found."],
-    #                 "similarity_percentage": 0
-    #             })
 
     # Generate report
     report_filename = f"{filename.rsplit('.', 1)[0]}_similarity_report.pdf"
 
-    pdf_path = generate_pdf_report(source_text, matches, overall_similarity, report_filename)
-    with open(pdf_path, 'rb') as file:
-        file_data = base64.b64encode(file.read()).decode('utf-8')
-    callback_url = "https://staging.portalteam.org/api/files/save-response"
-    #callback_url = "http://localhost/PortalCRM/api/files/save-response"
+    with metrics.stage('report'):
+        if report is not None:
+            def copy_report(stream):
+                with open(report, 'rb') as f:
+                    shutil.copyfileobj(f, stream)
+            pdf_path = write_report(report_filename, copy_report)
+            # Rendering lists the matches in report order; keep that order
+            matches.sort(key=lambda match: match["similarity_percentage"], reverse=True)
+        else:
+            pdf_path = generate_pdf_report(source_text, matches, overall_similarity, report_filename)
     data = {
         'insert_id': insert_id,
         'similarity': overall_similarity,
         'file_name': report_filename,
-        'file_data': file_data,
     }
-    
-    response = requests.post(callback_url, json=data)
-    
-    download_files(download_dir)
-    #print(f"Status Code: {response.status_code}")
-    #print(f"Response Headers: {response.headers}")
-    #print(f"Response Body: {response.text}")
-
-    # If you want to process the JSON response (if applicable)
-    #if response.headers.get('Content-Type') == 'application/json':
-        #response_json = response.json()
-        #print(f"Response JSON: {response_json}")
-    return jsonify({
+
+    # The report is sent as base64 'file_data' while it is read from disk
+    with metrics.stage('callback'):
+        status = delivery.send(data, pdf_path)
+    if status is None:
+        print(f"Callback for insert_id {insert_id} not delivered yet, kept in {OUTBOX_DIR}")
+    else:
+        print(f"Callback for insert_id {insert_id} returned {status}")
+
+    return {
         'message': 'Similarity report generated successfully.',
         "Total similarity" : f"{total_similarity}",
         "Total Source" : f"{total_sources}",
@@ -398,9 +956,557 @@ def check_similarity():
                 'similarity_percentage': f"{match['similarity_percentage']:.2f}",
             } for match in matches
         ]
-    }), 200
+    }
+
+
+def run_similarity_job(job):
+    """
+    Check one saved upload against the corpus, render the report and post it to
+    the save-response callback. Runs in a worker process; the returned dict is
+    the job result shown by the status endpoint.
+    """
+    file_path = job['file_path']
+    filename = job['filename']
+    insert_id = job['insert_id']
+
+    with metrics.Trace(f"insert_id={insert_id} job={job.get('job_id')}") as trace:
+        # One snapshot for the whole check, even if the corpus changes meanwhile
+        corpus = resident_corpus.refresh()
+        cached = results = None
+        missing_shards = []
+        try:
+            if result_cache is not None:
+                cache_key = result_cache.key(file_sha256(file_path), filename, MATCH_PARAMETERS)
+                cached = read_cached_check(cache_key)
+                metrics.cache_lookup('result_cache', hit=cached is not None)
+            if cached is not None:
+                source_text = cached['text']
+                results = update_cached_results(cached, filename, corpus)
+            if results is None:
+                # Extract source text
+                with metrics.stage('extract'):
+                    source_text = extract_text(file_path)
+        finally:
+            os.remove(file_path)
+            print('Source file reomved successfully')
+
+        if not source_text:
+            raise ValueError('Failed to extract text from the uploaded file.')
+
+        if results is None and shard_client is not None:
+            results, missing_shards = scan_shards(source_text, filename)
+        elif results is None:
+            results = scan_corpus(source_text, filename, corpus)
+        # Unchanged results keep their report; new ones are rendered and cached
+        report = result_cache.report_path(cache_key) if cached is not None and results == cached['results'] else None
+        matches, total_similarity, total_sources = merge_results(results)
+        result = deliver_result(source_text, filename, insert_id, matches, total_similarity, total_sources, report)
+        if result_cache is not None and (report is None or cached['revision'] != corpus.revision):
+            result_cache.put(cache_key, {'revision': corpus.revision, 'text': source_text, 'results': results},
+                             result['report_path'])
+    if missing_shards:
+        result['missing_shards'] = missing_shards
+    result['trace'] = trace.as_dict()
+    return result
+
+
+def prepare_upload(file_path):
+    """Batch worker: extract one spooled upload. Returns (source_text, source) or None."""
+    try:
+        source_text = extract_text(file_path)
+    except Exception as e:
+        print(f"Failed to extract {file_path}: {e}")
+        source_text = None
+    finally:
+        os.remove(file_path)
+    if not source_text:
+        return None
+    return source_text, prepare_source(source_text)
+
+
+def score_upload(work):
+    """Batch worker: score one upload against its corpus candidates."""
+    source, candidates = work
+    # Already running in a pool, so no nested comparison pool
+    return score_candidates(source, candidates, parallel=False, corpus=resident_corpus.refresh())
+
+
+def compare_submissions(sources, files):
+    """
+    Cross-compare the uploads of a batch (collusion between submissions due at
+    the same deadline). Returns, per upload, a list of (match, contribution)
+    against the other uploads, with the same scoring as corpus documents.
+    """
+    owners = defaultdict(list)
+    for i, source in enumerate(sources):
+        if source is not None:
+            for h in set(source['hashes']):
+                owners[h].append(i)
+
+    results = [[] for _ in sources]
+    for i, source in enumerate(sources):
+        if source is None or not source['hashes']:
+            continue
+        # Upload positions whose shingle a peer also has bound the phrases it can
+        # match, so peers that cannot pass the 2% threshold are skipped unscored
+        shared = Counter()
+        for h, count in Counter(source['hashes']).items():
+            for j in owners[h]:
+                shared[j] += count
+        for j in sorted(shared):
+            if j == i or not (shared[j] / len(source['hashes'])) * 100 > 2:
+                continue
+            peer, peer_file = sources[j], files[j]
+            if source['digest'] == peer['digest']:
+                result = exact_match(peer_file['filename'])
+            else:
+                result = phrase_match(peer_file['filename'], source, peer['hashes'], peer['words'])
+            if result is not None:
+                match, _ = result
+                match["document"] = peer_file['filename']
+                match["insert_id"] = peer_file['insert_id']
+                results[i].append(result)
+    return results
+
+
+def run_batch_similarity_job(job):
+    """
+    Check the uploads of one batch request: extract them in parallel, look up
+    corpus candidates for all of them at once, score them against the corpus
+    and each other, then deliver a report and callback per upload as single
+    checks do. A coordinator sends each upload to the shards instead.
+    """
+    files = job['files']
+    workers = min(BATCH_WORKERS, len(files))
+    insert_ids = ','.join(str(file['insert_id']) for file in files)
+    corpus = resident_corpus.refresh()
+    with metrics.Trace(f"insert_id={insert_ids} job={job.get('job_id')}", kind='batch') as trace:
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        run = pool.map if pool else map
+        try:
+            with metrics.stage('extract'):
+                prepared = list(run(prepare_upload, [file['file_path'] for file in files]))
+            sources = [item[1] if item else None for item in prepared]
+            checked = [i for i, source in enumerate(sources) if source is not None]
+
+            scored, missing_shards = {}, {}
+            if shard_client is not None:
+                for i in checked:
+                    shard_results, missing_shards[i] = scan_shards(prepared[i][0], files[i]['filename'])
+                    scored[i] = merge_results(shard_results)
+            else:
+                with metrics.stage('candidates'):
+                    index_hits = {}
+                    if CANDIDATE_FILTER == 'index':
+                        queries = [i for i in checked if sources[i]['hashes']]
+                        index_hits = dict(zip(queries, shingle_index.candidates_batch([index_keys(sources[i]) for i in queries])))
+                    work = [
+                        (sources[i], select_candidates(sources[i], files[i]['filename'], index_hits.get(i), corpus))
+                        for i in checked
+                    ]
+                with metrics.stage('compare'):
+                    scored = dict(zip(checked, run(score_upload, work)))
+        finally:
+            if pool:
+                pool.shutdown()
+
+        with metrics.stage('peers'):
+            peers = compare_submissions(sources, files)
+
+        results = []
+        for i, file in enumerate(files):
+            if i not in scored:
+                results.append({'insert_id': file['insert_id'], 'file_name': file['filename'],
+                                'error': 'Failed to extract text from the uploaded file.'})
+                continue
+            matches, total_similarity, total_sources = merge_results(peers[i], *scored[i])
+            result = deliver_result(prepared[i][0], file['filename'], file['insert_id'],
+                                    matches, total_similarity, total_sources)
+            result.update(insert_id=file['insert_id'], file_name=file['filename'])
+            if missing_shards.get(i):
+                result['missing_shards'] = missing_shards[i]
+            results.append(result)
+    return {'message': 'Batch similarity check finished.', 'results': results, 'trace': trace.as_dict()}
+
+
+# Mirror of the portal's files into downloaded_docs/
+delivery = Delivery(CALLBACK_URL, OUTBOX_DIR)
+corpus_watcher = DirectoryWatcher(ASSIGNMENT_DIR, apply_corpus_changes, accept=corpus_file)
+# The manifest stays where earlier versions kept it
+corpus_sync = CorpusSync(download_dir, FILES_API_URL, SYNC_MANIFEST, workers=SYNC_WORKERS, on_files=ingest_corpus_files,
+                         accept=corpus_file)
+
+
+
+def job_done(job_id, result):
+    # Timings come back with the result, since jobs run in worker processes
+    metrics.record_job(result)
+    metrics.update_gauges()
+    # Finished jobs wake the background sync instead of downloading on the request path
+    corpus_sync.trigger()
+
+
+job_queue = JobQueue(run_similarity_job, JOB_WORKERS, MAX_PENDING_JOBS, JOBS_DIR, on_done=job_done)
+
+# Every process sees the same corpus, outbox and sync, so those gauges take the
+# largest value across gunicorn workers instead of adding them up
+metrics.gauge_function(
+    'similarity_corpus_documents', 'Documents in the resident corpus.', lambda: len(resident_corpus.snapshot()),
+    mode='livemax')
+metrics.gauge_function(
+    'similarity_jobs_pending', 'Similarity jobs queued or running.', job_queue.depth)
+metrics.gauge_function(
+    'similarity_outbox_pending', 'Callbacks waiting in the outbox.', lambda: len(delivery.pending()),
+    mode='livemax')
+metrics.gauge_function(
+    'corpus_sync_last_duration_seconds', 'Duration of the last corpus sync.',
+    lambda: corpus_sync.last_duration or 0, mode='livemax')
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.http_in_flight.inc()
+
+
+@app.after_request
+def observe_request(response):
+    metrics.http_seconds.labels(
+        endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+        method=request.method, status=response.status_code,
+    ).observe(time.perf_counter() - g.request_started)
+    return response
+
+
+@app.teardown_request
+def finish_request(error=None):
+    if 'request_started' in g:
+        metrics.http_in_flight.dec()
+    metrics.update_gauges()
+
+
+def write_base64(encoded, file_path):
+    """
+    Decode a base64 string into file_path a chunk at a time, never holding the
+    whole file. Accepts and rejects exactly what base64.b64decode does:
+    characters outside the base64 alphabet are skipped, non-ASCII input raises.
+    """
+    if not encoded.isascii():
+        raise ValueError('string argument should contain only ASCII characters')
+    step = UPLOAD_CHUNK_SIZE // 3 * 4
+    carry = b''
+    with open(file_path, 'wb') as f:
+        for i in range(0, len(encoded), step):
+            chunk = carry + encoded[i:i + step].encode('ascii').translate(None, NON_BASE64)
+            if b'=' in chunk:
+                # Padding ends the data or is an error, depending on where it falls;
+                # leave that to one b64decode call over the rest (normally a few bytes)
+                carry = chunk + encoded[i + step:].encode('ascii').translate(None, NON_BASE64)
+                break
+            # Decode whole 4-character groups; the rest starts the next chunk
+            usable = len(chunk) - len(chunk) % 4
+            f.write(base64.b64decode(chunk[:usable]))
+            carry = chunk[usable:]
+        # A truncated final group fails here, as it would in one b64decode call
+        f.write(base64.b64decode(carry))
+
+
+def read_upload():
+    """
+    Work out how the upload was sent. Returns ((file_name, insert_id, save), None),
+    where save(file_path) writes the document to disk, or (None, error response).
+
+    - JSON: {"file": <base64>, "file_name": ..., "insert_id": ...} (original contract)
+    - multipart/form-data: a "file" part plus "insert_id" (and optional "file_name") fields;
+      werkzeug spools large parts to a temp file, which is copied in chunks
+    - raw body (application/octet-stream, PDF or DOCX type): the document itself, with
+      file_name and insert_id in the query string or X-File-Name / X-Insert-Id headers;
+      the body is streamed straight to disk
+    """
+    if request.is_json:
+        try:
+            data = request.get_json()
+        except Exception as e:
+            print("Error:", str(e))
+            return None, (jsonify({"error": str(e)}), 500)
+        #print("Data...", data)
+        if not data or 'file' not in data or 'insert_id' not in data:
+            print('Missing file or insert_id')
+            return None, (jsonify({'error': 'Missing file or insert_id'}), 400)
+        return (data['file_name'], data['insert_id'], lambda file_path: write_base64(data['file'], file_path)), None
+
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        insert_id = request.form.get('insert_id')
+        if upload is None or insert_id is None:
+            print('Missing file or insert_id')
+            return None, (jsonify({'error': 'Missing file or insert_id'}), 400)
+        return (request.form.get('file_name') or upload.filename, insert_id, upload.save), None
+
+    if request.mimetype in RAW_UPLOAD_TYPES:
+        file_name = request.args.get('file_name') or request.headers.get('X-File-Name')
+        insert_id = request.args.get('insert_id') or request.headers.get('X-Insert-Id')
+        if not file_name or insert_id is None:
+            print('Missing file_name or insert_id')
+            return None, (jsonify({'error': 'Missing file_name or insert_id'}), 400)
+
+        def save(file_path):
+            with open(file_path, 'wb') as f:
+                shutil.copyfileobj(request.stream, f, UPLOAD_CHUNK_SIZE)
+        return (file_name, insert_id, save), None
+
+    print("Request must be JSON, multipart/form-data or a raw file body")
+    return None, (jsonify({"error": "Request must be JSON, multipart/form-data or a raw file body"}), 400)
+
+
+@app.route('/check-similarity', methods=['POST'])
+def check_similarity():
+    print("Entered...")
+    print(request)
+    upload, error = read_upload()
+    if error:
+        return error
+    file_name, insert_id, save_upload = upload
+
+    if not allowed_file(file_name):
+        print('Unsupported file format. Upload a PDF, DOCX or DOC file.')
+        return jsonify({'error': 'Unsupported file format. Upload a PDF, DOCX or DOC file.'}), 400
+
+    filename = secure_filename(file_name)
+    if not filename.endswith(SUPPORTED_SUFFIXES):
+        print('Unsupported file type')
+        return jsonify({'error': 'Unsupported file type.'}), 400
+
+    # Reject before decoding when the workers cannot keep up
+    if job_queue.depth() >= MAX_PENDING_JOBS:
+        print('Job queue is full')
+        return jsonify({'error': 'Too many pending similarity checks, retry later.'}), 503, {'Retry-After': '30'}
+
+    # Spool the upload to disk for the worker process
+    job_id = uuid.uuid4().hex
+    file_path = os.path.join(UPLOADS_DIR, f"{job_id}_{filename}")
+    try:
+        with metrics.stage('save_upload'):
+            save_upload(file_path)
+        print(f"File saved successfully: {file_path}")
+    except Exception as e:
+        print(f"Error saving file: {e}")
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return jsonify({'error': 'Error saving the file.'}), 500
+
+    job = {'file_path': file_path, 'filename': filename, 'insert_id': insert_id, 'job_id': job_id}
+    if job_queue.submit(job, job_id=job_id) is None:
+        os.remove(file_path)
+        print('Job queue is full')
+        return jsonify({'error': 'Too many pending similarity checks, retry later.'}), 503, {'Retry-After': '30'}
+
+    # Inline mode keeps the old synchronous contract
+    if JOB_WORKERS <= 0:
+        status = job_queue.status(job_id)
+        if status['status'] == 'done':
+            return jsonify(status['result']), 200
+        return jsonify({'error': status.get('error', 'Similarity check failed.')}), 400
+
+    print(f"Queued job {job_id} for insert_id {insert_id}")
+    return jsonify({
+        'message': 'Similarity check queued.',
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id),
+    }), 202
+
+
+def read_batch_uploads():
+    """
+    Uploads of a batch request as ([(file_name, insert_id, save)], None), or
+    (None, error response).
+
+    - JSON: {"files": [{"file": <base64>, "file_name": ..., "insert_id": ...}, ...]}
+    - multipart/form-data: repeated "file" parts with one "insert_id" field per
+      file in the same order (and optionally one "file_name" per file); up to
+      MAX_BATCH_BYTES in total, each part spooled to a temp file as it arrives
+    - JSON is decoded whole, base64 and all, so the request stays within the
+      app-wide MAX_CONTENT_LENGTH (50MB, about 37MB of documents); send larger
+      batches as multipart
+    """
+    if request.mimetype == 'multipart/form-data':
+        # Must be set before the form is parsed; a file, insert_id and file_name per upload
+        request.max_content_length = MAX_BATCH_BYTES
+        request.max_form_parts = 3 * MAX_BATCH_FILES + 10
+
+    if request.is_json:
+        try:
+            data = request.get_json()
+        except RequestEntityTooLarge:
+            print("JSON batch over MAX_CONTENT_LENGTH")
+            return None, (jsonify({"error": "JSON batches are limited to 50MB, send larger batches as multipart/form-data"}), 413)
+        except Exception as e:
+            print("Error:", str(e))
+            return None, (jsonify({"error": str(e)}), 500)
+        files = data.get('files') if isinstance(data, dict) else None
+        if not isinstance(files, list) or not all(
+                isinstance(item, dict) and 'file' in item and 'file_name' in item and 'insert_id' in item
+                for item in files):
+            print('Missing files, or a file without file, file_name or insert_id')
+            return None, (jsonify({'error': 'Each entry of files needs file, file_name and insert_id'}), 400)
+        return [
+            (item['file_name'], item['insert_id'], lambda file_path, encoded=item['file']: write_base64(encoded, file_path))
+            for item in files
+        ], None
+
+    if request.mimetype == 'multipart/form-data':
+        uploads = request.files.getlist('file')
+        insert_ids = request.form.getlist('insert_id')
+        file_names = request.form.getlist('file_name') or [upload.filename for upload in uploads]
+        if len(insert_ids) != len(uploads) or len(file_names) != len(uploads):
+            print('Every file needs an insert_id')
+            return None, (jsonify({'error': 'Send one insert_id (and file_name, if any) per file'}), 400)
+        return [
+            (file_name, insert_id, upload.save)
+            for upload, insert_id, file_name in zip(uploads, insert_ids, file_names)
+        ], None
+
+    print("Batch requests must be JSON or multipart/form-data")
+    return None, (jsonify({"error": "Batch requests must be JSON or multipart/form-data"}), 400)
+
+
+@app.route('/check-similarity/batch', methods=['POST'])
+def check_similarity_batch():
+    """
+    Check many submissions in one job. Each upload gets its own report and
+    save-response callback, exactly as if it had been posted on its own.
+    """
+    uploads, error = read_batch_uploads()
+    if error:
+        return error
+    if not uploads:
+        return jsonify({'error': 'No files in the batch.'}), 400
+    if len(uploads) > MAX_BATCH_FILES:
+        return jsonify({'error': f'At most {MAX_BATCH_FILES} files per batch.'}), 400
+
+    for file_name, _, _ in uploads:
+        if not allowed_file(file_name) or not secure_filename(file_name).endswith(SUPPORTED_SUFFIXES):
+            print(f'Unsupported file format: {file_name}')
+            return jsonify({'error': f'Unsupported file format: {file_name}. Upload PDF, DOCX or DOC files.'}), 400
+
+    if job_queue.depth() >= MAX_PENDING_JOBS:
+        print('Job queue is full')
+        return jsonify({'error': 'Too many pending similarity checks, retry later.'}), 503, {'Retry-After': '30'}
+
+    job_id = uuid.uuid4().hex
+    files = []
+    try:
+        for i, (file_name, insert_id, save_upload) in enumerate(uploads):
+            filename = secure_filename(file_name)
+            file_path = os.path.join(UPLOADS_DIR, f"{job_id}_{i}_{filename}")
+            files.append({'file_path': file_path, 'filename': filename, 'insert_id': insert_id})
+            with metrics.stage('save_upload'):
+                save_upload(file_path)
+    except Exception as e:
+        print(f"Error saving file: {e}")
+        for file in files:
+            if os.path.exists(file['file_path']):
+                os.remove(file['file_path'])
+        return jsonify({'error': 'Error saving the files.'}), 500
+    print(f"Saved {len(files)} files for batch {job_id}")
+
+    if job_queue.submit({'files': files, 'job_id': job_id}, job_id=job_id, fn=run_batch_similarity_job) is None:
+        for file in files:
+            os.remove(file['file_path'])
+        print('Job queue is full')
+        return jsonify({'error': 'Too many pending similarity checks, retry later.'}), 503, {'Retry-After': '30'}
+
+    if JOB_WORKERS <= 0:
+        status = job_queue.status(job_id)
+        if status['status'] == 'done':
+            return jsonify(status['result']), 200
+        return jsonify({'error': status.get('error', 'Similarity check failed.')}), 400
+
+    print(f"Queued batch job {job_id} with {len(files)} files")
+    return jsonify({
+        'message': 'Batch similarity check queued.',
+        'job_id': job_id,
+        'files': len(files),
+        'status_url': url_for('job_status', job_id=job_id),
+    }), 202
+
+
+@app.route('/shard/score', methods=['POST'])
+def shard_score():
+    """
+    Shard server side of scatter-gather: compare {"text", "filename"} with
+    this node's part of the corpus. Returns the scan_corpus results and the
+    corpus revision they were computed at.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('text'), str):
+        return jsonify({'error': 'Missing text'}), 400
+    corpus = resident_corpus.refresh()
+    results = scan_corpus(data['text'], data.get('filename', ''), corpus)
+    return jsonify({'shard': SHARD_INDEX, 'revision': corpus.revision, 'results': results}), 200
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    status = job_queue.status(secure_filename(job_id))
+    if status is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+    return jsonify(status), 200
+
+
+@app.route('/jobs', methods=['GET'])
+def job_queue_stats():
+    """Queue depth, so callers can back off before they get 503s."""
+    return jsonify(job_queue.stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Stage latencies, cache hit rates and queue state in Prometheus text format,
+    for all gunicorn workers when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+_background_lock = None
+
+def start_background_tasks():
+    """
+    Start the corpus sync, directory watcher and outbox replay in this process
+    if no other process runs them. They write the corpus indexes, which allow a
+    single writer, so under gunicorn one worker holds BACKGROUND_LOCK and the
+    others retry every BACKGROUND_RETRY_INTERVAL seconds, taking over when the
+    holder exits (e.g. when it is recycled).
+    """
+    def acquire():
+        global _background_lock
+        lock_file = open(BACKGROUND_LOCK, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        _background_lock = lock_file  # Held until this process exits
+        print(f"Process {os.getpid()} runs the corpus sync and callback outbox")
+        # A coordinator holds no corpus, only callbacks
+        if shard_client is None:
+            corpus_sync.start(SYNC_INTERVAL)
+            corpus_watcher.start(WATCH_INTERVAL)
+        delivery.start(OUTBOX_INTERVAL)
+        return True
+
+    def retry():
+        while not acquire():
+            time.sleep(BACKGROUND_RETRY_INTERVAL)
+
+    if not acquire():
+        threading.Thread(target=retry, name='background-lock', daemon=True).start()
+
 
 if __name__ == '__main__':
-    download_files(download_dir)
+    # Development server; production runs gunicorn with gunicorn.conf.py (see wsgi.py)
+    if shard_client is None:
+        sync_corpus_index()
+    start_background_tasks()
     app.run(debug=True, host='0.0.0.0', port=8002)
  
\ No newline at end of file
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Constants
+# Seconds; checks range from milliseconds (cache hits) to minutes (scanned PDFs)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+# prometheus_client's multiprocess mode: every process writes its metrics here and
+# /metrics, served by any of them, adds them up (set by gunicorn.conf.py)
+METRICS_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+registry = CollectorRegistry()
+_gauge_functions = []  # (gauge, name, fn) set by update_gauges()
+
+stage_seconds = Histogram(
+    'similarity_stage_seconds', 'Time spent in each stage of a similarity check.', ['stage'],
+    buckets=LATENCY_BUCKETS, registry=registry)
+job_seconds = Histogram(
+    'similarity_job_seconds', 'Total time of a similarity job in its worker.', ['kind'],
+    buckets=LATENCY_BUCKETS, registry=registry)
+jobs_total = Counter(
+    'similarity_jobs_total', 'Finished similarity jobs.', ['outcome'], registry=registry)
+cache_requests = Counter(
+    'similarity_cache_requests_total', 'Cache lookups by cache and result (hit or miss).', ['cache', 'result'],
+    registry=registry)
+http_seconds = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency.', ['endpoint', 'method', 'status'],
+    buckets=LATENCY_BUCKETS, registry=registry)
+http_in_flight = Gauge(
+    'http_requests_in_flight', 'HTTP requests being served.', registry=registry, multiprocess_mode='livesum')
+
+
+def gauge_function(name, help, fn, mode='livesum'):
+    """
+    A gauge set from fn() by update_gauges(). Across processes the values of
+    live ones are added up ('livesum'), or the largest is taken ('livemax')
+    for values every process sees alike.
+    """
+    gauge = Gauge(name, help, registry=registry, multiprocess_mode=mode)
+    _gauge_functions.append((gauge, name, fn))
+    return gauge
+
+
+def update_gauges():
+    """Set this process' function gauges; other processes read them from its files."""
+    for gauge, name, fn in _gauge_functions:
+        try:
+            gauge.set(fn())
+        except Exception as e:
+            print(f"Failed to read {name}: {e}")
+
+
+def render():
+    """Prometheus text exposition format, over every process in multiprocess mode."""
+    update_gauges()
+    if not METRICS_DIR:
+        return generate_latest(registry)
+    collected = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collected, METRICS_DIR)
+    return generate_latest(collected)
+
+
+def mark_process_dead(pid, metrics_dir=METRICS_DIR):
+    """
+    Drop the live gauges of an exited process; its counters and histograms
+    still count. Call from gunicorn's master.
+    """
+    multiprocess.mark_process_dead(pid, metrics_dir)
+
+
+_local = threading.local()
+
+
+class Trace:
+    """
+    Stage timings and cache lookups of one similarity check, keyed by a
+    correlation id (the insert_id and job id).
+
+    While a trace is active on a thread, stage() and cache_lookup() record into
+    it instead of the metrics. Jobs run in worker processes, so the trace is
+    returned with the job result and folded into the metrics by record_job()
+    in the process that submitted the job.
+    """
+
+    def __init__(self, correlation_id, kind='single'):
+        self.correlation_id = correlation_id
+        self.kind = kind
+        self.timings = {}
+        self.cache = {}
+        self._started = None
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'trace', None)
+        _local.trace = self
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timings['total'] = time.perf_counter() - self._started
+        _local.trace = self._previous
+        self.log(failed=exc_type is not None)
+        return False
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def add_lookup(self, cache, hit):
+        counts = self.cache.setdefault(cache, {'hit': 0, 'miss': 0})
+        counts['hit' if hit else 'miss'] += 1
+
+    def log(self, failed=False):
+        stages = ' '.join(f"{stage}={seconds:.3f}s" for stage, seconds in self.timings.items())
+        lookups = ' '.join(f"{cache}={counts['hit']}/{counts['hit'] + counts['miss']}"
+                           for cache, counts in self.cache.items())
+        print(f"[{self.correlation_id}] {'failed' if failed else 'done'} {stages}"
+              + (f" cache_hits {lookups}" if lookups else ''))
+
+    def as_dict(self):
+        return {'correlation_id': self.correlation_id, 'kind': self.kind,
+                'timings': {stage: round(seconds, 6) for stage, seconds in self.timings.items()},
+                'cache': self.cache}
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as stage name of the current trace (or straight into the histogram)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        trace = current_trace()
+        if trace is not None:
+            trace.add_time(name, seconds)
+        else:
+            stage_seconds.labels(stage=name).observe(seconds)
+
+
+def cache_lookup(cache, hit):
+    trace = current_trace()
+    if trace is not None:
+        trace.add_lookup(cache, hit)
+    else:
+        cache_requests.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def record_job(result):
+    """Fold the trace returned with a job result into the metrics."""
+    if not result:
+        jobs_total.labels(outcome='failed').inc()
+        return
+    jobs_total.labels(outcome='done').inc()
+    trace = result.get('trace') or {}
+    timings = dict(trace.get('timings', {}))
+    total = timings.pop('total', None)
+    if total is not None:
+        job_seconds.labels(kind=trace.get('kind', 'single')).observe(total)
+    for name, seconds in timings.items():
+        stage_seconds.labels(stage=name).observe(seconds)
+    for cache, counts in trace.get('cache', {}).items():
+        for outcome, count in counts.items():
+            if count:
+                cache_requests.labels(cache=cache, result=outcome).inc(count)
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+# Constants
+LSH_PATH = "minhash_lsh.db"
+MERSENNE_PRIME = (1 << 31) - 1
+QUERY_CHUNK_SIZE = 900
+SIGNATURE_CHUNK = 20000  # shingles hashed per step, bounds the temporary matrix
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS signatures (
+    name TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS buckets_key ON buckets (band, bucket);
+CREATE INDEX IF NOT EXISTS buckets_name ON buckets (name);
+"""
+
+
+class MinHashLSH:
+    """
+    MinHash signatures of each document's shingle set, banded into an LSH table.
+
+    A signature has bands * rows values. Two documents become candidates when
+    all rows of at least one band agree, which happens with probability
+    1 - (1 - J**rows)**bands for Jaccard similarity J. More bands or fewer rows
+    raise recall for weakly similar documents at the cost of more candidates.
+    """
+
+    def __init__(self, path=LSH_PATH, bands=64, rows=1, seed=1):
+        self.path = path
+        self.bands = bands
+        self.rows = rows
+        self.num_perm = bands * rows
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, MERSENNE_PRIME, size=(self.num_perm, 1), dtype=np.uint64)
+        self._b = rng.randint(0, MERSENNE_PRIME, size=(self.num_perm, 1), dtype=np.uint64)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+        params = f"{bands}x{rows}/{seed}"
+        conn = self._conn()
+        with conn:
+            conn.executescript(SCHEMA)
+            row = conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+            if row and row[0] != params:
+                print(f"LSH table was built with {row[0]}, rebuilding for {params}")
+                conn.execute("DELETE FROM buckets")
+                conn.execute("DELETE FROM signatures")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('params', ?)", (params,))
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def signature(self, hashes):
+        """MinHash signature (uint64 array of num_perm values) of a set of shingle hashes."""
+        signature = np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint64)
+        values = np.fromiter((h & 0xffffffff for h in set(hashes)), dtype=np.uint64) % MERSENNE_PRIME
+        for start in range(0, len(values), SIGNATURE_CHUNK):
+            chunk = values[start:start + SIGNATURE_CHUNK]
+            permuted = (self._a * chunk + self._b) % MERSENNE_PRIME
+            np.minimum(signature, permuted.min(axis=1), out=signature)
+        return signature
+
+    def band_keys(self, signature):
+        """One bucket key per band, as signed 64-bit ints SQLite can store."""
+        keys = []
+        for band in range(self.bands):
+            values = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            digest = hashlib.blake2b(values, digest_size=8).digest()
+            keys.append(int.from_bytes(digest, 'little', signed=True))
+        return keys
+
+    def documents(self):
+        return dict(self._conn().execute("SELECT name, sha256 FROM signatures"))
+
+    def has_document(self, name, sha256):
+        """True if name is indexed with exactly this content hash."""
+        row = self._conn().execute("SELECT sha256 FROM signatures WHERE name = ?", (name,)).fetchone()
+        return bool(row) and row[0] == sha256
+
+    def add_document(self, name, sha256, hashes):
+        """Store the signature of a document. Returns False if it is already up to date."""
+        conn = self._conn()
+        row = conn.execute("SELECT sha256 FROM signatures WHERE name = ?", (name,)).fetchone()
+        if row and row[0] == sha256:
+            return False
+
+        signature = self.signature(hashes)
+        with self._write_lock, conn:
+            conn.execute("DELETE FROM buckets WHERE name = ?", (name,))
+            conn.execute(
+                "INSERT OR REPLACE INTO signatures (name, sha256, signature) VALUES (?, ?, ?)",
+                (name, sha256, signature.tobytes()),
+            )
+            if hashes:
+                conn.executemany(
+                    "INSERT INTO buckets (band, bucket, name) VALUES (?, ?, ?)",
+                    ((band, key, name) for band, key in enumerate(self.band_keys(signature))),
+                )
+        return True
+
+    def remove_document(self, name):
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.execute("DELETE FROM buckets WHERE name = ?", (name,))
+            conn.execute("DELETE FROM signatures WHERE name = ?", (name,))
+
+    def top_candidates(self, hashes, k):
+        """
+        Return up to k (document name, estimated Jaccard similarity) pairs for the
+        documents that share an LSH bucket with the query, best first.
+        """
+        if not hashes:
+            return []
+        conn = self._conn()
+        signature = self.signature(hashes)
+
+        names = set()
+        for band, key in enumerate(self.band_keys(signature)):
+            names.update(name for (name,) in conn.execute(
+                "SELECT name FROM buckets WHERE band = ? AND bucket = ?", (band, key)
+            ))
+
+        scored = []
+        names = list(names)
+        for start in range(0, len(names), QUERY_CHUNK_SIZE):
+            chunk = names[start:start + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            for name, blob in conn.execute(
+                f"SELECT name, signature FROM signatures WHERE name IN ({placeholders})", chunk
+            ):
+                other = np.frombuffer(blob, dtype=np.uint64)
+                scored.append((name, float(np.mean(other == signature))))
+
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:k]
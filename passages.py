@@ -0,0 +1,109 @@
+class SuffixAutomaton:
+    """
+    Suffix automaton of a sequence (here the upload's shingle hashes).
+
+    Built once in O(len(sequence)); every corpus document is then streamed
+    through it in O(len(document)) to find the maximal passages it shares with
+    the sequence. States are kept in parallel lists, which is considerably
+    lighter than one object per state.
+    """
+
+    def __init__(self, sequence):
+        self.next = [{}]
+        self.link = [-1]
+        self.length = [0]
+        self.first_end = [-1]  # End position of the first occurrence of the state's strings
+        last = 0
+        for i, c in enumerate(sequence):
+            cur = self._add_state(self.length[last] + 1, -1, i, {})
+            p = last
+            while p != -1 and c not in self.next[p]:
+                self.next[p][c] = cur
+                p = self.link[p]
+            if p == -1:
+                self.link[cur] = 0
+            else:
+                q = self.next[p][c]
+                if self.length[p] + 1 == self.length[q]:
+                    self.link[cur] = q
+                else:
+                    clone = self._add_state(self.length[p] + 1, self.link[q], self.first_end[q], dict(self.next[q]))
+                    while p != -1 and self.next[p].get(c) == q:
+                        self.next[p][c] = clone
+                        p = self.link[p]
+                    self.link[q] = self.link[cur] = clone
+            last = cur
+
+    def _add_state(self, length, link, first_end, transitions):
+        self.next.append(transitions)
+        self.link.append(link)
+        self.length.append(length)
+        self.first_end.append(first_end)
+        return len(self.length) - 1
+
+    def common_passages(self, target, min_length=1):
+        """
+        Maximal runs of target that also occur in the automaton's sequence, as
+        (sequence offset, target offset, length) in target order. The sequence
+        offset is that of the run's first occurrence.
+        """
+        next_, link, lengths, first_end = self.next, self.link, self.length, self.first_end
+        spans = []
+        state = length = 0
+        for j, c in enumerate(target):
+            while state and c not in next_[state]:
+                state = link[state]
+                length = lengths[state]
+            if c in next_[state]:
+                state = next_[state][c]
+                length += 1
+            else:
+                state = length = 0
+            # Report a run where the next element no longer extends it
+            if length >= min_length and (j + 1 == len(target) or target[j + 1] not in next_[state]):
+                spans.append((first_end[state] - length + 1, j - length + 1, length))
+        return spans
+
+
+def select_passages(spans, n):
+    """
+    Turn shingle-level runs into non-overlapping word passages of the source.
+
+    A run of m shingles covers m + n - 1 words. Passages are taken in source
+    order and trimmed where they overlap an earlier one, the same left-to-right
+    choice the shingle matcher makes; what is left must still be n words long.
+    """
+    passages = []
+    covered = 0
+    for source_offset, target_offset, run in sorted(spans, key=lambda span: (span[0], -span[2])):
+        length = run + n - 1
+        overlap = covered - source_offset
+        if overlap > 0:
+            source_offset += overlap
+            target_offset += overlap
+            length -= overlap
+        if length >= n:
+            passages.append((source_offset, target_offset, length))
+            covered = source_offset + length
+    return passages
+
+
+def match_passages(automaton, target_hashes, num_source_shingles, n=5):
+    """
+    Common passages between the upload (whose shingle hashes the automaton was
+    built from) and one document, as (spans, similarity percentage, fragments).
+
+    spans are (source word offset, target word offset, length in words).
+    fragments is the number of non-overlapping n-word phrases the spans hold,
+    len // n each, so the percentage is on the same scale as match_shingles.
+    """
+    if hasattr(target_hashes, 'tolist'):
+        target_hashes = target_hashes.tolist()
+    spans = select_passages(automaton.common_passages(target_hashes), n)
+    fragments = sum(length // n for _, _, length in spans)
+    similarity_percentage = (fragments / num_source_shingles) * 100 if num_source_shingles > 0 else 0
+    return spans, similarity_percentage, fragments
+
+
+def passage_texts(source_words, spans):
+    return [" ".join(source_words[start:start + length]) for start, _, length in spans]
@@ -0,0 +1,178 @@
+import multiprocessing
+import os
+import time
+
+from PyPDF2 import PdfReader
+
+# Constants
+# Extraction backend: 'pypdf2' (default), or 'pdfplumber' / 'pypdfium2' when installed.
+# Corpus text is cached by file content, so clear text_cache/ after switching.
+PDF_ENGINE = os.environ.get('PDF_ENGINE', 'pypdf2')
+# Processes extracting page ranges of one PDF; 0 extracts on the calling process,
+# where the time budget is only checked between pages and a hung page still hangs
+PDF_PAGE_WORKERS = int(os.environ.get('PDF_PAGE_WORKERS', 0))
+PDF_PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', 16))
+# Per-document budget: seconds spent and pages read before the rest is skipped
+PDF_TIME_BUDGET = float(os.environ.get('PDF_TIME_BUDGET', 60))
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', 2000))
+
+
+def _clean(message):
+    return str(message).encode('utf-8', 'ignore').decode('utf-8')
+
+
+def _pypdf2_pages(file_path):
+    reader = PdfReader(file_path)
+    return len(reader.pages), lambda i: reader.pages[i].extract_text(), None
+
+
+def _pdfplumber_pages(file_path):
+    import pdfplumber
+    pdf = pdfplumber.open(file_path)
+    return len(pdf.pages), lambda i: pdf.pages[i].extract_text(), pdf.close
+
+
+def _pypdfium2_pages(file_path):
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(file_path)
+
+    def page_text(i):
+        page = pdf[i]
+        textpage = page.get_textpage()
+        try:
+            return textpage.get_text_range()
+        finally:
+            textpage.close()
+            page.close()
+    return len(pdf), page_text, pdf.close
+
+
+# name -> open(file_path) returning (page count, page_text(i), close or None)
+ENGINES = {
+    'pypdf2': _pypdf2_pages,
+    'pdfplumber': _pdfplumber_pages,
+    'pypdfium2': _pypdfium2_pages,
+}
+
+
+def available_engines():
+    """Engines whose library can be imported here."""
+    available = ['pypdf2']
+    for name in ('pdfplumber', 'pypdfium2'):
+        try:
+            __import__(name)
+            available.append(name)
+        except ImportError:
+            continue
+    return available
+
+
+def open_pdf(file_path, engine=PDF_ENGINE):
+    opener = ENGINES.get(engine)
+    if opener is None:
+        raise ValueError(f"Unknown PDF engine: {engine}")
+    return opener(file_path)
+
+
+def _read_pages(page_text, start, stop, deadline=None):
+    """
+    Text of pages start..stop-1 as a list, one entry per page read. Pages that
+    fail to extract contribute ''. Stops early once time.time() passes deadline.
+    """
+    texts = []
+    for i in range(start, stop):
+        if deadline is not None and time.time() > deadline:
+            break
+        try:
+            texts.append(page_text(i) or '')  # Handle pages with no text
+        except Exception as e:
+            print(f"Skipped a problematic page due to: {_clean(e)}")
+            texts.append('')
+    return texts
+
+
+def _extract_range(task):
+    file_path, start, stop, engine = task
+    _, page_text, close = open_pdf(file_path, engine)
+    try:
+        return _read_pages(page_text, start, stop)
+    finally:
+        if close:
+            close()
+
+
+_page_pool = None
+_page_pool_pid = None
+
+def _get_page_pool(workers):
+    # multiprocessing.Pool rather than an executor: a hung page is only stopped by terminate().
+    # Forked from the fork server, as job workers are: the web process extracts
+    # PDFs on its sync thread while the watcher and outbox threads hold locks.
+    global _page_pool, _page_pool_pid
+    if _page_pool is None or _page_pool_pid != os.getpid():
+        _page_pool = multiprocessing.get_context('forkserver').Pool(workers)
+        _page_pool_pid = os.getpid()
+    return _page_pool
+
+
+def _reset_page_pool():
+    global _page_pool
+    if _page_pool is not None and _page_pool_pid == os.getpid():
+        _page_pool.terminate()
+    _page_pool = None
+
+
+def extract_pdf_text(file_path, engine=PDF_ENGINE, workers=PDF_PAGE_WORKERS,
+                     time_budget=PDF_TIME_BUDGET, max_pages=PDF_MAX_PAGES):
+    """
+    Extract the text of a PDF, or None if it cannot be opened.
+
+    With workers > 0, documents longer than one task's page range are split
+    across a pool of processes, and a range still running when the time budget
+    runs out is abandoned by terminating the pool, so one malformed page cannot
+    hold a job worker. Otherwise (the default, and for documents of one range)
+    the budget is only checked between pages: it bounds many slow pages, but a
+    single page that never returns blocks the caller.
+    """
+    deadline = time.time() + time_budget
+    name = os.path.basename(file_path)
+    try:
+        count, page_text, close = open_pdf(file_path, engine)
+    except Exception as e:
+        print(f"Error processing PDF file: {_clean(e)}")
+        return None
+
+    try:
+        if count > max_pages:
+            print(f"{name} has {count} pages, extracting the first {max_pages}")
+            count = max_pages
+        if workers <= 0 or count <= PDF_PAGES_PER_TASK:
+            texts = _read_pages(page_text, 0, count, deadline)
+            if len(texts) < count:
+                print(f"Time budget exhausted after {len(texts)} of {count} pages of {name}")
+            return ''.join(texts)
+    except Exception as e:
+        print(f"Error processing PDF file: {_clean(e)}")
+        return None
+    finally:
+        if close:
+            close()
+
+    tasks = [
+        (file_path, start, min(start + PDF_PAGES_PER_TASK, count), engine)
+        for start in range(0, count, PDF_PAGES_PER_TASK)
+    ]
+    pool = _get_page_pool(workers)
+    pending = [pool.apply_async(_extract_range, (task,)) for task in tasks]
+    texts = []
+    for task, result in zip(tasks, pending):
+        try:
+            texts.extend(result.get(timeout=max(0, deadline - time.time())))
+        except multiprocessing.TimeoutError:
+            print(f"Time budget exhausted at page {task[1]} of {count} of {name}")
+            _reset_page_pool()
+            break
+        except Exception as e:
+            print(f"Skipped pages {task[1]}-{task[2] - 1} due to: {_clean(e)}")
+    return ''.join(texts)
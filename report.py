@@ -0,0 +1,146 @@
+import os
+import re
+
+from fpdf import FPDF
+from unidecode import unidecode
+
+# Constants
+# Matching documents listed in a report, most similar first
+REPORT_MAX_SOURCES = int(os.environ.get('REPORT_MAX_SOURCES', 50))
+# Passages quoted per matching document, and words quoted per passage
+REPORT_MAX_PASSAGES = int(os.environ.get('REPORT_MAX_PASSAGES', 25))
+REPORT_MAX_PASSAGE_WORDS = int(os.environ.get('REPORT_MAX_PASSAGE_WORDS', 60))
+# Words of the uploaded document reproduced in the report
+REPORT_MAX_SOURCE_WORDS = int(os.environ.get('REPORT_MAX_SOURCE_WORDS', 50000))
+HIGHLIGHT_COLOR = (200, 30, 30)
+LINE_HEIGHT = 5
+WRITE_CHUNK_SIZE = 1024 * 1024  # characters of the finished document encoded per write
+
+
+def merge_spans(spans):
+    """
+    Merge (start, _, length) word spans into sorted, non-overlapping
+    (start, end) ranges; adjacent 5-word matches become one passage.
+    """
+    ranges = []
+    for start, _, length in sorted(spans):
+        end = start + length
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+    return [tuple(r) for r in ranges]
+
+
+def source_segments(source_text, ranges, max_words=REPORT_MAX_SOURCE_WORDS):
+    """
+    Split source_text into (text, highlighted) segments along word ranges,
+    keeping its own spacing and line breaks. Stops after max_words words.
+    """
+    words = list(re.finditer(r'\S+', source_text))
+    limit = min(len(words), max_words)
+    segments = []
+    position = 0  # character offset written so far
+    for start, end in ranges:
+        if start >= limit:
+            break
+        end = min(end, limit)
+        begin = words[start].start()
+        if begin > position:
+            segments.append((source_text[position:begin], False))
+        position = words[end - 1].end()
+        segments.append((source_text[begin:position], True))
+    tail = words[limit - 1].end() if limit else 0
+    if tail > position:
+        segments.append((source_text[position:tail], False))
+    return segments, len(words) - limit
+
+
+class ReportPDF(FPDF):
+    def footer(self):
+        self.set_y(-12)
+        self.set_font("Arial", 'I', size=8)
+        self.set_text_color(120, 120, 120)
+        self.cell(0, 5, f"Page {self.page_no()}", align="C")
+
+
+def render_report(stream, source_text, matches, overall_similarity):
+    """
+    Write the similarity report PDF to a binary stream. fpdf assembles the
+    whole document as a latin-1 string; it is encoded and written a chunk at a
+    time, so that string is the only full copy held.
+
+    The uploaded text appears once, with every matched word highlighted. Each
+    matching document (up to REPORT_MAX_SOURCES) then gets its own page with at
+    most REPORT_MAX_PASSAGES merged passages, so the size of a report no longer
+    grows with the number of 5-word matches.
+    """
+    pdf = ReportPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+
+    pdf.set_font("Arial", 'B', size=14)
+    pdf.cell(0, 10, "Detailed Similarity Report", ln=True, align="C")
+    pdf.ln(5)
+    pdf.set_font("Arial", size=12)
+    pdf.cell(0, 10, f"Overall Similarity: {overall_similarity:.2f}%", ln=True)
+
+    # In place, as before: callers list the matches in report order
+    matches.sort(key=lambda match: match["similarity_percentage"], reverse=True)
+    all_spans = [span for match in matches for span in match.get("spans") or ()]
+
+    # Uploaded text with the matched passages highlighted
+    pdf.set_font("Arial", 'B', size=12)
+    pdf.multi_cell(0, 10, "Source Document Content:", border='B')
+    pdf.ln(3)
+    pdf.set_font("Arial", size=10)
+    segments, omitted_words = source_segments(source_text or '', merge_spans(all_spans))
+    for text, highlighted in segments:
+        if highlighted:
+            pdf.set_text_color(*HIGHLIGHT_COLOR)
+        pdf.write(LINE_HEIGHT, unidecode(text))
+        if highlighted:
+            pdf.set_text_color(0, 0, 0)
+    if omitted_words:
+        pdf.ln(LINE_HEIGHT * 2)
+        pdf.set_font("Arial", 'I', size=10)
+        pdf.write(LINE_HEIGHT, f"[{omitted_words} more words not shown]")
+
+    words = (source_text or '').split()
+    for match in matches[:REPORT_MAX_SOURCES]:
+        pdf.add_page()
+        pdf.set_font("Arial", 'B', size=12)
+        pdf.multi_cell(0, 8, unidecode(f"Matching Document: {match['document_name']} "
+                                       f"({match['similarity_percentage']:.2f}% similarity)"))
+        pdf.set_font("Arial", 'U', size=10)
+        pdf.set_text_color(30, 60, 200)
+        pdf.cell(0, 8, "View File", ln=1, link=match['document'])
+        pdf.set_text_color(0, 0, 0)
+        pdf.ln(2)
+
+        pdf.set_font("Arial", size=10)
+        if match.get("spans"):
+            passages = merge_spans(match["spans"])
+            for start, end in passages[:REPORT_MAX_PASSAGES]:
+                quoted = words[start:min(end, start + REPORT_MAX_PASSAGE_WORDS)]
+                ellipsis = " ..." if end - start > REPORT_MAX_PASSAGE_WORDS else ""
+                pdf.multi_cell(0, LINE_HEIGHT, unidecode(
+                    f"Words {start + 1}-{end}: \"{' '.join(quoted)}{ellipsis}\""))
+                pdf.ln(2)
+            hidden = len(passages) - REPORT_MAX_PASSAGES
+        else:
+            for phrase in match["matching_phrases"][:REPORT_MAX_PASSAGES]:
+                pdf.multi_cell(0, LINE_HEIGHT, unidecode("Matching Phrase: " + phrase))
+            hidden = len(match["matching_phrases"]) - REPORT_MAX_PASSAGES
+        if hidden > 0:
+            pdf.set_font("Arial", 'I', size=10)
+            pdf.multi_cell(0, LINE_HEIGHT, f"... and {hidden} more passages")
+
+    if len(matches) > REPORT_MAX_SOURCES:
+        pdf.ln(5)
+        pdf.set_font("Arial", 'I', size=10)
+        pdf.multi_cell(0, LINE_HEIGHT, f"{len(matches) - REPORT_MAX_SOURCES} more matching documents not shown.")
+
+    document = pdf.output(dest='S')
+    for i in range(0, len(document), WRITE_CHUNK_SIZE):
+        stream.write(document[i:i + WRITE_CHUNK_SIZE].encode('latin1'))
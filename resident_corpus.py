@@ -0,0 +1,179 @@
+import os
+import threading
+
+
+class CorpusSnapshot:
+    """
+    Immutable view of the corpus at one token store version: per document name,
+    (text digest, shingle hashes), the hashes a read-only view into the token
+    store's memory-mapped file. Never modified once published.
+
+    Also indexes the documents by digest of their file bytes and of their
+    normalized text. Documents with the same text are duplicates: they compare
+    the same against any upload, so each has a canonical name (the first of
+    them) under which it is compared once.
+
+    revision is the token store revision of the snapshot; added maps each
+    document to the revision it was stored at and removed_revision is the last
+    revision that removed or replaced a document.
+    """
+
+    __slots__ = ('version', 'generation', 'documents', 'names', 'by_file', 'by_text', 'canonical',
+                 'revision', 'removed_revision', 'added', '_records')
+
+    def __init__(self, version, generation, documents, records, revision=0, removed_revision=0, added=None):
+        self.version = version
+        self.generation = generation
+        self.documents = documents
+        self.names = sorted(documents)
+        self._records = records  # {name: (sha256, shingle_offset)}, to reuse entries on refresh
+        self.revision = revision
+        self.removed_revision = removed_revision
+        self.added = added or {}
+        self.by_file = {}
+        self.by_text = {}
+        for name in self.names:
+            self.by_file.setdefault(records[name][0], []).append(name)
+            self.by_text.setdefault(documents[name][0], []).append(name)
+        self.canonical = {name: self.by_text[documents[name][0]][0] for name in self.names}
+
+    def get(self, name):
+        return self.documents.get(name)
+
+    def file_duplicates(self, sha256):
+        """Names of the documents whose file bytes have this digest."""
+        return self.by_file.get(sha256, [])
+
+    def text_duplicates(self, text_sha256):
+        """Names of the documents whose normalized text has this digest."""
+        return self.by_text.get(text_sha256, [])
+
+    def grown_since(self, revision):
+        """True if documents were only added, not removed or replaced, after revision."""
+        return self.removed_revision <= revision <= self.revision
+
+    def added_since(self, revision):
+        return {name for name, added in self.added.items() if added > revision}
+
+    def __contains__(self, name):
+        return name in self.documents
+
+    def __len__(self):
+        return len(self.documents)
+
+
+EMPTY_SNAPSHOT = CorpusSnapshot(None, None, {}, {})
+
+
+class ResidentCorpus:
+    """
+    The corpus kept in memory between requests, published as CorpusSnapshots.
+
+    Readers call snapshot(), a plain attribute read, and use that snapshot for a
+    whole check, so they see one consistent corpus without taking a lock. After
+    the token store changes, refresh() builds the next snapshot copy-on-write:
+    entries of unchanged documents are reused, changed and new ones are added,
+    removed ones dropped, and the new snapshot replaces the old one in a single
+    assignment. Each process holds its own snapshot; refresh() costs one stat
+    when nothing changed.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._snapshot = EMPTY_SNAPSHOT
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        return self._snapshot
+
+    def refresh(self):
+        """Publish a new snapshot if the token store changed. Returns the current snapshot."""
+        current = self._snapshot
+        if current.version is not None and current.version == self.store.version():
+            return current
+
+        with self._lock:
+            current = self._snapshot
+            version, index, shingles = self.store.read_all()
+            generation, records = index['generation'], index['documents']
+            if version is not None and version == current.version:
+                return current
+
+            # Entries of another generation point into a file that compaction replaced
+            reuse = current._records if generation == current.generation else {}
+            documents = {}
+            keys = {}
+            shared = {}  # Duplicates share their arrays in the store, and one entry here
+            for name, doc in records.items():
+                key = (doc['sha256'], doc['shingle_offset'])
+                extent = (doc['text_sha256'], doc['shingle_offset'])
+                if reuse.get(name) == key:
+                    documents[name] = shared.setdefault(extent, current.documents[name])
+                else:
+                    documents[name] = shared.get(extent) or shared.setdefault(extent, (
+                        doc['text_sha256'],
+                        shingles[doc['shingle_offset']:doc['shingle_offset'] + doc['shingle_count']],
+                    ))
+                keys[name] = key
+
+            added = {name: doc.get('revision', 0) for name, doc in records.items()}
+            snapshot = CorpusSnapshot(version, generation, documents, keys,
+                                      index['revision'], index['removed_revision'], added)
+            self._snapshot = snapshot
+            return snapshot
+
+
+class DirectoryWatcher:
+    """
+    Polls a directory and reports files that appeared, changed (size or mtime)
+    or disappeared since the previous scan. Only names accepted by accept(name)
+    are watched, so temp files of in-progress downloads are ignored.
+    """
+
+    def __init__(self, directory, on_change, accept=None):
+        self.directory = directory
+        self.on_change = on_change
+        self.accept = accept or (lambda name: True)
+        self._seen = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def scan(self):
+        listing = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and self.accept(entry.name):
+                    stat = entry.stat()
+                    listing[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return listing
+
+    def poll(self):
+        """Scan once and call on_change(changed_paths, removed_names) if anything differs."""
+        listing = self.scan()
+        seen = self._seen if self._seen is not None else listing
+        self._seen = listing
+        changed = [os.path.join(self.directory, name) for name, version in sorted(listing.items())
+                   if seen.get(name) != version]
+        removed = sorted(name for name in seen if name not in listing)
+        if changed or removed:
+            self.on_change(changed, removed)
+        return changed, removed
+
+    def start(self, interval):
+        """Take the current listing as the baseline, then poll every interval seconds."""
+        if self._thread is not None:
+            return
+        self._seen = self.scan()
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.poll()
+                except Exception as e:
+                    print(f"Watching {self.directory} failed: {e}")
+
+        self._thread = threading.Thread(target=run, name='corpus-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
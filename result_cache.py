@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from text_cache import atomic_write
+
+# Constants
+RESULT_CACHE_DIR = "result_cache/"
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+class ResultCache:
+    """
+    Disk cache of finished similarity checks, so a resubmitted file is not
+    extracted, scanned and rendered again.
+
+    Each entry is <key>.json (the upload's text, its per-document results and
+    the corpus revision they were computed at) plus <key>.pdf, the rendered
+    report. Reading an entry touches it, and after every write the least
+    recently used entries are evicted until the cache fits in max_bytes.
+    Worker processes share the directory; files are replaced by rename, and an
+    entry whose files disappear under a reader is a miss.
+    """
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """Cache key of JSON-serializable parts (upload hash, matcher parameters, ...)."""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, f"{key}.{suffix}")
+
+    def report_path(self, key):
+        return self._path(key, 'pdf')
+
+    def get(self, key):
+        """Return the entry stored under key, or None. Marks it recently used."""
+        entry_path = self._path(key, 'json')
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self.report_path(key)):
+            return None
+        return entry
+
+    def put(self, key, entry, report_path):
+        """Store entry and a copy of the report at report_path under key."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        os.close(fd)
+        try:
+            shutil.copyfile(report_path, tmp_path)
+            os.replace(tmp_path, self.report_path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        atomic_write(self._path(key, 'json'), json.dumps(entry))
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = {}
+            total = 0
+            with os.scandir(self.cache_dir) as listing:
+                for item in listing:
+                    key, _, suffix = item.name.partition('.')
+                    if suffix not in ('json', 'pdf'):
+                        continue
+                    try:
+                        stat = item.stat()
+                    except FileNotFoundError:
+                        continue
+                    size, used = entries.get(key, (0, 0))
+                    used = max(used, stat.st_mtime) if suffix == 'json' else used
+                    entries[key] = (size + stat.st_size, used)
+                    total += stat.st_size
+
+            for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes:
+                    break
+                for suffix in ('json', 'pdf'):
+                    try:
+                        os.remove(self._path(key, suffix))
+                    except FileNotFoundError:
+                        pass
+                total -= size
@@ -0,0 +1,62 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from corpus_sync import make_session
+
+# Constants
+SHARD_QUERY_TIMEOUT = 120  # seconds a shard gets to score one upload
+SHARD_CONNECT_TIMEOUT = 5
+
+
+def shard_of(name, count):
+    """Shard (0 to count - 1) owning the corpus document name, the same on every node."""
+    digest = hashlib.sha256(name.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+class ShardClient:
+    """
+    Scatter-gather over shard servers, each of which holds one hash partition
+    of the corpus and scores uploads against it at POST <url>/shard/score.
+
+    A query goes to every shard at once and waits at most timeout seconds. A
+    shard that is down, answers with an error or misses the deadline is left
+    out, so the answer covers the other partitions; the caller is told which
+    shards are missing.
+    """
+
+    def __init__(self, urls, timeout=SHARD_QUERY_TIMEOUT):
+        self.urls = [url.strip().rstrip('/') for url in urls]
+        self.timeout = timeout
+        # POSTs are never retried (see make_session), a missing shard is reported instead
+        self.session = make_session(len(self.urls))
+
+    def _query(self, url, payload):
+        response = self.session.post(f"{url}/shard/score", json=payload,
+                                     timeout=(min(SHARD_CONNECT_TIMEOUT, self.timeout), self.timeout))
+        response.raise_for_status()
+        return response.json()
+
+    def scatter(self, payload):
+        """
+        POST payload to every shard. Returns ({url: response JSON} of the shards
+        that answered in time, [urls of those that did not]).
+        """
+        # A fresh pool per query, so a shard that hangs past its deadline never
+        # holds up the next query while its read times out
+        pool = ThreadPoolExecutor(max_workers=len(self.urls), thread_name_prefix='shard')
+        try:
+            futures = {pool.submit(self._query, url, payload): url for url in self.urls}
+            done, _ = wait(futures, timeout=self.timeout)
+        finally:
+            pool.shutdown(wait=False)
+
+        answers, missing = {}, []
+        for future, url in futures.items():
+            if future in done and future.exception() is None:
+                answers[url] = future.result()
+                continue
+            error = future.exception() if future in done else f"no answer within {self.timeout}s"
+            print(f"Shard {url} left out of the check: {error}")
+            missing.append(url)
+        return answers, missing
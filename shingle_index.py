@@ -0,0 +1,274 @@
+import os
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from shingles import text_shingles
+from winnowing import winnow
+
+# Constants
+INDEX_PATH = "shingle_index.db"
+QUERY_CHUNK_SIZE = 900  # stay under SQLite's bound-parameter limit
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    shingle INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS postings_shingle ON postings (shingle);
+CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+CREATE TABLE IF NOT EXISTS document_frequency (
+    shingle INTEGER PRIMARY KEY,
+    df INTEGER NOT NULL
+);
+"""
+
+
+class ShingleIndex:
+    """
+    Persistent inverted index from hashed n-word shingles to the corpus
+    documents (and word positions) that contain them.
+
+    Documents are keyed by file name and re-indexed when their content hash
+    changes. With window > 1 only the winnowed fingerprints of each document are
+    indexed (see winnowing.py), and queries should use fingerprints too.
+
+    With max_df > 0 the index also keeps the document frequency of every
+    shingle, and shingles in more than max_df documents (templates, question
+    text, boilerplate) get no postings. The hashes of the documents are read
+    back from token_store (see token_store.py): removing a document decrements
+    the frequencies of its shingles, and postings come back, from the documents
+    that contain them, when a shingle drops to max_df documents again. A
+    document must therefore leave the index before its old version leaves the
+    token store.
+
+    The index is rebuilt from scratch if it was built with another n, window or max_df.
+    """
+
+    def __init__(self, path=INDEX_PATH, n=5, window=1, max_df=0, token_store=None):
+        if max_df and token_store is None:
+            raise ValueError("A shingle index with max_df needs the token store")
+        self.path = path
+        self.n = n
+        self.window = window
+        self.max_df = max_df
+        self.token_store = token_store
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+        conn = self._conn()
+        with conn:
+            conn.executescript(SCHEMA)
+            built = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('n', 'window', 'max_df')"))
+            # Older indexes have no window or max_df and hold every shingle
+            params = {'n': n, 'window': window, 'max_df': max_df}
+            previous = {key: int(built.get(key, 1 if key == 'window' else 0)) for key in params}
+            if built and previous != params:
+                print(f"Shingle index was built with {previous}, rebuilding for {params}")
+                conn.execute("DELETE FROM postings")
+                conn.execute("DELETE FROM documents")
+                conn.execute("DELETE FROM document_frequency")
+            conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             [(key, str(value)) for key, value in params.items()])
+
+    def _conn(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def documents(self):
+        """Return {name: sha256} for every indexed document."""
+        return dict(self._conn().execute("SELECT name, sha256 FROM documents"))
+
+    def add_document(self, name, sha256, text):
+        """
+        Index text under name. Returns False if the same content is already indexed.
+        """
+        conn = self._conn()
+        row = conn.execute("SELECT doc_id, sha256 FROM documents WHERE name = ?", (name,)).fetchone()
+        if row and row[1] == sha256:
+            return False
+
+        _, hashes = text_shingles(text or '', self.n)
+        positions = self._posting_positions(hashes)
+        with self._write_lock, conn:
+            if row:
+                self._delete(conn, row[0])
+            doc_id = conn.execute(
+                "INSERT INTO documents (name, sha256) VALUES (?, ?)", (name, sha256)
+            ).lastrowid
+            common = {}
+            if self.max_df:
+                unique = set(hashes)
+                conn.executemany(
+                    "INSERT INTO document_frequency (shingle, df) VALUES (?, 1) "
+                    "ON CONFLICT (shingle) DO UPDATE SET df = df + 1",
+                    ((h,) for h in unique),
+                )
+                common = self._frequent(conn, unique)
+                # Shingles that just became common lose the postings of other documents too
+                self._execute_chunked(conn, "DELETE FROM postings WHERE shingle IN ({})",
+                                      [h for h, df in common.items() if df == self.max_df + 1])
+            conn.executemany(
+                "INSERT INTO postings (shingle, doc_id, position) VALUES (?, ?, ?)",
+                ((hashes[position], doc_id, position) for position in positions if hashes[position] not in common),
+            )
+        return True
+
+    def remove_document(self, name):
+        conn = self._conn()
+        with self._write_lock, conn:
+            row = conn.execute("SELECT doc_id FROM documents WHERE name = ?", (name,)).fetchone()
+            if row:
+                self._delete(conn, row[0])
+
+    def _posting_positions(self, hashes):
+        return winnow(hashes, self.window).tolist() if self.window > 1 else range(len(hashes))
+
+    @staticmethod
+    def _execute_chunked(conn, sql, values):
+        for start in range(0, len(values), QUERY_CHUNK_SIZE):
+            chunk = values[start:start + QUERY_CHUNK_SIZE]
+            conn.execute(sql.format(",".join("?" * len(chunk))), chunk)
+
+    def _frequent(self, conn, shingles):
+        """{shingle: df} of the given shingles that are in more than max_df documents."""
+        unique = list(shingles)
+        frequent = {}
+        for start in range(0, len(unique), QUERY_CHUNK_SIZE):
+            chunk = unique[start:start + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            frequent.update(conn.execute(
+                f"SELECT shingle, df FROM document_frequency WHERE shingle IN ({placeholders}) AND df > ?",
+                chunk + [self.max_df],
+            ))
+        return frequent
+
+    def _delete(self, conn, doc_id):
+        """Remove a document inside the caller's transaction, updating document frequencies."""
+        if self.max_df:
+            name, sha256 = conn.execute("SELECT name, sha256 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            stored = self.token_store.get(name) if self.token_store.has_document(name, sha256) else None
+            if stored is None:
+                print(f"Token store has no copy of {name}, its shingle frequencies stay counted")
+                unique = set()
+            else:
+                unique = set(stored[1].tolist())
+            was_common = self._frequent(conn, unique)
+            conn.executemany("UPDATE document_frequency SET df = df - 1 WHERE shingle = ?", ((h,) for h in unique))
+            conn.executemany("DELETE FROM document_frequency WHERE shingle = ? AND df <= 0", ((h,) for h in unique))
+            restored = [h for h, df in was_common.items() if df == self.max_df + 1]
+            if restored:
+                self._restore_postings(conn, restored, exclude=name)
+        conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+        conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    def _restore_postings(self, conn, shingles, exclude):
+        """Re-add the postings of shingles that are no longer common, for the documents that contain them."""
+        wanted = np.asarray(shingles, dtype=np.uint64)
+        found = self.token_store.documents_with(wanted)
+        found.pop(exclude, None)
+        names = list(found)
+        indexed = {}
+        for start in range(0, len(names), QUERY_CHUNK_SIZE):
+            chunk = names[start:start + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            for doc_id, name, sha256 in conn.execute(
+                f"SELECT doc_id, name, sha256 FROM documents WHERE name IN ({placeholders})", chunk
+            ):
+                # Skip a stored version the index does not hold
+                if found[name][0] == sha256:
+                    indexed[name] = doc_id
+        for name, doc_id in indexed.items():
+            hashes = found[name][1]
+            positions = np.asarray(self._posting_positions(hashes), dtype=np.int64)
+            hits = positions[np.isin(hashes[positions], wanted)]
+            conn.executemany(
+                "INSERT INTO postings (shingle, doc_id, position) VALUES (?, ?, ?)",
+                ((int(hashes[position]), doc_id, int(position)) for position in hits.tolist()),
+            )
+
+    def common_shingles(self, hashes):
+        """The shingles among hashes that are in more than max_df documents (none if max_df is 0)."""
+        if not self.max_df or not hashes:
+            return set()
+        return set(self._frequent(self._conn(), set(hashes)))
+
+    def candidates(self, hashes):
+        """
+        Look up a set of shingle hashes once and return a Counter of
+        {document name: number of distinct shingles shared with the query}.
+        """
+        conn = self._conn()
+        unique = list(set(hashes))
+        hits = Counter()
+        for start in range(0, len(unique), QUERY_CHUNK_SIZE):
+            chunk = unique[start:start + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT doc_id, COUNT(DISTINCT shingle) FROM postings "
+                f"WHERE shingle IN ({placeholders}) GROUP BY doc_id",
+                chunk,
+            )
+            for doc_id, count in rows:
+                hits[doc_id] += count
+
+        names = {}
+        doc_ids = list(hits)
+        for start in range(0, len(doc_ids), QUERY_CHUNK_SIZE):
+            chunk = doc_ids[start:start + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            names.update(conn.execute(
+                f"SELECT doc_id, name FROM documents WHERE doc_id IN ({placeholders})", chunk
+            ))
+        return Counter({names[doc_id]: count for doc_id, count in hits.items() if doc_id in names})
+
+    def candidates_batch(self, hash_lists):
+        """
+        candidates() for several queries with one pass over the index: the union
+        of their shingles is looked up once, which pays off when submissions
+        share text (the assignment prompt, a common template).
+        Returns one Counter per query, in order.
+        """
+        conn = self._conn()
+        unique = list(set().union(*hash_lists)) if hash_lists else []
+        shingle_docs = defaultdict(list)
+        for start in range(0, len(unique), QUERY_CHUNK_SIZE):
+            chunk = unique[start:start + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            for shingle, doc_id in conn.execute(
+                f"SELECT DISTINCT shingle, doc_id FROM postings WHERE shingle IN ({placeholders})", chunk
+            ):
+                shingle_docs[shingle].append(doc_id)
+
+        names = dict(conn.execute("SELECT doc_id, name FROM documents"))
+        results = []
+        for hashes in hash_lists:
+            hits = Counter()
+            for shingle in set(hashes):
+                hits.update(shingle_docs.get(shingle, ()))
+            results.append(Counter({names[doc_id]: count for doc_id, count in hits.items() if doc_id in names}))
+        return results
+
+    def postings(self, shingle):
+        """Return the [(document name, position)] posting list of one shingle hash."""
+        return list(self._conn().execute(
+            "SELECT d.name, p.position FROM postings p JOIN documents d ON d.doc_id = p.doc_id "
+            "WHERE p.shingle = ? ORDER BY d.name, p.position",
+            (shingle,),
+        ))
@@ -0,0 +1,42 @@
+import hashlib
+from functools import lru_cache
+
+# Rolling hash parameters: polynomial hash over token ids modulo a Mersenne prime
+HASH_MODULUS = (1 << 61) - 1
+HASH_BASE = 0x5bd1e9955bd1e995 % HASH_MODULUS
+
+
+@lru_cache(maxsize=1 << 20)
+def token_id(word):
+    """Stable 61-bit id of a word, identical across processes and restarts."""
+    digest = hashlib.blake2b(word.encode('utf-8', 'ignore'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % HASH_MODULUS
+
+
+def token_ids(words):
+    return [token_id(word) for word in words]
+
+
+def shingle_hashes(ids, n=5):
+    """
+    Hash every window of n consecutive token ids with a rolling hash.
+    hashes[i] identifies the n-gram that starts at word i.
+    """
+    if len(ids) < n:
+        return []
+
+    high = pow(HASH_BASE, n - 1, HASH_MODULUS)
+    h = 0
+    for tid in ids[:n]:
+        h = (h * HASH_BASE + tid) % HASH_MODULUS
+    hashes = [h]
+    for i in range(n, len(ids)):
+        h = ((h - ids[i - n] * high) * HASH_BASE + ids[i]) % HASH_MODULUS
+        hashes.append(h)
+    return hashes
+
+
+def text_shingles(text, n=5):
+    """Split text into words and return (words, shingle hashes)."""
+    words = text.split()
+    return words, shingle_hashes(token_ids(words), n)
@@ -0,0 +1,121 @@
+"""CorpusSync against a local stand-in for the portal's /api/files endpoint."""
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from corpus_sync import CorpusSync
+
+
+class FilesStub:
+    """Serves files ({name: bytes}) as the portal does: a listing at /api/files and each file with an ETag."""
+
+    def __init__(self, files):
+        self.files = dict(files)
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(self.path)
+                if self.path == '/api/files':
+                    listing = [{'file_name': name, 'file_link': f"{stub.url}/files/{name}", 'size': len(data)}
+                               for name, data in sorted(stub.files.items())]
+                    return self.reply(200, json.dumps({'data': listing}).encode('utf-8'))
+                data = stub.files.get(self.path[len('/files/'):])
+                if data is None:
+                    return self.reply(404, b'')
+                etag = '"' + hashlib.sha256(data).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    return self.reply(304, b'')
+                self.reply(200, data, etag)
+
+            def reply(self, status, body, etag=None):
+                self.send_response(status)
+                if etag:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def file_requests(self):
+        return [path for path in self.requests if path.startswith('/files/')]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    stub = FilesStub({'a.docx': b'first', 'b.pdf': b'second', 'notes.txt': b'skipped'})
+    yield stub
+    stub.close()
+
+
+def corpus_file(name):
+    return name.endswith(('.pdf', '.docx', '.doc'))
+
+
+def test_sync_downloads_new_files_once(stub, tmp_path):
+    directory = tmp_path / 'docs'
+    synced = []
+    sync = CorpusSync(str(directory), f"{stub.url}/api/files", on_files=synced.extend, accept=corpus_file)
+
+    assert sorted(os.path.basename(path) for path in sync.sync()) == ['a.docx', 'b.pdf']
+    assert (directory / 'a.docx').read_bytes() == b'first'
+    assert sorted(os.listdir(directory)) == ['.sync_manifest.json', 'a.docx', 'b.pdf']
+    assert len(synced) == 2
+
+    # A restarted sync reads the manifest and fetches nothing
+    stub.requests.clear()
+    assert CorpusSync(str(directory), f"{stub.url}/api/files", accept=corpus_file).sync() == []
+    assert stub.file_requests() == []
+
+
+def test_changed_listing_is_fetched_again(stub, tmp_path):
+    directory = tmp_path / 'docs'
+    sync = CorpusSync(str(directory), f"{stub.url}/api/files", accept=corpus_file)
+    sync.sync()
+
+    stub.files['a.docx'] = b'first, edited'
+    stub.requests.clear()
+    assert [os.path.basename(path) for path in sync.sync()] == ['a.docx']
+    assert stub.file_requests() == ['/files/a.docx']
+    assert (directory / 'a.docx').read_bytes() == b'first, edited'
+
+
+def test_unmodified_file_is_not_rewritten(stub, tmp_path):
+    directory = tmp_path / 'docs'
+    sync = CorpusSync(str(directory), f"{stub.url}/api/files", accept=corpus_file)
+    sync.sync()
+
+    # Listing metadata changed, content did not: the ETag answers 304
+    sync.manifest['b.pdf']['listing'] = {}
+    assert sync.sync() == []
+    assert stub.file_requests()[-1] == '/files/b.pdf'
+
+
+def test_directories_keep_their_own_manifests(stub, tmp_path):
+    first, second = tmp_path / 'first', tmp_path / 'second'
+    CorpusSync(str(first), f"{stub.url}/api/files", accept=corpus_file).sync()
+
+    downloaded = CorpusSync(str(second), f"{stub.url}/api/files", accept=corpus_file).sync()
+    assert sorted(os.path.basename(path) for path in downloaded) == ['a.docx', 'b.pdf']
+    assert sorted(json.loads((first / '.sync_manifest.json').read_text())) == ['a.docx', 'b.pdf']
+
+
+def test_unreachable_listing_changes_nothing(tmp_path):
+    sync = CorpusSync(str(tmp_path / 'docs'), "http://127.0.0.1:9/api/files")
+    assert sync.sync() is None
+    assert os.listdir(tmp_path / 'docs') == []
@@ -0,0 +1,112 @@
+"""Delivery against a local stand-in for the save-response callback."""
+import base64
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from delivery import Delivery
+
+
+class CallbackStub:
+    """Answers every POST with the next status of statuses (the last one repeats) and keeps the bodies."""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.bodies = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                stub.bodies.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+                status = stub.statuses.pop(0) if len(stub.statuses) > 1 else stub.statuses[0]
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def report(tmp_path):
+    path = tmp_path / 'report.pdf'
+    path.write_bytes(b'%PDF-1.3 ' + bytes(range(256)) * 40)
+    return str(path)
+
+
+def make_stub(request, statuses):
+    stub = CallbackStub(statuses)
+    request.addfinalizer(stub.close)
+    return stub
+
+
+def test_send_posts_fields_and_report(request, tmp_path, report):
+    stub = make_stub(request, [200])
+    delivery = Delivery(stub.url, str(tmp_path / 'outbox'))
+
+    assert delivery.send({'insert_id': 7, 'file_name': 'a_similarity_report.pdf'}, report) == 200
+    body, = stub.bodies
+    assert body['insert_id'] == 7 and body['file_name'] == 'a_similarity_report.pdf'
+    with open(report, 'rb') as f:
+        assert base64.b64decode(body['file_data']) == f.read()
+    assert delivery.pending() == []
+
+
+def test_pending_callback_is_replayed_after_restart(request, tmp_path, report):
+    stub = make_stub(request, [503, 200])
+    outbox = str(tmp_path / 'outbox')
+
+    assert Delivery(stub.url, outbox, backoff=0).send({'insert_id': 7}, report) is None
+    # The report may be replaced before the replay; the entry keeps its own copy
+    with open(report, 'rb') as f:
+        sent = f.read()
+    with open(report, 'wb') as f:
+        f.write(b'another job')
+
+    restarted = Delivery(stub.url, outbox, backoff=0)
+    assert restarted.replay() == 1
+    assert restarted.pending() == []
+    assert len(stub.bodies) == 2
+    assert base64.b64decode(stub.bodies[1]['file_data']) == sent
+
+
+def test_replay_waits_for_backoff(request, tmp_path, report):
+    stub = make_stub(request, [503, 200])
+    delivery = Delivery(stub.url, str(tmp_path / 'outbox'), backoff=3600)
+
+    assert delivery.send({'insert_id': 7}, report) is None
+    assert delivery.replay() == 0
+    assert len(stub.bodies) == 1 and len(delivery.pending()) == 1
+
+
+def test_gives_up_after_max_attempts(request, tmp_path, report):
+    stub = make_stub(request, [503])
+    delivery = Delivery(stub.url, str(tmp_path / 'outbox'), max_attempts=3, backoff=0)
+
+    assert delivery.send({'insert_id': 7}, report) is None
+    delivery.replay()
+    assert len(delivery.pending()) == 1
+    delivery.replay()
+    assert delivery.pending() == []
+    assert len(stub.bodies) == 3
+    assert sorted(name.rsplit('.', 1)[1] for name in os.listdir(delivery.failed_dir)) == ['json', 'pdf']
+
+
+def test_rejected_callback_is_not_retried(request, tmp_path, report):
+    stub = make_stub(request, [400])
+    delivery = Delivery(stub.url, str(tmp_path / 'outbox'), backoff=0)
+
+    assert delivery.send({'insert_id': 7}, report) == 400
+    assert delivery.replay() == 0
+    assert len(stub.bodies) == 1 and delivery.pending() == []
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from metrics import cache_lookup
+
+# Constants
+TEXT_CACHE_DIR = "text_cache/"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def normalize_text(text):
+    """
+    Collapse all whitespace runs to single spaces.
+    Tokenizing with split() gives the same words before and after normalization.
+    """
+    return " ".join(text.split()) if text else ""
+
+
+def text_sha256(text):
+    """Digest of normalized text, equal for documents whose text compares equal."""
+    return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomic_write(path, data, mode='w'):
+    """Write data to a temp file in the same directory and rename it over path."""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TextCache:
+    """
+    Content-addressed store of extracted, normalized document text.
+
+    Objects are stored as objects/<sha256 of file bytes>.txt. The manifest maps
+    each corpus file (by absolute path, however callers spell it) to the size,
+    mtime and hash it had when it was last seen, so an unchanged file is
+    resolved with one stat() and no re-hashing.
+    """
+
+    def __init__(self, cache_dir=TEXT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._batch_depth = 0
+        self._dirty = False
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Older manifests are keyed by the path as it was passed in
+        return {self._manifest_key(path): entry for path, entry in manifest.items()}
+
+    @staticmethod
+    def _manifest_key(file_path):
+        return os.path.abspath(file_path)
+
+    @contextmanager
+    def batch(self):
+        """Defer manifest writes until the block exits, for bulk ingestion."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._dirty:
+                    self._save_manifest()
+
+    def _save_manifest(self, removed=None):
+        if self._batch_depth and not removed:
+            self._dirty = True
+            return
+        self._dirty = False
+        # Worker processes share the manifest file, so merge what others wrote first
+        merged = self._load_manifest()
+        merged.update(self.manifest)
+        if removed:
+            merged.pop(removed, None)
+        self.manifest = merged
+        atomic_write(self.manifest_path, json.dumps(self.manifest))
+
+    def _object_path(self, sha256):
+        return os.path.join(self.objects_dir, f"{sha256}.txt")
+
+    def file_key(self, file_path):
+        """
+        Return the content hash of file_path.
+        The file is only re-hashed when its size or mtime differ from the manifest.
+        """
+        stat = os.stat(file_path)
+        key = self._manifest_key(file_path)
+        entry = self.manifest.get(key)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['sha256']
+
+        sha256 = file_sha256(file_path)
+        with self._lock:
+            self.manifest[key] = {
+                'sha256': sha256,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+            }
+            self._save_manifest()
+        return sha256
+
+    def get_text(self, file_path, extract):
+        """
+        Return the normalized text of file_path, calling extract(file_path) only
+        on a cache miss. Files that yield no text are cached as empty text so a
+        broken document is not re-parsed on every request.
+        """
+        sha256 = self.file_key(file_path)
+        text = self.cached_text(sha256)
+        cache_lookup('text_cache', hit=text is not None)
+        if text is not None:
+            return text
+
+        text = normalize_text(extract(file_path))
+        atomic_write(self._object_path(sha256), text)
+        return text
+
+    def cached_text(self, sha256):
+        """Return the cached text of the file with content hash sha256, or None."""
+        try:
+            with open(self._object_path(sha256), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def forget(self, file_path):
+        """Drop the manifest entry of a file that was removed or replaced."""
+        key = self._manifest_key(file_path)
+        with self._lock:
+            self.manifest.pop(key, None)
+            self._save_manifest(removed=key)
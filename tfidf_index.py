@@ -0,0 +1,265 @@
+import io
+import json
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+
+from text_cache import atomic_write
+
+# Constants
+TFIDF_DIR = "tfidf_index/"
+COMPACT_GARBAGE_RATIO = 0.5
+
+# Same tokenization as the TfidfVectorizer in files.py: lowercase, words of 2+ characters
+analyze = CountVectorizer().build_analyzer()
+
+
+class TfidfIndex:
+    """
+    Persistent TF-IDF vectors of the corpus for cosine screening.
+
+    Raw term counts are kept as a CSR matrix (one row per stored document)
+    against an append-only vocabulary, so adding a document never touches the
+    other rows. IDF weights use the same smoothed formula as scikit-learn and are
+    derived from the live rows' document frequencies when the matrix is loaded,
+    so an upload is scored against the whole corpus with one sparse
+    matrix-vector product.
+
+    Like TokenStore, only one process writes. Every save writes a new
+    generation of the matrix (counts.<gen>.npz) before index.json points to it,
+    and readers reload when index.json changes.
+    """
+
+    def __init__(self, index_dir=TFIDF_DIR):
+        self.index_dir = index_dir
+        self.index_path = os.path.join(index_dir, 'index.json')
+        self.vocab_path = os.path.join(index_dir, 'vocab.txt')
+        os.makedirs(index_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._batch_depth = 0
+        self._dirty = False
+        self._index = None
+        self._index_version_seen = None
+        self._vocab = None
+        self._counts = None
+        self._pending_rows = []
+        self._weights = None
+
+    # Reading
+
+    def _matrix_path(self, generation):
+        return os.path.join(self.index_dir, f"counts.{generation}.npz")
+
+    def _index_version(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self):
+        """Reload the index, vocabulary and count matrix if another process saved them."""
+        version = self._index_version()
+        if self._index is not None and version == self._index_version_seen:
+            return
+        if version is None:
+            index = {'generation': 0, 'rows': [], 'documents': {}}
+            counts = None
+        else:
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                counts = sp.load_npz(self._matrix_path(index['generation']))
+            except (OSError, ValueError, KeyError) as e:
+                # A newer generation replaced this one mid-read; keep what we have and retry next time
+                if self._index is not None:
+                    return
+                print(f"Failed to load the TF-IDF index: {e}")
+                index = {'generation': 0, 'rows': [], 'documents': {}}
+                counts = None
+                version = None
+        self._index = index
+        self._index_version_seen = version
+        self._vocab = None
+        self._load_vocab()
+        if counts is None:
+            counts = sp.csr_matrix((0, len(self._vocab)), dtype=np.float32)
+        self._counts = counts
+        self._pending_rows = []
+        self._weights = None
+
+    def _load_vocab(self):
+        if self._vocab is None:
+            self._vocab = {}
+            if os.path.exists(self.vocab_path):
+                with open(self.vocab_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        self._vocab[line.rstrip('\n')] = len(self._vocab)
+        return self._vocab
+
+    def _matrix(self):
+        """Count matrix including rows added in the current batch, as wide as the vocabulary."""
+        if self._pending_rows:
+            self._counts = sp.vstack([self._resize(self._counts)] + [self._resize(row) for row in self._pending_rows],
+                                     format='csr')
+            self._pending_rows = []
+        return self._resize(self._counts)
+
+    def _resize(self, matrix):
+        if matrix.shape[1] != len(self._vocab):
+            matrix = matrix.copy()
+            matrix.resize((matrix.shape[0], len(self._vocab)))
+        return matrix
+
+    def _live_rows(self):
+        return np.array([doc['row'] for doc in self._index['documents'].values()], dtype=np.int64)
+
+    def _weighted(self):
+        """(L2-normalized TF-IDF rows, idf, number of live documents), cached per generation."""
+        if self._weights is None:
+            counts = self._matrix()
+            live = self._live_rows()
+            num_docs = len(live)
+            df = np.bincount(counts[live].indices, minlength=counts.shape[1]) if num_docs else np.zeros(counts.shape[1])
+            idf = (np.log((1 + num_docs) / (1 + df)) + 1).astype(np.float32)
+            weighted = counts @ sp.diags(idf)
+            norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+            norms[norms == 0] = 1
+            self._weights = (sp.diags(1 / norms) @ weighted).tocsr(), idf, num_docs
+        return self._weights
+
+    def documents(self):
+        """Return {name: sha256} for every stored document."""
+        with self._lock:
+            self._refresh()
+            return {name: doc['sha256'] for name, doc in self._index['documents'].items()}
+
+    def has_document(self, name, sha256):
+        with self._lock:
+            self._refresh()
+            doc = self._index['documents'].get(name)
+            return doc is not None and doc['sha256'] == sha256
+
+    def top_candidates(self, text, k):
+        """
+        The k stored documents with the highest TF-IDF cosine similarity to text,
+        as [(name, cosine)], best first. Documents sharing no term are left out.
+        """
+        terms = Counter(analyze(text))
+        with self._lock:
+            self._refresh()
+            if not self._index['documents']:
+                return []
+            weighted, idf, num_docs = self._weighted()
+            rows = {doc['row']: name for name, doc in self._index['documents'].items()}
+
+        known = [(self._vocab[term], count) for term, count in terms.items() if term in self._vocab]
+        unseen = [count for term, count in terms.items() if term not in self._vocab]
+        query = np.zeros(weighted.shape[1], dtype=np.float32)
+        for column, count in known:
+            query[column] = count * idf[column]
+        # Terms no corpus document contains still count towards the upload's norm
+        unseen_idf = np.log(1 + num_docs) + 1
+        norm = np.sqrt(np.dot(query, query) + sum((count * unseen_idf) ** 2 for count in unseen))
+        if norm == 0:
+            return []
+
+        scores = weighted @ query / norm
+        order = np.argsort(-scores, kind='stable')
+        candidates = []
+        for row in order.tolist():
+            if scores[row] <= 0 or len(candidates) == k:
+                break
+            name = rows.get(row)
+            if name is not None:  # Rows of removed documents stay until compaction
+                candidates.append((name, float(scores[row])))
+        return candidates
+
+    # Writing (single writer)
+
+    @contextmanager
+    def batch(self):
+        """Save the matrix once when the block exits instead of after every document."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._dirty:
+                    self._save()
+
+    def _save(self):
+        if self._batch_depth:
+            self._dirty = True
+            return
+        self._dirty = False
+        counts = self._matrix()
+        old_generation = self._index['generation']
+        self._index['generation'] = old_generation + 1
+        buffer = io.BytesIO()
+        sp.save_npz(buffer, counts)
+        atomic_write(self._matrix_path(self._index['generation']), buffer.getvalue(), mode='wb')
+        atomic_write(self.index_path, json.dumps(self._index))
+        self._index_version_seen = self._index_version()
+        self._weights = None
+        old_path = self._matrix_path(old_generation)
+        if os.path.exists(old_path):
+            os.remove(old_path)
+
+    def add_document(self, name, sha256, text):
+        """Add or replace a document's term counts; a replaced row becomes garbage."""
+        terms = Counter(analyze(text))
+        with self._lock:
+            self._refresh()
+            vocab = self._load_vocab()
+            new_terms = [term for term in terms if term not in vocab]
+            for term in new_terms:
+                vocab[term] = len(vocab)
+            if new_terms:
+                with open(self.vocab_path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(term + '\n' for term in new_terms))
+
+            columns = np.array([vocab[term] for term in terms], dtype=np.int64)
+            values = np.array(list(terms.values()), dtype=np.float32)
+            order = np.argsort(columns)
+            row = sp.csr_matrix((values[order], columns[order], [0, len(columns)]), shape=(1, len(vocab)))
+            self._pending_rows.append(row)
+            self._index['rows'].append(name)
+            self._index['documents'][name] = {'sha256': sha256, 'row': len(self._index['rows']) - 1}
+            self._weights = None
+            self._save()
+
+    def remove_document(self, name):
+        with self._lock:
+            self._refresh()
+            if self._index['documents'].pop(name, None) is not None:
+                self._weights = None
+                self._save()
+
+    def garbage_ratio(self):
+        with self._lock:
+            self._refresh()
+            total = len(self._index['rows'])
+            return 1 - len(self._index['documents']) / total if total else 0
+
+    def compact(self):
+        """Drop the rows of removed and replaced documents."""
+        with self._lock:
+            self._refresh()
+            counts = self._matrix()
+            names = sorted(self._index['documents'], key=lambda name: self._index['documents'][name]['row'])
+            live = [self._index['documents'][name]['row'] for name in names]
+            self._counts = counts[live]
+            self._index['rows'] = names
+            self._index['documents'] = {
+                name: dict(self._index['documents'][name], row=row) for row, name in enumerate(names)
+            }
+            self._weights = None
+            self._save()
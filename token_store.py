@@ -0,0 +1,284 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+from text_cache import atomic_write
+
+# Constants
+TOKEN_STORE_DIR = "token_store/"
+COMPACT_GARBAGE_RATIO = 0.5
+SCAN_CHUNK_SIZE = 1 << 22  # shingles compared per step by documents_with
+
+
+class TokenStore:
+    """
+    Compact binary copy of every corpus document for matching without strings.
+
+    Each document is stored as its uint64 shingle hashes, appended to a flat
+    file that readers memory-map. Many worker processes can therefore share
+    the same pages. documents.json records, per document, its content hash,
+    the digest of its normalized text, its offset into the file and the
+    revision it was stored at. The revision counts every addition and removal;
+    removed_revision is the last one that removed or replaced a document, so a
+    reader can tell whether the corpus has only grown since a given revision.
+
+    Documents with the same normalized text share one copy of the array: the
+    first one stored is written and the others point to its offset.
+
+    Only one process writes (the one that ingests the corpus). The data file
+    carries a generation number, so compaction writes a new generation and
+    readers switch over when documents.json points to it.
+    """
+
+    def __init__(self, store_dir=TOKEN_STORE_DIR):
+        self.store_dir = store_dir
+        self.index_path = os.path.join(store_dir, 'documents.json')
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._batch_depth = 0
+        self._dirty = False
+        self._index = None
+        self._index_version_seen = None
+        self._shingles = None
+        self._text_owners = None
+
+    # Reading
+
+    def _data_path(self, kind, generation):
+        # Stores written before token ids were dropped also have tokens.<generation>.u32
+        suffix = 'u32' if kind == 'tokens' else 'u64'
+        return os.path.join(self.store_dir, f"{kind}.{generation}.{suffix}")
+
+    def _index_version(self):
+        # The index is always replaced by rename, so a new inode means a new version
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self):
+        """Reload the index and re-map the data file if another process changed them."""
+        version = self._index_version()
+        if self._index is not None and version == self._index_version_seen:
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {'generation': 0, 'documents': {}}
+        index.setdefault('revision', 0)
+        index.setdefault('removed_revision', 0)
+        self._index = index
+        self._index_version_seen = version
+        self._shingles = None
+        self._text_owners = None
+
+    def _map(self):
+        if self._shingles is None:
+            path = self._data_path('shingles', self._index['generation'])
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                self._shingles = np.empty(0, dtype=np.uint64)
+            else:
+                self._shingles = np.memmap(path, dtype=np.uint64, mode='r')
+        return self._shingles
+
+    def documents(self):
+        """Return {name: sha256} for every stored document."""
+        with self._lock:
+            self._refresh()
+            return {name: doc['sha256'] for name, doc in self._index['documents'].items()}
+
+    def has_document(self, name, sha256):
+        with self._lock:
+            self._refresh()
+            doc = self._index['documents'].get(name)
+            return doc is not None and doc['sha256'] == sha256
+
+    def get(self, name):
+        """
+        Return (text digest, shingle hashes) of a document, the hashes as a
+        read-only array view, or None if it is not stored.
+        """
+        with self._lock:
+            self._refresh()
+            doc = self._index['documents'].get(name)
+            if doc is None:
+                return None
+            shingles = self._map()
+        return doc['text_sha256'], shingles[doc['shingle_offset']:doc['shingle_offset'] + doc['shingle_count']]
+
+    def documents_with(self, shingles):
+        """
+        Return {name: (sha256, shingle hashes)} of the stored documents that
+        contain any of the given shingles. One pass over the mapped shingle
+        file, in chunks; only the matching documents are sliced out.
+        """
+        wanted = np.unique(np.asarray(list(shingles), dtype=np.uint64))
+        with self._lock:
+            self._refresh()
+            stored = self._map()
+            documents = dict(self._index['documents'])
+        by_range = defaultdict(list)  # documents with the same text share one range
+        for name, doc in documents.items():
+            if doc['shingle_count']:
+                by_range[doc['shingle_offset'], doc['shingle_count']].append(name)
+        if not len(wanted) or not by_range:
+            return {}
+
+        ranges = sorted(by_range)
+        starts = np.asarray([start for start, _ in ranges], dtype=np.int64)
+        ends = starts + np.asarray([count for _, count in ranges], dtype=np.int64)
+        found = set()
+        for chunk_start in range(0, len(stored), SCAN_CHUNK_SIZE):
+            chunk = np.asarray(stored[chunk_start:chunk_start + SCAN_CHUNK_SIZE])
+            slots = np.minimum(np.searchsorted(wanted, chunk), len(wanted) - 1)
+            hits = np.flatnonzero(wanted[slots] == chunk) + chunk_start
+            # Map hits to live ranges; replaced documents leave garbage between them
+            which = np.searchsorted(starts, hits, side='right') - 1
+            live = (which >= 0) & (hits < ends[np.maximum(which, 0)])
+            found.update(np.unique(which[live]).tolist())
+
+        result = {}
+        for i in sorted(found):
+            start, count = ranges[i]
+            for name in by_range[start, count]:
+                result[name] = (documents[name]['sha256'], stored[start:start + count])
+        return result
+
+    def version(self):
+        """Changes whenever the index is replaced (a document added, removed or compacted)."""
+        return self._index_version()
+
+    def read_all(self):
+        """
+        Return (version, index, shingles) read under one lock, so the index and
+        the mapped array belong together. index holds generation, revision,
+        removed_revision and {name: document record} as documents. version
+        changes whenever the index is replaced.
+        """
+        with self._lock:
+            self._refresh()
+            shingles = self._map()
+            index = dict(self._index, documents=dict(self._index['documents']))
+            return self._index_version_seen, index, shingles
+
+    # Writing (single writer)
+
+    @contextmanager
+    def batch(self):
+        """Publish the index once when the block exits instead of after every document."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._dirty:
+                    self._save_index()
+
+    def _next_revision(self, removes=False):
+        self._index['revision'] += 1
+        if removes:
+            self._index['removed_revision'] = self._index['revision']
+        return self._index['revision']
+
+    def _save_index(self):
+        if self._batch_depth:
+            self._dirty = True
+            return
+        self._dirty = False
+        atomic_write(self.index_path, json.dumps(self._index))
+        self._index_version_seen = self._index_version()
+        self._shingles = None
+
+    def _text_owner(self, text_sha256, exclude):
+        """Name of another stored document with this text, whose array can be shared."""
+        if self._text_owners is None:
+            self._text_owners = {}
+            for name, doc in self._index['documents'].items():
+                self._text_owners.setdefault(doc['text_sha256'], name)
+        owner = self._text_owners.get(text_sha256)
+        doc = self._index['documents'].get(owner)
+        if owner == exclude or doc is None or doc['text_sha256'] != text_sha256:
+            return None
+        return owner
+
+    def add_document(self, name, sha256, text_sha256, hashes):
+        """
+        Append a document; a previous version under the same name becomes garbage.
+        A document whose text is already stored only gets an index entry.
+        """
+        with self._lock:
+            self._refresh()
+            revision = self._next_revision(removes=name in self._index['documents'])
+            owner = self._text_owner(text_sha256, exclude=name)
+            if owner is not None:
+                shared = self._index['documents'][owner]
+                self._index['documents'][name] = dict(shared, sha256=sha256, revision=revision)
+                self._save_index()
+                return
+
+            shingles = np.asarray(hashes, dtype=np.uint64)
+            with open(self._data_path('shingles', self._index['generation']), 'ab') as f:
+                offset = f.tell() // shingles.itemsize
+                f.write(shingles.tobytes())
+            self._shingles = None
+            self._index['documents'][name] = {
+                'sha256': sha256,
+                'text_sha256': text_sha256,
+                'shingle_offset': offset,
+                'shingle_count': len(shingles),
+                'revision': revision,
+            }
+            self._text_owners[text_sha256] = name
+            self._save_index()
+
+    def remove_document(self, name):
+        with self._lock:
+            self._refresh()
+            if self._index['documents'].pop(name, None) is not None:
+                self._next_revision(removes=True)
+                # The removed document may have owned an array others share
+                self._text_owners = None
+                self._save_index()
+
+    def garbage_ratio(self):
+        with self._lock:
+            self._refresh()
+            shingles = self._map()
+            stored = {(doc['shingle_offset'], doc['shingle_count']) for doc in self._index['documents'].values()}
+            live = sum(count for _, count in stored)
+            return 1 - live / len(shingles) if len(shingles) else 0
+
+    def compact(self):
+        """Rewrite live documents into a new generation of the data file."""
+        with self._lock:
+            self._refresh()
+            old_generation = self._index['generation']
+            new_generation = old_generation + 1
+            shingles = self._map()
+            documents = {}
+            moved = {}  # old offset and count -> new offset, so shared arrays stay shared
+            with open(self._data_path('shingles', new_generation), 'wb') as shingle_file:
+                shingle_offset = 0
+                for name, doc in self._index['documents'].items():
+                    old_offset = (doc['shingle_offset'], doc['shingle_count'])
+                    if old_offset not in moved:
+                        shingle_file.write(shingles[doc['shingle_offset']:doc['shingle_offset'] + doc['shingle_count']].tobytes())
+                        moved[old_offset] = shingle_offset
+                        shingle_offset += doc['shingle_count']
+                    documents[name] = {key: value for key, value in doc.items() if not key.startswith('token_')}
+                    documents[name]['shingle_offset'] = moved[old_offset]
+            self._index = dict(self._index, generation=new_generation, documents=documents)
+            self._save_index()
+            # Readers that still map the old generation keep their pages until they refresh
+            for path in (self._data_path('tokens', old_generation), self._data_path('shingles', old_generation),
+                         os.path.join(self.store_dir, 'vocab.txt')):
+                if os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,95 @@
+import numpy as np
+
+from passages import select_passages
+
+
+def guaranteed_length(w, n=5):
+    """Shortest shared passage, in words, that winnowing always detects."""
+    return w + n - 1
+
+
+def winnow(hashes, w):
+    """
+    Positions of the fingerprints of a shingle hash sequence, ascending.
+
+    Winnowing (Schleimer, Wilkerson and Aiken; the algorithm behind MOSS) keeps
+    about 2 / (w + 1) of the shingles, yet two documents sharing a passage of at
+    least w + n - 1 words share that passage's windows and so at least one
+    fingerprint; shorter passages may be missed.
+
+    Each window of w hashes selects its minimum, the rightmost one on ties
+    (robust winnowing); a position selected by consecutive windows counts once.
+    Sequences shorter than a window keep their minimum.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    if len(hashes) == 0:
+        return np.empty(0, dtype=np.int64)
+    if len(hashes) <= w:
+        return np.array([len(hashes) - 1 - int(np.argmin(hashes[::-1]))])
+    windows = np.lib.stride_tricks.sliding_window_view(hashes, w)
+    rightmost = w - 1 - np.argmin(windows[:, ::-1], axis=1)
+    return np.unique(rightmost + np.arange(len(windows)))
+
+
+def match_fingerprints(source_positions, source_array, target_array, w, n=5, ignore=None):
+    """
+    Copied passages between the upload and one document, located by their
+    shared fingerprints, as (spans, similarity percentage, fragments) on the
+    scale of match_passages.
+
+    source_positions are the upload's fingerprints (winnow of source_array).
+    Fingerprints the document shares, at a constant offset between the two
+    documents, at most w shingles apart and with equal shingles between
+    them, belong to one copied passage,
+    which is then extended over the equal shingles around it. Source shingles
+    flagged in the boolean array ignore are neither matched nor extended over.
+    """
+    target_positions = winnow(target_array, w)
+    target_fingerprints = target_array[target_positions]
+    source_fingerprints = source_array[source_positions]
+    shared = np.isin(source_fingerprints, target_fingerprints)
+    if ignore is not None:
+        shared &= ~ignore[source_positions]
+    if not shared.any():
+        return [], 0, 0
+
+    # First target position of each shared fingerprint
+    order = np.argsort(target_fingerprints, kind='stable')
+    sources = source_positions[shared]
+    targets = target_positions[order[np.searchsorted(target_fingerprints, source_fingerprints[shared], sorter=order)]]
+
+    runs = []  # (source offset, target offset, shingles)
+    for i, j in zip(sources.tolist(), targets.tolist()):
+        if runs:
+            start_i, start_j, length = runs[-1]
+            end = start_i + length
+            # Only join over a gap whose shingles are equal too: with w > n an
+            # edited word can sit between two shared fingerprints
+            if (j - i == start_j - start_i and i - (end - 1) <= w
+                    and np.array_equal(source_array[end:i], target_array[end - start_i + start_j:j])):
+                runs[-1] = (start_i, start_j, i - start_i + 1)
+                continue
+        runs.append((i, j, 1))
+
+    if ignore is None:
+        ignore = np.zeros(len(source_array), dtype=bool)
+    # A passage's first and last fingerprints can be up to w - 1 shingles inside it
+    extended = []
+    for i, j, length in runs:
+        while i > 0 and j > 0 and source_array[i - 1] == target_array[j - 1] and not ignore[i - 1]:
+            i, j, length = i - 1, j - 1, length + 1
+        while (i + length < len(source_array) and j + length < len(target_array)
+               and source_array[i + length] == target_array[j + length] and not ignore[i + length]):
+            length += 1
+        # Fingerprints chained across a common shingle still make two passages
+        start = 0
+        for k in np.flatnonzero(ignore[i:i + length]).tolist() + [length]:
+            if k > start:
+                extended.append((i + start, j + start, k - start))
+            start = k + 1
+
+    spans = select_passages(extended, n)
+    fragments = sum(length // n for _, _, length in spans)
+    num_source_shingles = len(source_array)
+    similarity_percentage = (fragments / num_source_shingles) * 100 if num_source_shingles > 0 else 0
+    return spans, similarity_percentage, fragments
@@ -0,0 +1,21 @@
+"""
+WSGI entry point for production serving:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py preloads this module in the master, so the corpus is
+ingested once before the workers are forked and the workers share the
+imported modules copy-on-write. Checks that run inline (JOB_WORKERS=0) also
+share the master's corpus snapshot. By default checks run in job processes
+forked from each worker's fork server (see jobs.py), which imports main
+itself; those share the corpus through the token store's memory-mapped file
+and build their own snapshot of it. A coordinator (SHARD_URLS set) holds no
+corpus and skips this.
+"""
+import main
+
+if main.shard_client is None:
+    main.sync_corpus_index()
+    main.resident_corpus.refresh()
+
+app = main.app